@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Juju actions for the storpool-inventory charm: collect and submit
+some or all of the data on demand, fetch the hook profiling reports,
+show the recorded changes.
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+
+
+def action_sections(inventory):
+    """
+    Parse the "sections" action parameter into a list of collector names,
+    making sure that they are all known.
+    """
+    hookenv = inventory.hookenv
+    names = (hookenv.action_get('sections') or '').split()
+    known = [col.name for col in inventory.configured_collectors()]
+    unknown = sorted(set(names).difference(known))
+    if unknown:
+        raise ValueError('Unknown sections: {lst}; the known ones are: {kn}'
+                         .format(lst=' '.join(unknown),
+                                 kn=' '.join(known)))
+    return names
+
+
+def action_key(name):
+    """
+    Convert a collector name into a valid action output key.
+    """
+    return name.lower()
+
+
+def collect_now(inventory):
+    """
+    Run the specified collectors right away.
+    """
+    hookenv = inventory.hookenv
+    reactive = inventory.reactive
+    names = action_sections(inventory)
+    if not names:
+        names = [col.name for col in inventory.configured_collectors()]
+
+    inventory.spschedule.request(inventory.schedulefile, names)
+    reactive.remove_state('storpool-inventory.collected')
+    reactive.set_state('storpool-inventory.collecting')
+    start = time.monotonic()
+    inventory.collect()
+    duration = time.monotonic() - start
+    if not inventory.rhelpers.is_state('storpool-inventory.collected'):
+        hookenv.action_fail('The data collection failed')
+        return
+
+    meta = inventory.read_collected()['_meta']
+    results = {
+        'duration': '{d:.3f}'.format(d=duration),
+        'collected': ' '.join(meta['last_run']),
+        'changed': str(inventory.rhelpers.is_state(
+            'storpool-inventory.submitting')).lower(),
+    }
+    for name in meta['last_run']:
+        res = meta['collectors'][name]
+        prefix = 'timings.' + action_key(name) + '.'
+        results[prefix + 'duration'] = '{d:.3f}'.format(d=res['duration'])
+        results[prefix + 'returncode'] = str(res['returncode'])
+        results[prefix + 'bytes'] = str(res['stdout_bytes'])
+    hookenv.action_set(results)
+
+
+def submit_sections(inventory, names):
+    """
+    Send only the sections produced by the specified collectors.
+    """
+    config = inventory.hookenv.config()
+    url = config.get('submit_url', None)
+    if not url:
+        raise ValueError('No submit_url configured')
+    collected = inventory.read_collected()
+    if collected is None:
+        raise ValueError('No data has been collected yet')
+    sections = dict((key, collected[key])
+                    for name in names
+                    for key in (name + '.txt', name + '.err')
+                    if key in collected)
+    data = json.dumps({
+        'format': 'sections',
+        'filename': platform.node(),
+        'timestamp': collected.get('_meta', {}).get('timestamp'),
+        'sections': sections,
+    }).encode('latin1')
+
+    encoding = config.get('submit_encoding', 'legacy')
+    if encoding in ('gzip', 'zstd'):
+        (code, length, encoding) = inventory.spsubmit.post_compressed(
+            url, [data], encoding)
+    else:
+        (code, length) = (inventory.spsubmit.post(url, data), len(data))
+    return (code, length, len(sections))
+
+
+def submit_now(inventory):
+    """
+    Submit the collected data right away.
+    """
+    hookenv = inventory.hookenv
+    reactive = inventory.reactive
+    names = action_sections(inventory)
+    start = time.monotonic()
+    if names:
+        (code, length, count) = submit_sections(inventory, names)
+        duration = time.monotonic() - start
+        results = {
+            'code': str(code),
+            'bytes': str(length),
+            'sections': str(count),
+        }
+        if code is None or code < 200 or code >= 300:
+            hookenv.action_set(results)
+            hookenv.action_fail('The server responded with code {code}'
+                                .format(code=code))
+            return
+    else:
+        if not inventory.rhelpers.is_state('storpool-inventory.collected'):
+            hookenv.action_fail('No data has been collected yet')
+            return
+        inventory.spbackoff.forget(inventory.backofffile)
+        reactive.set_state('storpool-inventory.submitting')
+        reactive.remove_state('storpool-inventory.submitted')
+        inventory.try_to_submit()
+        duration = time.monotonic() - start
+        if inventory.rhelpers.is_state('storpool-inventory.sending'):
+            results = {'background': 'true'}
+        elif not inventory.rhelpers.is_state('storpool-inventory.submitted'):
+            hookenv.action_fail('The submission failed')
+            return
+        else:
+            results = {}
+    results['duration'] = '{d:.3f}'.format(d=duration)
+    hookenv.action_set(results)
+
+
+def get_profiles(inventory):
+    """
+    Return the summaries of the most recent hook handler profiles and
+    the paths to the raw cProfile statistics files.
+    """
+    hookenv = inventory.hookenv
+    count = hookenv.action_get('count') or 0
+    reports = inventory.spprofiling.reports(inventory.profiledir)
+    if count > 0:
+        reports = reports[-count:]
+
+    results = {'count': str(len(reports))}
+    for (idx, (timestamp, name, path)) in enumerate(reversed(reports)):
+        prefix = 'reports.{idx}.'.format(idx=idx + 1)
+        results[prefix + 'name'] = name
+        results[prefix + 'timestamp'] = '{ts:.6f}'.format(ts=timestamp)
+        results[prefix + 'file'] = path + '.prof'
+        try:
+            with open(path + '.txt', mode='r') as f:
+                results[prefix + 'summary'] = f.read()
+        except FileNotFoundError:
+            pass
+    if hookenv.action_get('clear'):
+        inventory.spprofiling.forget(inventory.profiledir)
+    hookenv.action_set(results)
+
+
+def show_history(inventory):
+    """
+    Show the changes in the collected output sections between two points
+    in time.
+    """
+    hookenv = inventory.hookenv
+    sphistory = inventory.sphistory
+    since = sphistory.parse_time(hookenv.action_get('from'))
+    until = sphistory.parse_time(hookenv.action_get('to'))
+    names = (hookenv.action_get('sections') or '').split()
+    (old_ts, new_ts, diffs) = sphistory.changes(inventory.historydir,
+                                                since, until)
+    if names:
+        keys = set(name + ext for name in names for ext in ('.txt', '.err'))
+        diffs = dict((key, value) for (key, value) in diffs.items()
+                     if key in keys)
+    hookenv.action_set({
+        'from': '{ts:.6f}'.format(ts=old_ts),
+        'to': '{ts:.6f}'.format(ts=new_ts),
+        'entries': str(len(sphistory.entries(inventory.historydir))),
+        'changed': ' '.join(sorted(diffs.keys())),
+        'diff': ''.join(diffs[key] for key in sorted(diffs.keys())),
+    })
+
+
+ACTIONS = {
+    'collect-now': collect_now,
+    'get-profiles': get_profiles,
+    'show-history': show_history,
+    'submit-now': submit_now,
+}
+
+
+def main():
+    charm_dir = os.environ.get('CHARM_DIR',
+                               os.path.dirname(os.path.dirname(
+                                   os.path.realpath(__file__))))
+    for path in (charm_dir, os.path.join(charm_dir, 'lib')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    from charms.layer import basic
+    basic.bootstrap_charm_deps()
+    basic.init_config_states()
+
+    from charmhelpers.core import hookenv
+    from charmhelpers.core import unitdata
+    from reactive import storpool_inventory_charm as inventory
+
+    name = os.path.basename(sys.argv[0])
+    action = ACTIONS.get(name)
+    if action is None:
+        hookenv.action_fail('Unknown action {name}'.format(name=name))
+        return
+    try:
+        action(inventory)
+    except Exception as e:
+        hookenv.action_fail('{name} failed: {e}'.format(name=name, e=e))
+    finally:
+        unitdata.kv().flush()
+
+
+if __name__ == '__main__':
+    main()
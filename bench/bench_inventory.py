@@ -0,0 +1,513 @@
+#!/usr/bin/python3
+
+"""
+Benchmark the storpool-inventory charm's collect() and try_to_submit()
+handlers end to end against fake tool binaries and a local HTTP server.
+
+The fake tools are placed in front of the search path; they produce
+large, realistic-looking output after a configurable delay. The wall
+time of each phase, the peak RSS of the process and its children, and
+the number of bytes sent to the server are compared against a recorded
+baseline, and the program exits with code 1 on a regression.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from http import server as http_server
+
+import mock
+
+root_path = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+for path in (root_path,
+             os.path.join(root_path, 'unit_tests', 'lib'),
+             os.path.join(root_path, 'lib')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from charmhelpers.core import hookenv  # noqa: E402
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        'baseline.json')
+
+# Relative tolerances before a metric is considered a regression
+TOLERANCES = {
+    'time': 0.5,
+    'rss': 0.25,
+    'bytes': 0.05,
+}
+
+# Absolute slack so that very small values are not too noisy
+SLACK = {
+    'time': 0.1,
+    'rss': 4096,
+    'bytes': 0,
+}
+
+# The delays of the fake tools in seconds, before scaling
+DELAYS = {
+    'dmidecode': 0.4,
+    'lshw': 1.5,
+    'lspci -vv': 0.6,
+    'lspci -vvnnqD': 0.6,
+    'lspci': 0.2,
+    'nvme list': 0.3,
+}
+
+FAKE_TOOL = """#!/bin/sh
+cmd="$(basename "$0")"
+if [ "$#" -gt 0 ]; then
+    cmd="$cmd $*"
+fi
+key="$(printf '%s' "$cmd" | tr -c 'A-Za-z0-9' '_')"
+if [ ! -f "$BENCH_FAKEDIR/out/$key" ]; then
+    echo "No canned output for '$cmd'" 1>&2
+    exit 1
+fi
+if [ -f "$BENCH_FAKEDIR/delay/$key" ]; then
+    sleep "$(cat "$BENCH_FAKEDIR/delay/$key")"
+fi
+exec cat "$BENCH_FAKEDIR/out/$key"
+"""
+
+FAKE_SUDO = """#!/bin/sh
+exec "$@"
+"""
+
+
+def gen_pci(functions):
+    """
+    Generate the output of the three lspci variants for a host with
+    a lot of SR-IOV virtual functions.
+    """
+    short, vv, vvnn = [], [], []
+    for idx in range(functions):
+        slot = '{bus:02x}:{dev:02x}.{fn:x}'.format(
+            bus=3 + idx // 256, dev=(idx // 8) % 32, fn=idx % 8)
+        name = 'Mellanox Technologies MT27710 Family [ConnectX-4 Lx ' \
+            'Virtual Function]'
+        short.append('{slot} Ethernet controller: {name}'
+                     .format(slot=slot, name=name))
+        details = [
+            '\tSubsystem: Mellanox Technologies Device 0003{ids}',
+            '\tControl: I/O- Mem+ BusMaster+ SpecCycle- MemWINV- '
+            'VGASnoop- ParErr- Stepping- SERR- FastB2B- DisINTx+',
+            '\tStatus: Cap+ 66MHz- UDF- FastB2B- ParErr- DEVSEL=fast '
+            '>TAbort- <TAbort- <MAbort- >SERR- <PERR- INTx-',
+            '\tLatency: 0',
+            '\tRegion 0: Memory at 3bffe{idx:07x} (64-bit, prefetchable) '
+            '[size=32M]',
+            '\tCapabilities: [60] Express (v2) Endpoint, MSI 00',
+            '\t\tDevCap:\tMaxPayload 512 bytes, PhantFunc 0, Latency L0s '
+            'unlimited, L1 unlimited',
+            '\t\t\tExtTag+ AttnBtn- AttnInd- PwrInd- RBE+ FLReset+ '
+            'SlotPowerLimit 0.000W',
+            '\t\tDevCtl:\tReport errors: Correctable- Non-Fatal- Fatal- '
+            'Unsupported-',
+            '\t\t\tRlxdOrd- ExtTag+ PhantFunc- AuxPwr- NoSnoop- FLReset-',
+            '\t\t\tMaxPayload 256 bytes, MaxReadReq 512 bytes',
+            '\t\tLnkCap:\tPort #0, Speed 8GT/s, Width x8, ASPM not '
+            'supported, Exit Latency L0s unlimited, L1 unlimited',
+            '\t\tLnkSta:\tSpeed unknown, Width x0, TrErr- Train- SlotClk- '
+            'DLActive- BWMgmt- ABWMgmt-',
+            '\tCapabilities: [9c] MSI-X: Enable+ Count=12 Masked-',
+            '\t\tVector table: BAR=0 offset=00002000',
+            '\t\tPBA: BAR=0 offset=00003000',
+            '\tCapabilities: [100 v1] Vendor Specific Information: '
+            'ID=0000 Rev=0 Len=00c <?>',
+            '\tCapabilities: [150 v1] Alternative Routing-ID '
+            'Interpretation (ARI)',
+            '\t\tARICap:\tMFVC- ACS-, Next Function: 0',
+            '\tKernel driver in use: mlx5_core',
+            '\tKernel modules: mlx5_core',
+            '',
+        ]
+        vv.append('{slot} Ethernet controller: {name}'
+                  .format(slot=slot, name=name))
+        vv.extend(line.format(ids='', idx=idx) for line in details)
+        vvnn.append('0000:{slot} Ethernet controller [0200]: {name} '
+                    '[15b3:1016]'.format(slot=slot, name=name))
+        vvnn.extend(line.format(ids=' [15b3:0003]', idx=idx)
+                    for line in details)
+    return ('\n'.join(short) + '\n', '\n'.join(vv) + '\n',
+            '\n'.join(vvnn) + '\n')
+
+
+def gen_lshw(functions):
+    """
+    Generate the output of lshw for the same host.
+    """
+    lines = [
+        'node1',
+        '    description: Rack Mount Chassis',
+        '    product: ProLiant DL380 Gen10 (868703-B21)',
+        '    vendor: HPE',
+        '    serial: CZJ00000000',
+        '    width: 64 bits',
+    ]
+    for idx in range(functions):
+        lines.extend([
+            '        *-network:{idx}'.format(idx=idx),
+            '             description: Ethernet interface',
+            '             product: MT27710 Family [ConnectX-4 Lx Virtual '
+            'Function]',
+            '             vendor: Mellanox Technologies',
+            '             physical id: {idx:x}'.format(idx=idx),
+            '             bus info: pci@0000:{bus:02x}:{dev:02x}.{fn:x}'
+            .format(bus=3 + idx // 256, dev=(idx // 8) % 32, fn=idx % 8),
+            '             logical name: enp3s0f0v{idx}'.format(idx=idx),
+            '             version: 00',
+            '             serial: 52:54:00:{a:02x}:{b:02x}:{c:02x}'
+            .format(a=idx >> 16 & 255, b=idx >> 8 & 255, c=idx & 255),
+            '             width: 64 bits',
+            '             clock: 33MHz',
+            '             capabilities: pciexpress msix bus_master cap_list '
+            'ethernet physical',
+            '             configuration: autonegotiation=off '
+            'broadcast=yes driver=mlx5_core driverversion=5.0-0 '
+            'firmware=14.26.1040 latency=0 link=no multicast=yes',
+            '             resources: iomemory:3bf0-3bef irq:0 '
+            'memory:3bffe000000-3bfffffffff',
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+def gen_ip(functions):
+    """
+    Generate the output of `ip address list` and `ip link list`.
+    """
+    addr, link = [], []
+    for idx in range(functions):
+        head = [
+            '{n}: enp3s0f0v{idx}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 9000 '
+            'qdisc mq state UP mode DEFAULT group default qlen 1000'
+            .format(n=idx + 2, idx=idx),
+            '    link/ether 52:54:00:{a:02x}:{b:02x}:{c:02x} '
+            'brd ff:ff:ff:ff:ff:ff'
+            .format(a=idx >> 16 & 255, b=idx >> 8 & 255, c=idx & 255),
+        ]
+        link.extend(head)
+        addr.extend(head)
+        addr.extend([
+            '    inet 10.{a}.{b}.{c}/16 brd 10.{a}.255.255 scope global '
+            'enp3s0f0v{idx}'.format(a=idx >> 16 & 255, b=idx >> 8 & 255,
+                                    c=idx & 255, idx=idx),
+            '       valid_lft forever preferred_lft forever',
+        ])
+    return '\n'.join(addr) + '\n', '\n'.join(link) + '\n'
+
+
+def gen_dmidecode():
+    """
+    Generate the output of dmidecode.
+    """
+    lines = ['# dmidecode 3.0', 'SMBIOS 3.1 present.', '']
+    for idx in range(96):
+        lines.extend([
+            'Handle 0x{h:04X}, DMI type 17, 40 bytes'.format(h=0x1000 + idx),
+            'Memory Device',
+            '\tTotal Width: 72 bits',
+            '\tData Width: 64 bits',
+            '\tSize: 32 GB',
+            '\tForm Factor: DIMM',
+            '\tLocator: PROC {p} DIMM {d}'.format(p=idx // 48 + 1,
+                                                  d=idx % 48 + 1),
+            '\tType: DDR4',
+            '\tSpeed: 2666 MT/s',
+            '\tManufacturer: HPE',
+            '\tSerial Number: {s:08X}'.format(s=0x12345678 + idx),
+            '\tPart Number: 840758-091',
+            '',
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+class FakeTools(object):
+    """
+    Create the fake tools and their canned output.
+    """
+    def __init__(self, topdir, functions, delay_scale):
+        self.topdir = topdir
+        self.bindir = os.path.join(topdir, 'bin')
+        os.mkdir(self.bindir)
+        os.mkdir(os.path.join(topdir, 'out'))
+        os.mkdir(os.path.join(topdir, 'delay'))
+
+        (lspci, lspci_vv, lspci_vvnn) = gen_pci(functions)
+        (ip_addr, ip_link) = gen_ip(functions)
+        lsblk = 'NAME MAJ:MIN RM SIZE RO TYPE MOUNTPOINT\n' + ''.join(
+            'sd{c} 8:{m} 0 3.7T 0 disk\n'.format(c=chr(97 + i), m=16 * i)
+            for i in range(24))
+        outputs = {
+            'dmidecode': gen_dmidecode(),
+            'free -m': 'Mem: 1 2 3\n',
+            'lsblk': lsblk,
+            'lspci': lspci,
+            'lspci -vv': lspci_vv,
+            'lspci -vvnnqD': lspci_vvnn,
+            'lshw': gen_lshw(functions),
+            'lscpu': 'Architecture: x86_64\nCPU(s): 96\n',
+            'lsmod': 'Module Size Used by\nmlx5_core 1 0\n',
+            'nvme list': 'Node SN Model\n',
+            'ls -l /dev/disk/by-id': 'total 0\n',
+            'ls -l /dev/disk/by-path': 'total 0\n',
+            'ls -l /sys/class/net': 'total 0\n',
+            'ip address list': ip_addr,
+            'ip -details address list': ip_addr,
+            'ip link list': ip_link,
+        }
+        tools = set()
+        for (cmd, output) in outputs.items():
+            key = ''.join(c if c.isalnum() else '_' for c in cmd)
+            with open(os.path.join(topdir, 'out', key), mode='w') as f:
+                f.write(output)
+            if cmd in DELAYS:
+                with open(os.path.join(topdir, 'delay', key),
+                          mode='w') as f:
+                    f.write('{d:.3f}\n'.format(d=DELAYS[cmd] * delay_scale))
+            tools.add(cmd.split()[0])
+
+        fake = os.path.join(topdir, 'fake-tool')
+        with open(fake, mode='w') as f:
+            f.write(FAKE_TOOL)
+        os.chmod(fake, 0o755)
+        for tool in tools:
+            os.symlink(fake, os.path.join(self.bindir, tool))
+        sudo = os.path.join(self.bindir, 'sudo')
+        with open(sudo, mode='w') as f:
+            f.write(FAKE_SUDO)
+        os.chmod(sudo, 0o755)
+
+    def environ(self):
+        return {
+            'PATH': self.bindir + ':' + os.environ.get('PATH', os.defpath),
+            'BENCH_FAKEDIR': self.topdir,
+        }
+
+
+class CountingHandler(http_server.BaseHTTPRequestHandler):
+    """
+    Accept the submissions, counting the bytes received.
+    """
+    received = 0
+    requests = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        type(self).received += len(self.requestline) + 2 + \
+            len(str(self.headers)) + len(body)
+        type(self).requests += 1
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(object):
+    """
+    Run a local HTTP server in a separate thread.
+    """
+    def __enter__(self):
+        CountingHandler.received = 0
+        CountingHandler.requests = 0
+        self.srv = http_server.HTTPServer(('127.0.0.1', 0), CountingHandler)
+        self.thread = threading.Thread(target=self.srv.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{port}/'.format(port=self.srv.server_port)
+        return self
+
+    def __exit__(self, *args):
+        self.srv.shutdown()
+        self.thread.join()
+        self.srv.server_close()
+
+    def reset(self):
+        CountingHandler.received = 0
+        CountingHandler.requests = 0
+
+
+class FakeReactive(object):
+    """
+    A minimal stand-in for the charms.reactive flags.
+    """
+    def __init__(self, states):
+        self.states = set(states)
+
+    def set_state(self, name):
+        self.states.add(name)
+
+    def remove_state(self, name):
+        self.states.discard(name)
+
+    def is_state(self, name):
+        return name in self.states
+
+
+def run_benchmarks(fakes, srv, datadir, encodings):
+    """
+    Time the collection and the submission with each encoding.
+    """
+    from reactive import storpool_inventory_charm as testee
+
+    olddir = testee.datadir
+    paths = dict((name, datadir + value[len(olddir):])
+                 for (name, value) in vars(testee).items()
+                 if isinstance(value, str) and value.startswith(olddir))
+    config = {
+        'submit_url': srv.url,
+        'native_collectors': False,
+    }
+    flags = FakeReactive(['storpool-inventory.collecting',
+                          'storpool-inventory.configured'])
+    metrics = {}
+
+    with mock.patch.multiple(testee, **paths), \
+            mock.patch.dict(os.environ, fakes.environ()), \
+            mock.patch.object(hookenv, 'config',
+                              new=lambda: mock.Mock(
+                                  get=lambda key, default=None:
+                                  config.get(key, default))), \
+            mock.patch('charms.reactive.set_state', new=flags.set_state), \
+            mock.patch('charms.reactive.remove_state',
+                       new=flags.remove_state), \
+            mock.patch('charms.reactive.helpers.is_state',
+                       new=flags.is_state), \
+            mock.patch('spinventory.packages.cache_valid',
+                       new=lambda path: True):
+        start = time.monotonic()
+        testee.collect()
+        metrics['collect_time'] = time.monotonic() - start
+        if 'storpool-inventory.collected' not in flags.states:
+            raise Exception('collect() failed')
+        metrics['collect_file_bytes'] = os.stat(testee.datafile).st_size
+        failed = sorted(name for (name, res) in
+                        testee.read_collected()['_meta']['collectors'].items()
+                        if res['returncode'] != 0)
+        if failed:
+            raise Exception('Some of the fake tools failed: {failed}'
+                            .format(failed=' '.join(failed)))
+
+        for encoding in encodings:
+            (config['submit_encoding'], _, binary) = encoding.partition('+')
+            config['submit_binary'] = binary == 'cbor'
+            srv.reset()
+            flags.set_state('storpool-inventory.submitting')
+            flags.remove_state('storpool-inventory.submitted')
+            start = time.monotonic()
+            testee.try_to_submit()
+            metrics['submit_{enc}_time'.format(
+                enc=encoding.replace('+', '_'))] = \
+                time.monotonic() - start
+            if 'storpool-inventory.submitted' not in flags.states:
+                raise Exception('try_to_submit() failed with the {enc} '
+                                'encoding'.format(enc=encoding))
+            metrics['submit_{enc}_bytes'.format(
+                enc=encoding.replace('+', '_'))] = \
+                CountingHandler.received
+
+    metrics['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics['peak_children_rss'] = \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return metrics
+
+
+def metric_kind(name):
+    """
+    Figure out which tolerance applies to a metric.
+    """
+    if name.endswith('_time'):
+        return 'time'
+    if name.endswith('_rss'):
+        return 'rss'
+    return 'bytes'
+
+
+def compare(metrics, baseline):
+    """
+    Compare the metrics to the baseline, return a list of regressions.
+    """
+    regressions = []
+    for (name, value) in sorted(metrics.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        kind = metric_kind(name)
+        limit = max(base * (1 + TOLERANCES[kind]), base + SLACK[kind])
+        if value > limit:
+            regressions.append('{name}: {value} > {limit:.3f} (baseline '
+                               '{base})'.format(name=name, value=value,
+                                                limit=limit, base=base))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the storpool-inventory charm')
+    parser.add_argument('--functions', type=int, default=1024,
+                        help='the number of PCI functions to simulate')
+    parser.add_argument('--delay-scale', type=float, default=1.0,
+                        help='the multiplier for the fake tool delays')
+    parser.add_argument('--encodings',
+                        default='legacy,gzip,legacy+cbor,gzip+cbor',
+                        help='the submission encodings to try, "+cbor" '
+                        'for a binary document')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='the baseline file to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='record the results as the new baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='storpool-inventory-bench.') \
+            as tempd:
+        fakedir = os.path.join(tempd, 'fake')
+        os.mkdir(fakedir)
+        datadir = os.path.join(tempd, 'data')
+        os.mkdir(datadir)
+        fakes = FakeTools(fakedir, args.functions, args.delay_scale)
+        with StandInServer() as srv:
+            metrics = run_benchmarks(fakes, srv, datadir,
+                                     args.encodings.split(','))
+
+    for (name, value) in sorted(metrics.items()):
+        if isinstance(value, float):
+            print('{name:<24} {value:12.3f}'.format(name=name, value=value))
+        else:
+            print('{name:<24} {value:12}'.format(name=name, value=value))
+
+    if args.save_baseline:
+        with open(args.baseline, mode='w') as f:
+            json.dump(dict((name, round(value, 3))
+                           for (name, value) in metrics.items()),
+                      f, indent=2, sort_keys=True)
+            print('', file=f)
+        print('Saved the baseline to {fname}'.format(fname=args.baseline))
+        return
+
+    try:
+        with open(args.baseline, mode='r') as f:
+            baseline = json.load(f)
+    except OSError:
+        print('No baseline at {fname}'.format(fname=args.baseline))
+        return
+
+    regressions = compare(metrics, baseline)
+    if regressions:
+        print('Regressions against {fname}:'.format(fname=args.baseline))
+        for line in regressions:
+            print('  ' + line)
+        sys.exit(1)
+    print('No regressions against {fname}'.format(fname=args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Helper routines for the storpool-inventory charm: running the collectors,
+storing and submitting the collected data.
+"""
@@ -0,0 +1,138 @@
+"""
+Keep track of the failed submission attempts and decide when to try
+again, backing off exponentially and spreading the units of a large
+deployment over time so that they do not all hit the server at once.
+"""
+
+import email.utils
+import json
+import os
+import random
+import time
+
+from spinventory import store as spstore
+
+
+RETRY_AFTER_CODES = (429, 503)
+
+
+def load_state(path):
+    """
+    Load the backoff state: the number of consecutive failures and
+    the earliest time of the next submission attempt.
+    """
+    try:
+        with open(path, mode='r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = None
+    if not isinstance(state, dict):
+        state = {}
+    state.setdefault('failures', 0)
+    state.setdefault('not_before', 0)
+    return state
+
+
+def save_state(path, state):
+    """
+    Store the backoff state.
+    """
+    spstore.atomic_write(path, json.dumps(state, sort_keys=True)
+                         .encode('utf-8'))
+
+
+def jitter(unit, attempt):
+    """
+    Return a number between 0 and 1 that is different for each unit and
+    attempt, but stays the same if recomputed in a later hook.
+    """
+    return random.Random('{unit}/{attempt}'.format(unit=unit,
+                                                   attempt=attempt)).random()
+
+
+def backoff_delay(failures, base, maximum, fraction):
+    """
+    Compute the delay after the specified number of consecutive failures:
+    half of the exponentially growing interval is fixed, the other half
+    is scaled by the jitter fraction.
+    """
+    if failures <= 0 or base <= 0:
+        return 0
+    interval = base * 2 ** min(failures - 1, 32)
+    if maximum > 0:
+        interval = min(interval, maximum)
+    return interval / 2 + interval / 2 * fraction
+
+
+def parse_retry_after(value, now=None):
+    """
+    Parse the value of a Retry-After header, either a number of seconds or
+    an HTTP date, into a number of seconds; return None if it is invalid.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0, parsed.timestamp() - now)
+
+
+def remaining(path, now=None):
+    """
+    Return the number of seconds until the next submission attempt is
+    allowed, or 0 if it may be made right away.
+    """
+    if now is None:
+        now = time.time()
+    return max(0, load_state(path)['not_before'] - now)
+
+
+def record_failure(path, unit, base, maximum, retry_after=None, now=None):
+    """
+    Note a failed submission attempt, return the number of seconds until
+    the next one; if the server asked for a specific delay, honour it and
+    only spread the units over another `base` seconds after it.
+    """
+    if now is None:
+        now = time.time()
+    state = load_state(path)
+    state['failures'] += 1
+    fraction = jitter(unit, state['failures'])
+    if retry_after is not None:
+        delay = retry_after + max(base, 0) * fraction
+    else:
+        delay = backoff_delay(state['failures'], base, maximum, fraction)
+    state['not_before'] = now + delay
+    save_state(path, state)
+    return delay
+
+
+def defer(path, unit, splay, now=None):
+    """
+    Forget any previous failures and put off the next submission attempt
+    by a per-unit part of `splay` seconds, e.g. after a configuration
+    change that affects all the units at once.
+    """
+    if now is None:
+        now = time.time()
+    delay = max(splay, 0) * jitter(unit, 0)
+    save_state(path, {'failures': 0, 'not_before': now + delay})
+    return delay
+
+
+def forget(path):
+    """
+    Remove the backoff state, e.g. after a successful submission.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,169 @@
+"""
+A minimal CBOR (RFC 8949) encoder and decoder for the submitted documents,
+so that the collected sections may be sent as raw bytes instead of
+escaped JSON strings; the cbor2 module is used if it is available.
+"""
+
+import struct
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+MAJOR_UINT = 0
+MAJOR_NEGINT = 1
+MAJOR_BYTES = 2
+MAJOR_TEXT = 3
+MAJOR_ARRAY = 4
+MAJOR_MAP = 5
+MAJOR_SIMPLE = 7
+
+SIMPLE_VALUES = {
+    20: False,
+    21: True,
+    22: None,
+}
+
+FLOAT_FORMATS = {
+    25: ('>e', 2),
+    26: ('>f', 4),
+    27: ('>d', 8),
+}
+
+
+def _head(major, value):
+    """
+    Encode the initial byte of a data item and its argument.
+    """
+    if value < 24:
+        return struct.pack('>B', major << 5 | value)
+    elif value < 0x100:
+        return struct.pack('>BB', major << 5 | 24, value)
+    elif value < 0x10000:
+        return struct.pack('>BH', major << 5 | 25, value)
+    elif value < 0x100000000:
+        return struct.pack('>BI', major << 5 | 26, value)
+    elif value < 0x10000000000000000:
+        return struct.pack('>BQ', major << 5 | 27, value)
+    raise ValueError('Integer too large to encode: {v}'.format(v=value))
+
+
+def _encode(value, write):
+    """
+    Encode a single value, passing the encoded parts to `write`.
+    """
+    if value is None:
+        write(b'\xf6')
+    elif value is True:
+        write(b'\xf5')
+    elif value is False:
+        write(b'\xf4')
+    elif isinstance(value, int):
+        if value >= 0:
+            write(_head(MAJOR_UINT, value))
+        else:
+            write(_head(MAJOR_NEGINT, -1 - value))
+    elif isinstance(value, float):
+        write(b'\xfb' + struct.pack('>d', value))
+    elif isinstance(value, (bytes, bytearray)):
+        write(_head(MAJOR_BYTES, len(value)))
+        write(bytes(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        write(_head(MAJOR_TEXT, len(data)))
+        write(data)
+    elif isinstance(value, (list, tuple)):
+        write(_head(MAJOR_ARRAY, len(value)))
+        for item in value:
+            _encode(item, write)
+    elif isinstance(value, dict):
+        write(_head(MAJOR_MAP, len(value)))
+        for (key, item) in value.items():
+            _encode(key, write)
+            _encode(item, write)
+    else:
+        raise TypeError('Cannot encode a {t} value'
+                        .format(t=type(value).__name__))
+
+
+def dumps(value):
+    """
+    Encode a value consisting of dictionaries, lists, strings, bytes,
+    numbers, booleans, and None.
+    """
+    if cbor2 is not None:
+        return cbor2.dumps(value)
+    parts = []
+    _encode(value, parts.append)
+    return b''.join(parts)
+
+
+def _decode(data, pos):
+    """
+    Decode a single data item starting at `pos`, return it and
+    the position right after it.
+    """
+    if pos >= len(data):
+        raise ValueError('Truncated CBOR data')
+    major = data[pos] >> 5
+    info = data[pos] & 0x1f
+    pos += 1
+    if major == MAJOR_SIMPLE:
+        if info in SIMPLE_VALUES:
+            return (SIMPLE_VALUES[info], pos)
+        elif info in FLOAT_FORMATS:
+            (fmt, size) = FLOAT_FORMATS[info]
+            if pos + size > len(data):
+                raise ValueError('Truncated CBOR data')
+            return (struct.unpack(fmt, data[pos:pos + size])[0], pos + size)
+        raise ValueError('Unsupported CBOR simple value {i}'.format(i=info))
+
+    if info < 24:
+        arg = info
+    elif info <= 27:
+        size = 1 << (info - 24)
+        if pos + size > len(data):
+            raise ValueError('Truncated CBOR data')
+        arg = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    else:
+        raise ValueError('Unsupported CBOR argument {i}'.format(i=info))
+
+    if major == MAJOR_UINT:
+        return (arg, pos)
+    elif major == MAJOR_NEGINT:
+        return (-1 - arg, pos)
+    elif major in (MAJOR_BYTES, MAJOR_TEXT):
+        if pos + arg > len(data):
+            raise ValueError('Truncated CBOR data')
+        value = bytes(data[pos:pos + arg])
+        if major == MAJOR_TEXT:
+            value = value.decode('utf-8')
+        return (value, pos + arg)
+    elif major == MAJOR_ARRAY:
+        res = []
+        for _ in range(arg):
+            (item, pos) = _decode(data, pos)
+            res.append(item)
+        return (res, pos)
+    elif major == MAJOR_MAP:
+        res = {}
+        for _ in range(arg):
+            (key, pos) = _decode(data, pos)
+            (res[key], pos) = _decode(data, pos)
+        return (res, pos)
+    raise ValueError('Unsupported CBOR major type {m}'.format(m=major))
+
+
+def loads(data):
+    """
+    Decode a value encoded by `dumps()`.
+    """
+    if cbor2 is not None:
+        return cbor2.loads(data)
+    (value, pos) = _decode(data, 0)
+    if pos != len(data):
+        raise ValueError('Trailing data after the CBOR value')
+    return value
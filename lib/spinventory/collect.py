@@ -0,0 +1,480 @@
+"""
+Run the system tools that collect the inventory data, each one as
+a separate process, several of them at a time.
+"""
+
+import collections
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from concurrent import futures
+
+from spinventory import derive as spderive
+from spinventory import native as spnative
+
+
+Collector = collections.namedtuple('Collector',
+                                   ['name', 'command', 'func', 'source'])
+Collector.__new__.__defaults__ = (None, None)
+Collector.__doc__ = """
+A single data collection command: its stdout and stderr are stored into
+the `<name>.txt` and `<name>.err` files respectively.
+If `func` is set, it is invoked instead of running the command.
+If `source` is also set, `func` is passed the output of the collector
+with that name and returns the output of this one.
+"""
+
+CollectorResult = collections.namedtuple('CollectorResult', [
+    'name',
+    'returncode',
+    'timed_out',
+    'timestamp',
+    'duration',
+    'stdout_bytes',
+    'stderr_bytes',
+])
+CollectorResult.__doc__ = """
+The outcome of running a single collector: its exit code, whether it was
+killed, when it was started, how many seconds it ran for, and how much
+output it produced.
+"""
+
+COLLECTORS = [
+    Collector('dmidecode', ['dmidecode']),
+    Collector('free-m', ['free', '-m']),
+    Collector('lsblk', ['lsblk']),
+    Collector('lspci', ['lspci']),
+    Collector('lspci-vv', ['lspci', '-vv']),
+    Collector('lspci-vvnnqD', ['lspci', '-vvnnqD']),
+    Collector('lshw', ['lshw']),
+    Collector('lscpu', ['lscpu']),
+    Collector('lsmod', ['lsmod']),
+    Collector('nvme-list', ['nvme', 'list']),
+    Collector('ls-dev-disk-by-id', ['ls', '-l', '/dev/disk/by-id']),
+    Collector('ls-dev-disk-by-path', ['ls', '-l', '/dev/disk/by-path']),
+    Collector('ls-sys-class-net', ['ls', '-l', '/sys/class/net']),
+    Collector('ip-address-list', ['ip', 'address', 'list']),
+    Collector('ip-link-list', ['ip', 'link', 'list']),
+]
+
+# Payload version 2 drops the sections that duplicate the data of
+# a richer tool invocation: `lspci -vvnnqD` has everything that `lspci`
+# and `lspci -vv` show, and `ip -details address list` has everything
+# that `ip address list` and `ip link list` show.
+PAYLOAD_VERSIONS = (1, 2)
+
+LEGACY_COLLECTORS = frozenset([
+    'ip-address-list',
+    'ip-link-list',
+    'lspci',
+    'lspci-vv',
+])
+
+V2_COLLECTORS = [
+    Collector('ip-details-address-list',
+              ['ip', '-details', 'address', 'list']),
+]
+
+# Appended to the sections that were cut short
+TRUNCATION_MARKER = \
+    '\n[truncated by storpool-inventory, {size} bytes in total]\n'
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 120
+
+# How long to wait for a killed collector to go away
+KILL_GRACE = 5
+
+
+def command_prefix():
+    """
+    Run the tools via sudo unless we are already running as root.
+    """
+    if os.geteuid() == 0:
+        return []
+    return ['sudo']
+
+
+def collectors(native=True, derive=True, version=1):
+    """
+    Return the list of collectors to run for the specified payload
+    version, replacing some of the tools with functions reading
+    the kernel interfaces directly and deriving some of the sections
+    from the output of other tools if requested.
+    """
+    if version == 1:
+        res = list(COLLECTORS)
+    elif version == 2:
+        res = [col for col in COLLECTORS
+               if col.name not in LEGACY_COLLECTORS] + V2_COLLECTORS
+    else:
+        raise ValueError('Unsupported payload version {v}'
+                         .format(v=version))
+
+    if native:
+        res = [col._replace(func=spnative.NATIVE_COLLECTORS[col.name])
+               if col.name in spnative.NATIVE_COLLECTORS else col
+               for col in res]
+    if derive:
+        names = set(col.name for col in res)
+        res = [col._replace(func=spderive.DERIVED_COLLECTORS[col.name][1],
+                            source=spderive.DERIVED_COLLECTORS[col.name][0])
+               if col.name in spderive.DERIVED_COLLECTORS and
+               spderive.DERIVED_COLLECTORS[col.name][0] in names else col
+               for col in res]
+    return res
+
+
+def run_native(col, workdir, timeout=None):
+    """
+    Run a collector function instead of an external tool.
+    The function runs in a thread of its own; if it does not return
+    within `timeout` seconds (e.g. blocked on a hung device), stop
+    waiting for it and record it as timed out. The thread cannot be
+    killed, so it is left to finish or to die with the process.
+    """
+    timestamp = time.time()
+    start = time.monotonic()
+    outcome = {}
+
+    def call():
+        try:
+            outcome['output'] = col.func()
+        except Exception as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=call, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    with open(os.path.join(workdir, col.name + '.txt'), mode='wb') as out, \
+            open(os.path.join(workdir, col.name + '.err'), mode='wb') as err:
+        if worker.is_alive():
+            err.write('timed out after {t} seconds\n'
+                      .format(t=timeout).encode('utf-8'))
+            return collector_result(col, None, True, timestamp, start,
+                                    out, err)
+        if 'error' in outcome:
+            err.write('{e}\n'.format(e=outcome['error']).encode('utf-8'))
+            res = 1
+        else:
+            out.write(outcome['output'].encode('utf-8'))
+            res = 0
+        return collector_result(col, res, False, timestamp, start, out, err)
+
+
+def run_derived(col, source, workdir):
+    """
+    Produce the output of a collector from that of its source collector,
+    also copying the source's error output and exit code.
+    """
+    timestamp = time.time()
+    start = time.monotonic()
+    with open(os.path.join(workdir, source.name + '.txt'), mode='rb') as f:
+        text = f.read().decode('latin1')
+    with open(os.path.join(workdir, source.name + '.err'), mode='rb') as f:
+        errors = f.read()
+    with open(os.path.join(workdir, col.name + '.txt'), mode='wb') as out, \
+            open(os.path.join(workdir, col.name + '.err'), mode='wb') as err:
+        try:
+            out.write(col.func(text).encode('latin1'))
+            err.write(errors)
+        except Exception as e:
+            err.write('could not derive from {src}: {e}\n'
+                      .format(src=source.name, e=e).encode('latin1'))
+            return collector_result(col, 1, False, timestamp, start,
+                                    out, err)
+        return collector_result(col, source.returncode, source.timed_out,
+                                timestamp, start, out, err)
+
+
+def collector_result(col, returncode, timed_out, timestamp, start, out, err):
+    """
+    Build the result of a collector run, recording its output size.
+    """
+    out.flush()
+    err.flush()
+    return CollectorResult(name=col.name, returncode=returncode,
+                           timed_out=timed_out, timestamp=timestamp,
+                           duration=time.monotonic() - start,
+                           stdout_bytes=os.fstat(out.fileno()).st_size,
+                           stderr_bytes=os.fstat(err.fileno()).st_size)
+
+
+def parse_timeouts(spec):
+    """
+    Parse a "name=seconds name=seconds..." list of per-collector time
+    budgets into a dictionary.
+    """
+    res = {}
+    for item in (spec or '').split():
+        name, sep, value = item.partition('=')
+        if not sep or not name:
+            raise ValueError('Invalid collector timeout specification '
+                             '"{item}"'.format(item=item))
+        try:
+            res[name] = float(value)
+        except ValueError:
+            raise ValueError('Invalid timeout value for the "{name}" '
+                             'collector: "{value}"'
+                             .format(name=name, value=value))
+    return res
+
+
+def kill_collector(proc):
+    """
+    Kill a collector process along with anything it may have spawned;
+    return False if it could not be reaped within a few seconds, e.g.
+    stuck in an uninterruptible I/O wait on a hung device, in which
+    case it is abandoned.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
+    try:
+        proc.wait(timeout=KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+def run_collector(col, workdir, timeout=None):
+    """
+    Run a single collector, storing its output into the working directory.
+    If it runs for more than `timeout` seconds, kill it.
+    """
+    if col.func is not None:
+        return run_native(col, workdir, timeout)
+    timestamp = time.time()
+    start = time.monotonic()
+    with open(os.path.join(workdir, col.name + '.txt'), mode='wb') as out, \
+            open(os.path.join(workdir, col.name + '.err'), mode='wb') as err:
+        try:
+            proc = subprocess.Popen(command_prefix() + col.command,
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=out, stderr=err, cwd=workdir,
+                                    start_new_session=True)
+        except OSError as e:
+            err.write('could not run {cmd}: {e}\n'
+                      .format(cmd=col.command[0], e=e).encode('latin1'))
+            return collector_result(col, 127, False, timestamp, start,
+                                    out, err)
+
+        try:
+            res = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            reaped = kill_collector(proc)
+            err.write('timed out after {t} seconds{stuck}\n'
+                      .format(t=timeout,
+                              stuck='' if reaped
+                              else ', could not be killed')
+                      .encode('latin1'))
+            return collector_result(col, proc.returncode if reaped else None,
+                                    True, timestamp, start, out, err)
+        return collector_result(col, res, False, timestamp, start, out, err)
+
+
+def run_collectors(collectors, workdir, concurrency=DEFAULT_CONCURRENCY,
+                   timeout=DEFAULT_TIMEOUT, timeouts=None):
+    """
+    Run the specified collectors, at most `concurrency` of them at a time,
+    and return a list of their results in the same order.
+    Each collector is killed if it runs for longer than its entry in
+    the `timeouts` dictionary or, failing that, `timeout` seconds.
+    The derived collectors are processed after the others; if their
+    source is not among the collectors, their command is run instead.
+    """
+    if timeouts is None:
+        timeouts = {}
+    names = set(col.name for col in collectors)
+    collectors = [col._replace(func=None, source=None)
+                  if col.source is not None and col.source not in names
+                  else col
+                  for col in collectors]
+    direct = [col for col in collectors if col.source is None]
+    workers = max(1, min(concurrency, len(direct)))
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs = [(col.name, pool.submit(run_collector, col, workdir,
+                                       timeouts.get(col.name, timeout)))
+                for col in direct]
+        results = dict((name, job.result()) for (name, job) in jobs)
+    for col in collectors:
+        if col.source is not None:
+            results[col.name] = run_derived(col, results[col.source],
+                                            workdir)
+    return [results[col.name] for col in collectors]
+
+
+def build_meta(results, duration, previous=None):
+    """
+    Build the `_meta` section of the collected data: the timing and
+    size information for each collector, keeping the entries of any
+    collectors that were not run this time from the `previous` one.
+    """
+    collectors = {}
+    if previous is not None:
+        collectors.update(previous.get('collectors', {}))
+    for res in results:
+        collectors[res.name] = {
+            'returncode': res.returncode,
+            'timed_out': res.timed_out,
+            'timestamp': res.timestamp,
+            'duration': round(res.duration, 3),
+            'stdout_bytes': res.stdout_bytes,
+            'stderr_bytes': res.stderr_bytes,
+        }
+    return {
+        'timestamp': time.time(),
+        'duration': round(duration, 3),
+        'collectors': collectors,
+        'last_run': sorted(res.name for res in results),
+    }
+
+
+def summarize(results, duration):
+    """
+    Summarize a collection run for the unit's workload status.
+    """
+    summary = 'collected {n} sections in {d:.1f}s' \
+        .format(n=len(results), d=duration)
+    if results:
+        slowest = max(results, key=lambda res: res.duration)
+        summary += ', slowest: {name} {d:.1f}s' \
+            .format(name=slowest.name, d=slowest.duration)
+    timed_out = [res.name for res in results if res.timed_out]
+    if timed_out:
+        summary += ', timed out: {lst}'.format(lst=' '.join(timed_out))
+    return summary
+
+
+def truncation_marker(size):
+    """
+    Build the marker appended to a section that was cut short.
+    """
+    return TRUNCATION_MARKER.format(size=size)
+
+
+def truncate_text(text, max_bytes, size=None):
+    """
+    Cut a section down to at most `max_bytes` characters including
+    the truncation marker, preferably at a line boundary.
+    """
+    if size is None:
+        size = len(text)
+    marker = truncation_marker(size)
+    keep = max(0, max_bytes - len(marker))
+    text = text[:keep]
+    eol = text.rfind('\n')
+    if eol >= 0:
+        text = text[:eol + 1]
+    return text + marker
+
+
+def read_section(path, max_bytes=0):
+    """
+    Read a single output file in one go, but no more than `max_bytes`
+    characters of it if that is positive; return the text and the size
+    of the whole file.
+    """
+    with open(path, mode='r', encoding='latin1') as f:
+        size = os.fstat(f.fileno()).st_size
+        if max_bytes <= 0 or size <= max_bytes:
+            return (f.read(), size)
+        return (truncate_text(f.read(max_bytes), max_bytes, size), size)
+
+
+def read_sections(workdir, max_bytes=0):
+    """
+    Read the collected output files into a dictionary keyed by filename,
+    cutting each of them down to `max_bytes` characters if that is
+    positive.
+    """
+    collected = {}
+    for e in os.scandir(workdir):
+        if not e.is_file():
+            continue
+        (collected[e.name], _) = read_section(e.path, max_bytes)
+    return collected
+
+
+def truncated_sections(results, max_bytes):
+    """
+    Return a dictionary mapping the names of the output files that
+    `read_sections()` cut short to their original sizes.
+    """
+    if max_bytes <= 0:
+        return {}
+    res = {}
+    for col in results:
+        for (ext, size) in (('.txt', col.stdout_bytes),
+                            ('.err', col.stderr_bytes)):
+            if size > max_bytes:
+                res[col.name + ext] = size
+    return res
+
+
+def encoded_length(value):
+    """
+    Return the length of the JSON representation of a section.
+    """
+    return len(json.dumps(value))
+
+
+def truncate_encoded(text, max_encoded, size):
+    """
+    Cut a section down so that its JSON representation, including
+    the truncation marker, is no longer than `max_encoded` characters,
+    or as short as it may get.
+    """
+    marker_length = len(truncation_marker(size))
+    limit = len(text)
+    while True:
+        res = truncate_text(text, limit, size)
+        encoded = encoded_length(res)
+        over = encoded - max_encoded
+        if over <= 0 or len(res) <= marker_length:
+            return res
+        # Escaped characters take up more than one character each, so
+        # convert the overshoot back into raw characters.
+        limit = min(limit, len(res)) - \
+            max(1, over * len(res) // encoded)
+
+
+def fit_payload(collected, max_bytes, truncated):
+    """
+    Cut the largest output sections down until the JSON representation
+    of the collected data is no longer than `max_bytes` characters,
+    recording the original sizes of the sections in `truncated`;
+    return the JSON representation.
+    """
+    data = json.dumps(collected)
+    if max_bytes <= 0:
+        return data
+    while len(data) > max_bytes:
+        sections = sorted(
+            ((encoded_length(value), name)
+             for (name, value) in collected.items()
+             if name.endswith(('.txt', '.err')) and isinstance(value, str)),
+            reverse=True)
+        excess = len(data) - max_bytes
+        shrunk = False
+        for (length, name) in sections:
+            size = truncated.get(name, len(collected[name]))
+            text = truncate_encoded(collected[name], length - excess, size)
+            saved = length - encoded_length(text)
+            if saved <= 0:
+                continue
+            collected[name] = text
+            truncated[name] = size
+            shrunk = True
+            excess -= saved
+            if excess <= 0:
+                break
+        if not shrunk:
+            break
+        data = json.dumps(collected)
+    return data
@@ -0,0 +1,157 @@
+"""
+Keep track of the content hashes of the collected data sections so that
+only the changed ones need to be submitted.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+
+RE_FREE_ROW = re.compile(r'^(?P<label>\S+:)\s+(?P<total>\d+)\b.*$',
+                         re.MULTILINE)
+RE_IP_LIFETIMES = re.compile(r'^\s+valid_lft .*\n?', re.MULTILINE)
+
+
+def section_hash(value):
+    """
+    Compute the content hash of a single section of the collected data.
+    """
+    data = json.dumps(value, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def build_manifest(collected):
+    """
+    Compute the content hashes of all the sections of the collected data.
+    """
+    return dict((name, section_hash(value))
+                for (name, value) in collected.items())
+
+
+def manifest_id(manifest):
+    """
+    Compute a hash identifying the whole snapshot described by a manifest.
+    """
+    if manifest is None:
+        return None
+    return section_hash(manifest)
+
+
+def changed_sections(old, new):
+    """
+    Return the sorted names of the sections in the `new` manifest that
+    are not present in the `old` one or have different contents.
+    """
+    if old is None:
+        old = {}
+    return sorted(name for (name, value) in new.items()
+                  if old.get(name) != value)
+
+
+def removed_sections(old, new):
+    """
+    Return the sorted names of the sections that are only present in
+    the `old` manifest.
+    """
+    if old is None:
+        return []
+    return sorted(name for name in old if name not in new)
+
+
+def _free_totals(text):
+    """
+    Only keep the totals from the output of `free`.
+    """
+    return RE_FREE_ROW.sub(r'\g<label> \g<total>', text)
+
+
+def _without_lifetimes(text):
+    """
+    Drop the address lifetime countdowns from the output of `ip address`.
+    """
+    return RE_IP_LIFETIMES.sub('', text)
+
+
+# The sections that change all the time even if nothing happened to
+# the hardware or its configuration, and the way to get at their parts
+# that are worth resubmitting the data for.
+STABLE_PARTS = {
+    'free-m.txt': _free_totals,
+    'ip-address-list.txt': _without_lifetimes,
+    'ip-details-address-list.txt': _without_lifetimes,
+}
+
+
+def stable_manifest(collected):
+    """
+    Compute the content hashes of the data sections, ignoring
+    the metadata sections whose names start with an underscore and
+    the constantly changing values such as the used memory or
+    the remaining address lifetimes.
+    """
+    return dict((name, section_hash(STABLE_PARTS[name](value)
+                                    if name in STABLE_PARTS and
+                                    isinstance(value, str) else value))
+                for (name, value) in collected.items()
+                if not name.startswith('_'))
+
+
+def snapshot_changed(old, new):
+    """
+    Check whether any of the data sections differ in a meaningful way
+    between two snapshots.
+    """
+    return stable_manifest(old) != stable_manifest(new)
+
+
+def build_delta(filename, collected, manifest, previous):
+    """
+    Build a submission containing only the sections that have changed
+    since the `previous` manifest was submitted, along with the full
+    current manifest so that the server may reconstruct the snapshot.
+    """
+    return {
+        'format': 'delta',
+        'filename': filename,
+        'base': manifest_id(previous),
+        'manifest': manifest,
+        'sections': dict((name, collected[name])
+                         for name in changed_sections(previous, manifest)),
+        'removed': removed_sections(previous, manifest),
+    }
+
+
+def load_manifest(path):
+    """
+    Load a previously stored manifest, if there is one.
+    """
+    try:
+        with open(path, mode='r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict):
+        return None
+    return manifest
+
+
+def save_manifest(path, manifest):
+    """
+    Store the manifest of the last successfully submitted snapshot.
+    """
+    # Imported here, since the store uses our section_hash()
+    from spinventory import store as spstore
+    spstore.atomic_write(path, json.dumps(manifest, sort_keys=True)
+                         .encode('utf-8'))
+
+
+def forget_manifest(path):
+    """
+    Remove the stored manifest so that the next submission is a full one.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,27 @@
+"""
+Produce some of the collected data sections from the output of a richer
+tool invocation instead of running the tool again.
+"""
+
+import re
+
+
+RE_PROG_IF = re.compile(r' \(prog-if [0-9a-f]{2}(?: \[[^\]]*\])?\)$')
+
+
+def lspci_from_verbose(text):
+    """
+    Produce the output of `lspci` from that of `lspci -vv`: the device
+    lines are the same, except that verbose mode adds the programming
+    interface of the device class.
+    """
+    return ''.join(RE_PROG_IF.sub('', line) + '\n'
+                   for line in text.splitlines()
+                   if line and not line[0].isspace())
+
+
+# The sections that may be derived from another one: the name of
+# the source collector and the function converting its output.
+DERIVED_COLLECTORS = {
+    'lspci': ('lspci-vv', lspci_from_verbose),
+}
@@ -0,0 +1,132 @@
+"""
+Compute a stable fingerprint of a node's hardware so that the inventory
+server may be asked whether it already has the data of this exact node.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from spinventory import store as spstore
+
+
+RE_DMI_IDENTITY = re.compile(
+    r'^\s*(?P<key>Serial Number|UUID):\s*(?P<value>.*?)\s*$')
+
+# The values that some vendors fill in instead of a real serial number
+DMI_PLACEHOLDERS = frozenset([
+    '',
+    '0',
+    '0123456789',
+    '00000000-0000-0000-0000-000000000000',
+    'default string',
+    'none',
+    'not applicable',
+    'not present',
+    'not settable',
+    'not specified',
+    'system serial number',
+    'to be filled by o.e.m.',
+    'unknown',
+])
+
+
+def dmi_identity(text):
+    """
+    Return the sorted list of the serial numbers and UUIDs reported by
+    dmidecode, skipping the placeholder values.
+    """
+    res = set()
+    for line in text.splitlines():
+        m = RE_DMI_IDENTITY.match(line)
+        if m and m.group('value').lower() not in DMI_PLACEHOLDERS:
+            res.add('{key}: {value}'.format(key=m.group('key'),
+                                            value=m.group('value')))
+    return sorted(res)
+
+
+def stable_mac(mac):
+    """
+    Check whether a MAC address is a real, globally administered one,
+    not one made up by the driver or the network configuration.
+    """
+    try:
+        octets = [int(part, 16) for part in mac.split(':')]
+    except (AttributeError, ValueError):
+        return False
+    return len(octets) == 6 and any(octets) and not octets[0] & 0x03
+
+
+def hardware_identity(collected):
+    """
+    Extract the parts of the collected data that identify the hardware:
+    the DMI serial numbers, the PCI device IDs, the disk serial numbers,
+    and the MAC addresses of the network interfaces.
+    """
+    structured = collected.get('structured') or {}
+    return {
+        'dmi': dmi_identity(collected.get('dmidecode.txt', '')),
+        'pci': sorted(
+            '{slot} {vendor}:{device} {svendor}:{sdevice}'.format(
+                slot=dev.get('slot'),
+                vendor=dev.get('vendor_id'),
+                device=dev.get('device_id'),
+                svendor=dev.get('subsystem_vendor_id'),
+                sdevice=dev.get('subsystem_device_id'))
+            for dev in structured.get('pci', [])),
+        'disks': sorted(set(
+            disk['serial']
+            for disk in structured.get('disks', []) +
+            structured.get('nvme', [])
+            if disk.get('serial'))),
+        'macs': sorted(set(
+            nic['mac'].lower() for nic in structured.get('nics', [])
+            if stable_mac(nic.get('mac')))),
+    }
+
+
+def fingerprint(collected):
+    """
+    Compute the hardware fingerprint of the collected data, or return
+    None if there is nothing to identify the hardware by.
+    """
+    identity = hardware_identity(collected)
+    if not any(identity.values()):
+        return None
+    data = json.dumps(identity, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_acknowledged(path, url):
+    """
+    Return the fingerprint that the server at the specified URL was last
+    known to have, or None.
+    """
+    try:
+        with open(path, mode='r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('url') != url:
+        return None
+    return data.get('fingerprint')
+
+
+def save_acknowledged(path, url, value):
+    """
+    Remember that the server at the specified URL has the data with
+    the specified fingerprint.
+    """
+    spstore.atomic_write(path, json.dumps({'url': url, 'fingerprint': value})
+                         .encode('utf-8'))
+
+
+def forget(path):
+    """
+    Forget the fingerprint that the server was known to have.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,309 @@
+"""
+Keep a compact local history of the collected output sections: a full
+base snapshot and a series of entries, each one holding line-based diffs
+of the sections that changed since the previous one. The oldest entries
+are folded into the base as they expire.
+"""
+
+import calendar
+import difflib
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+
+from spinventory import delta as spdelta
+from spinventory import store as spstore
+
+
+RE_ENTRY = re.compile(r'^(?P<ts>[0-9]+\.[0-9]{6})\.json\.gz$')
+
+TIME_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+)
+
+
+def tracked_sections(collected):
+    """
+    Select the tool output sections, leaving out the metadata and
+    the parsed data that may be rebuilt from them.
+    """
+    return dict((name, value) for (name, value) in collected.items()
+                if name.endswith(('.txt', '.err')) and
+                isinstance(value, str))
+
+
+def line_diff(old, new):
+    """
+    Describe the changes between two texts as a list of [start, end,
+    lines] operations, each one replacing the old lines from `start` up
+    to `end` with the new ones.
+    """
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+
+    # Skip the common parts at both ends before handing the rest over
+    # to difflib, since most of the changes are small.
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and \
+            old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+    old_mid = old_lines[prefix:len(old_lines) - suffix]
+    new_mid = new_lines[prefix:len(new_lines) - suffix]
+
+    matcher = difflib.SequenceMatcher(None, old_mid, new_mid, autojunk=False)
+    return [[prefix + i1, prefix + i2, new_mid[j1:j2]]
+            for (tag, i1, i2, j1, j2) in matcher.get_opcodes()
+            if tag != 'equal']
+
+
+def apply_diff(old, ops):
+    """
+    Apply the operations produced by `line_diff()` to the old text.
+    """
+    old_lines = old.splitlines(True)
+    res = []
+    pos = 0
+    for (start, end, lines) in ops:
+        res.extend(old_lines[pos:start])
+        res.extend(lines)
+        pos = end
+    res.extend(old_lines[pos:])
+    return ''.join(res)
+
+
+def _write(path, data):
+    """
+    Atomically write a compressed JSON file.
+    """
+    spstore.atomic_write(path, gzip.compress(
+        json.dumps(data, sort_keys=True).encode('utf-8')))
+
+
+def _read(path):
+    """
+    Read a compressed JSON file.
+    """
+    with gzip.open(path, mode='rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def base_path(historydir):
+    """
+    Return the path to the base snapshot.
+    """
+    return os.path.join(historydir, 'base.json.gz')
+
+
+def head_path(historydir):
+    """
+    Return the path to the hashes of the most recent state.
+    """
+    return os.path.join(historydir, 'head.json')
+
+
+def entries(historydir):
+    """
+    Return a list of (timestamp, path) tuples for the history entries,
+    oldest first.
+    """
+    try:
+        names = os.listdir(os.path.join(historydir, 'entries'))
+    except FileNotFoundError:
+        return []
+    res = []
+    for name in names:
+        m = RE_ENTRY.match(name)
+        if m:
+            res.append((float(m.group('ts')),
+                        os.path.join(historydir, 'entries', name)))
+    return sorted(res)
+
+
+def load_base(historydir):
+    """
+    Return the base snapshot or None if there is no history yet.
+    """
+    try:
+        return _read(base_path(historydir))
+    except FileNotFoundError:
+        return None
+
+
+def load_head(historydir):
+    """
+    Return the timestamp and the section hashes of the most recent state.
+    """
+    try:
+        with open(head_path(historydir), mode='r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def apply_entry(sections, entry):
+    """
+    Update the sections with the changes recorded in a history entry.
+    """
+    for (name, ops) in entry['changed'].items():
+        sections[name] = apply_diff(sections.get(name, ''), ops)
+    for name in entry['removed']:
+        sections.pop(name, None)
+
+
+def state_at(historydir, timestamp=None):
+    """
+    Reconstruct the sections as they were at the specified time (the most
+    recent state by default); return the timestamp of the last change
+    before that and the sections, or (None, None) if there is no history
+    going back that far.
+    """
+    base = load_base(historydir)
+    if base is None or (timestamp is not None and
+                        timestamp < base['timestamp']):
+        return (None, None)
+    sections = base['sections']
+    last = base['timestamp']
+    for (ts, path) in entries(historydir):
+        if timestamp is not None and ts > timestamp:
+            break
+        apply_entry(sections, _read(path))
+        last = ts
+    return (last, sections)
+
+
+def record(historydir, collected, timestamp, previous=None):
+    """
+    Record the current output sections, storing the changes since
+    the last recorded state as a new entry; if `previous` matches that
+    state, use it instead of reconstructing it. Return the sorted names
+    of the changed sections, or None if a new base was started.
+    """
+    sections = tracked_sections(collected)
+    hashes = dict((name, spdelta.section_hash(value))
+                  for (name, value) in sections.items())
+    head = load_head(historydir)
+    if head is None or load_base(historydir) is None:
+        forget(historydir)
+        os.makedirs(os.path.join(historydir, 'entries'), mode=0o700,
+                    exist_ok=True)
+        _write(base_path(historydir),
+               {'timestamp': timestamp, 'sections': sections})
+        spstore.atomic_write(head_path(historydir), json.dumps(
+            {'timestamp': timestamp, 'hashes': hashes}).encode('us-ascii'))
+        return None
+
+    changed = spdelta.changed_sections(head['hashes'], hashes)
+    removed = spdelta.removed_sections(head['hashes'], hashes)
+    if not changed and not removed:
+        return []
+
+    old = None
+    if previous is not None:
+        old = tracked_sections(previous)
+        if any(spdelta.section_hash(old.get(name)) != head['hashes'][name]
+               for name in changed if name in head['hashes']):
+            old = None
+    if old is None:
+        (_, old) = state_at(historydir)
+
+    _write(os.path.join(historydir, 'entries',
+                        '{ts:.6f}.json.gz'.format(ts=timestamp)), {
+        'timestamp': timestamp,
+        'changed': dict((name, line_diff(old.get(name, ''), sections[name]))
+                        for name in changed),
+        'removed': removed,
+    })
+    spstore.atomic_write(head_path(historydir), json.dumps(
+        {'timestamp': timestamp, 'hashes': hashes}).encode('us-ascii'))
+    return sorted(changed + removed)
+
+
+def prune(historydir, max_entries, max_age, now=None):
+    """
+    Fold the entries beyond the `max_entries` most recent ones or older
+    than `max_age` seconds into the base snapshot; return their number.
+    """
+    if now is None:
+        now = time.time()
+    expired = entries(historydir)
+    first_kept = len(expired) - max_entries if max_entries > 0 else 0
+    expired = [(ts, path) for (idx, (ts, path)) in enumerate(expired)
+               if idx < first_kept or (max_age > 0 and ts < now - max_age)]
+    if not expired:
+        return 0
+
+    base = load_base(historydir)
+    for (ts, path) in expired:
+        apply_entry(base['sections'], _read(path))
+        base['timestamp'] = ts
+    _write(base_path(historydir), base)
+    for (_, path) in expired:
+        os.unlink(path)
+    return len(expired)
+
+
+def changes(historydir, since=None, until=None):
+    """
+    Compare the recorded states at two points in time (the oldest and
+    the most recent ones by default); return the actual timestamps of
+    the compared states and a unified diff of each changed section.
+    """
+    base = load_base(historydir)
+    if base is None:
+        raise ValueError('No history has been recorded yet')
+    if since is None or since < base['timestamp']:
+        since = base['timestamp']
+    (old_ts, old) = state_at(historydir, since)
+    (new_ts, new) = state_at(historydir, until)
+    if new is None:
+        raise ValueError('The oldest recorded state is from {ts:.0f}'
+                         .format(ts=base['timestamp']))
+
+    diffs = {}
+    for name in sorted(set(old).union(new)):
+        if old.get(name) == new.get(name):
+            continue
+        diffs[name] = ''.join(difflib.unified_diff(
+            old.get(name, '').splitlines(True),
+            new.get(name, '').splitlines(True),
+            fromfile='{name}@{ts:.0f}'.format(name=name, ts=old_ts),
+            tofile='{name}@{ts:.0f}'.format(name=name, ts=new_ts)))
+    return (old_ts, new_ts, diffs)
+
+
+def parse_time(value):
+    """
+    Parse a point in time specified either as seconds since the epoch or
+    as a UTC date and optional time, e.g. "2024-03-01T12:00".
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in TIME_FORMATS:
+        try:
+            return float(calendar.timegm(time.strptime(value, fmt)))
+        except ValueError:
+            pass
+    raise ValueError('Invalid time specification "{v}"'.format(v=value))
+
+
+def forget(historydir):
+    """
+    Remove the whole history.
+    """
+    shutil.rmtree(historydir, ignore_errors=True)
@@ -0,0 +1,136 @@
+"""
+Let udev record the block device and network interface hotplug events so
+that only the affected sections need to be collected again.
+"""
+
+import os
+import subprocess
+
+from spinventory import store as spstore
+
+
+RULES_FILE = '/etc/udev/rules.d/90-storpool-inventory.rules'
+
+# The collectors whose output may change after an event in each subsystem
+SUBSYSTEM_COLLECTORS = {
+    'block': [
+        'ls-dev-disk-by-id',
+        'ls-dev-disk-by-path',
+        'lsblk',
+        'nvme-list',
+    ],
+    'nvme': [
+        'ls-dev-disk-by-id',
+        'ls-dev-disk-by-path',
+        'lsblk',
+        'nvme-list',
+    ],
+    'net': [
+        'ip-address-list',
+        'ip-details-address-list',
+        'ip-link-list',
+        'ls-sys-class-net',
+    ],
+}
+
+RULE_TEMPLATE = """# Installed by the storpool-inventory charm, do not edit.
+ACTION=="add|remove", SUBSYSTEM=="block|nvme", RUN+="/bin/sh -c 'echo $env{{ACTION}} $env{{SUBSYSTEM}} $kernel >> {queue}'"
+ACTION=="add|remove|move", SUBSYSTEM=="net", RUN+="/bin/sh -c 'echo $env{{ACTION}} $env{{SUBSYSTEM}} $kernel >> {queue}'"
+"""  # noqa: E501
+
+
+def udev_rules(queuefile):
+    """
+    Build the udev rules appending the events to the queue file.
+    """
+    return RULE_TEMPLATE.format(queue=queuefile)
+
+
+def reload_udev():
+    """
+    Make udev notice the changed rules, ignoring any errors.
+    """
+    try:
+        subprocess.call(['udevadm', 'control', '--reload'],
+                        stdin=subprocess.DEVNULL)
+    except OSError:
+        pass
+
+
+def install_rules(path, queuefile):
+    """
+    Install the udev rules unless they are already in place; return
+    True if the rules file was changed.
+    """
+    contents = udev_rules(queuefile)
+    try:
+        with open(path, mode='r') as f:
+            if f.read() == contents:
+                return False
+    except FileNotFoundError:
+        pass
+    spstore.atomic_write(path, contents.encode('utf-8'))
+    return True
+
+
+def remove_rules(path):
+    """
+    Remove the udev rules; return True if they were installed.
+    """
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _read_events(path):
+    """
+    Read and remove a file containing recorded events.
+    """
+    try:
+        with open(path, mode='r', encoding='latin1') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    os.unlink(path)
+    return [tuple(fields) for fields in (line.split() for line in lines)
+            if len(fields) == 3]
+
+
+def take_events(queuefile):
+    """
+    Return and forget the recorded events as (action, subsystem, device)
+    tuples, oldest first; move the queue file out of the way first so that
+    no events recorded in the meantime are lost.
+    """
+    processing = queuefile + '.processing'
+    # Anything left over from a hook that failed halfway through
+    events = _read_events(processing)
+    try:
+        os.rename(queuefile, processing)
+    except FileNotFoundError:
+        return events
+    return events + _read_events(processing)
+
+
+def affected_collectors(events, names):
+    """
+    Return the sorted names of the collectors among `names` whose output
+    may have changed after the specified events.
+    """
+    affected = set()
+    for (_, subsystem, _) in events:
+        affected.update(SUBSYSTEM_COLLECTORS.get(subsystem, []))
+    return sorted(affected.intersection(names))
+
+
+def forget(queuefile):
+    """
+    Remove the queue of events.
+    """
+    for path in (queuefile, queuefile + '.processing'):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,266 @@
+"""
+Parse the output of some of the collectors into compact typed records
+describing the disks, NVMe namespaces, PCI devices and network interfaces.
+"""
+
+import re
+
+
+# The NVMeNamespace fields and the `nvme list` columns they come from
+NVME_LIST_COLUMNS = {
+    'node': 'Node',
+    'serial': 'SN',
+    'model': 'Model',
+    'namespace': 'Namespace',
+    'usage': 'Usage',
+    'format': 'Format',
+    'firmware': 'FW Rev',
+}
+
+RE_TREE_PREFIX = re.compile(r'^[^0-9A-Za-z]*')
+RE_PCI_HEADER = re.compile(
+    r'^(?P<slot>\S+) (?P<cls>.*?) \[(?P<cls_id>[0-9a-f]{4})\]: '
+    r'(?P<name>.*?) \[(?P<vendor_id>[0-9a-f]{4}):(?P<device_id>[0-9a-f]{4})\]'
+    r'(?: \(rev (?P<rev>[0-9a-f]+)\))?')
+RE_PCI_SUBSYSTEM = re.compile(
+    r'^\s+Subsystem: .*\[(?P<vendor_id>[0-9a-f]{4}):'
+    r'(?P<device_id>[0-9a-f]{4})\]\s*$')
+RE_PCI_DRIVER = re.compile(r'^\s+Kernel driver in use: (?P<driver>\S+)')
+RE_IP_LINK = re.compile(
+    r'^\d+: (?P<name>[^:@\s]+)(?:@\S+)?: <(?P<flags>[^>]*)>'
+    r'.*? mtu (?P<mtu>\d+)(?:.* state (?P<state>\S+))?')
+RE_IP_LINKADDR = re.compile(r'^\s+link/\S+ (?P<mac>[0-9a-f:]+)')
+RE_IP_ADDR = re.compile(r'^\s+inet6? (?P<addr>\S+)')
+
+
+class Record(object):
+    """
+    The base class for the inventory records: a simple attribute holder.
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unexpected {cls} fields: {names}'
+                            .format(cls=type(self).__name__,
+                                    names=' '.join(sorted(kwargs))))
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return '{cls}({fields})'.format(
+            cls=type(self).__name__,
+            fields=', '.join('{n}={v!r}'.format(n=name, v=getattr(self, name))
+                             for name in self.__slots__))
+
+
+class Disk(Record):
+    __slots__ = ('name', 'size', 'model', 'serial', 'by_id')
+
+
+class NVMeNamespace(Record):
+    __slots__ = ('node', 'serial', 'model', 'namespace', 'usage', 'format',
+                 'firmware')
+
+
+class PCIDevice(Record):
+    __slots__ = ('slot', 'cls', 'cls_id', 'name', 'vendor_id', 'device_id',
+                 'subsystem_vendor_id', 'subsystem_device_id', 'rev',
+                 'driver')
+
+
+class NIC(Record):
+    __slots__ = ('name', 'mac', 'mtu', 'state', 'addresses')
+
+
+def parse_disk_links(text):
+    """
+    Parse the output of `ls -l /dev/disk/by-id` into a dictionary
+    mapping kernel device names to the sorted list of their links.
+    """
+    res = {}
+    for line in text.splitlines():
+        (link, sep, target) = line.partition(' -> ')
+        if not sep:
+            continue
+        name = link.split()[-1]
+        res.setdefault(target.split('/')[-1], []).append(name)
+    for links in res.values():
+        links.sort()
+    return res
+
+
+def split_disk_id(link):
+    """
+    Split a "bus-Model_Name_Serial" disk identifier as generated by udev
+    into the model name and the serial number.
+    """
+    (bus, sep, ident) = link.partition('-')
+    if not sep or bus not in ('ata', 'nvme', 'scsi', 'usb') or \
+       ident.startswith('0x') or '_' not in ident:
+        return (None, None)
+    if bus == 'scsi' and ident[:1].isdigit():
+        ident = ident[1:]
+    (model, _, serial) = ident.rpartition('_')
+    for prefix in ('SATA_', 'ATA_'):
+        if model.startswith(prefix):
+            model = model[len(prefix):]
+    return (model.replace('_', ' '), serial)
+
+
+def parse_lsblk(text, links=None, nvme=None, sizes=None):
+    """
+    Parse the default output of `lsblk` into a list of disks, filling in
+    the model, serial number and persistent names from the disk links and
+    the NVMe namespaces if supplied. The size in bytes is taken from
+    the `sizes` dictionary, since `lsblk` only shows a rounded one;
+    it is None if not known.
+    """
+    if links is None:
+        links = {}
+    if sizes is None:
+        sizes = {}
+    nvme_by_name = dict((ns.node.split('/')[-1], ns) for ns in nvme or [])
+    res = []
+    for line in text.splitlines()[1:]:
+        fields = RE_TREE_PREFIX.sub('', line).split()
+        if len(fields) < 6 or fields[5] != 'disk':
+            continue
+        name = fields[0]
+        by_id = [link for link in links.get(name, [])
+                 if not link.startswith('wwn-')] + \
+            [link for link in links.get(name, []) if link.startswith('wwn-')]
+        (model, serial) = (None, None)
+        if name in nvme_by_name:
+            (model, serial) = (nvme_by_name[name].model,
+                               nvme_by_name[name].serial)
+        else:
+            for link in by_id:
+                (model, serial) = split_disk_id(link)
+                if serial is not None:
+                    break
+        res.append(Disk(name=name, size=sizes.get(name), model=model,
+                        serial=serial,
+                        by_id=['/dev/disk/by-id/' + link for link in by_id]))
+    return res
+
+
+def parse_nvme_list(text):
+    """
+    Parse the output of `nvme list` into a list of NVMe namespaces,
+    using the dashed line to figure out the column widths and the header
+    line to figure out which column is which, since newer versions of
+    nvme-cli add more of them.
+    """
+    lines = text.splitlines()
+    for idx, line in enumerate(lines):
+        if line.startswith('---'):
+            break
+    else:
+        return []
+    if idx == 0:
+        return []
+
+    spans = []
+    pos = 0
+    for dashes in lines[idx].split(' '):
+        if dashes:
+            spans.append((pos, pos + len(dashes)))
+        pos += len(dashes) + 1
+    if spans:
+        spans[-1] = (spans[-1][0], None)
+    header = lines[idx - 1]
+    columns = dict((header[start:end].strip(), (start, end))
+                   for (start, end) in spans)
+    if any(name not in columns for name in NVME_LIST_COLUMNS.values()):
+        return []
+
+    res = []
+    for line in lines[idx + 1:]:
+        if not line.strip():
+            continue
+        values = dict((field, line[slice(*columns[name])].strip())
+                      for (field, name) in NVME_LIST_COLUMNS.items())
+        values['usage'] = ' '.join(values['usage'].split())
+        values['format'] = ' '.join(values['format'].split())
+        res.append(NVMeNamespace(**values))
+    return res
+
+
+def parse_lspci(text):
+    """
+    Parse the output of `lspci -vvnnqD` into a list of PCI devices.
+    """
+    res = []
+    dev = None
+    for line in text.splitlines():
+        m = RE_PCI_HEADER.match(line)
+        if m is not None:
+            dev = PCIDevice(**m.groupdict())
+            res.append(dev)
+            continue
+        if dev is None:
+            continue
+        m = RE_PCI_SUBSYSTEM.match(line)
+        if m is not None:
+            dev.subsystem_vendor_id = m.group('vendor_id')
+            dev.subsystem_device_id = m.group('device_id')
+            continue
+        m = RE_PCI_DRIVER.match(line)
+        if m is not None:
+            dev.driver = m.group('driver')
+    return res
+
+
+def parse_ip_address(text):
+    """
+    Parse the output of `ip address list` or `ip -details address list`
+    into a list of network interfaces.
+    """
+    res = []
+    nic = None
+    for line in text.splitlines():
+        m = RE_IP_LINK.match(line)
+        if m is not None:
+            nic = NIC(name=m.group('name'), mtu=int(m.group('mtu')),
+                      state=m.group('state'), addresses=[])
+            res.append(nic)
+            continue
+        if nic is None:
+            continue
+        m = RE_IP_LINKADDR.match(line)
+        if m is not None and nic.mac is None:
+            nic.mac = m.group('mac')
+            continue
+        m = RE_IP_ADDR.match(line)
+        if m is not None:
+            nic.addresses.append(m.group('addr'))
+    return res
+
+
+def build_structured(collected, sizes=None):
+    """
+    Parse the relevant sections of the collected data and return
+    a dictionary of lists of records serialized as dictionaries;
+    `sizes` maps the disk names to their sizes in bytes.
+    """
+    nvme = parse_nvme_list(collected.get('nvme-list.txt', ''))
+    ip_address = collected.get('ip-details-address-list.txt',
+                               collected.get('ip-address-list.txt', ''))
+    links = parse_disk_links(collected.get('ls-dev-disk-by-id.txt', ''))
+    return {
+        'disks': [d.to_dict() for d in
+                  parse_lsblk(collected.get('lsblk.txt', ''), links, nvme,
+                              sizes)],
+        'nvme': [ns.to_dict() for ns in nvme],
+        'pci': [d.to_dict() for d in
+                parse_lspci(collected.get('lspci-vvnnqD.txt', ''))],
+        'nics': [n.to_dict() for n in parse_ip_address(ip_address)],
+    }
@@ -0,0 +1,377 @@
+"""
+Collect some of the inventory data directly from the kernel interfaces
+instead of running the corresponding tools: each function produces
+the same output as the tool it replaces, at least for the cases that
+we care about.
+"""
+
+import grp
+import os
+import pwd
+import re
+import stat
+import time
+
+
+SIX_MONTHS = 6 * 30 * 24 * 3600
+SIZE_SUFFIXES = 'BKMGTPE'
+RE_MOUNT_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def _path(root, path):
+    """
+    Build the full path to a file within the (possibly fake) root directory.
+    """
+    return os.path.join(root, path.lstrip('/'))
+
+
+def _read(path, default=None):
+    """
+    Read a single-line sysfs or procfs file.
+    """
+    try:
+        with open(path, mode='r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def read_meminfo(root='/'):
+    """
+    Parse /proc/meminfo into a dictionary of values in kilobytes.
+    """
+    res = {}
+    with open(_path(root, '/proc/meminfo'), mode='r') as f:
+        for line in f:
+            (name, sep, value) = line.partition(':')
+            if not sep:
+                continue
+            fields = value.split()
+            if fields:
+                res[name.strip()] = int(fields[0])
+    return res
+
+
+def free_m(root='/'):
+    """
+    Produce the output of `free -m`.
+    """
+    mem = read_meminfo(root)
+    total = mem.get('MemTotal', 0)
+    free = mem.get('MemFree', 0)
+    buffers = mem.get('Buffers', 0)
+    cached = mem.get('Cached', 0) + mem.get('SReclaimable', 0)
+    used = total - free - cached - buffers
+    if used < 0:
+        used = total - free
+    available = mem.get('MemAvailable', free)
+    swap_total = mem.get('SwapTotal', 0)
+    swap_free = mem.get('SwapFree', 0)
+
+    def row(title, values):
+        return '{t:<7}'.format(t=title) + \
+            ''.join(' {v:>11}'.format(v=v >> 10) for v in values)
+
+    return '\n'.join([
+        '              total        used        free      shared'
+        '  buff/cache   available',
+        row('Mem:', [total, used, free, mem.get('Shmem', 0),
+                     buffers + cached, available]),
+        row('Swap:', [swap_total, swap_total - swap_free, swap_free]),
+    ]) + '\n'
+
+
+def lsmod(root='/'):
+    """
+    Produce the output of `lsmod`.
+    """
+    lines = ['Module                  Size  Used by']
+    with open(_path(root, '/proc/modules'), mode='r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            (name, size, refcnt, holders) = fields[:4]
+            res = '{name:<19} {size:>8}  {refcnt}' \
+                .format(name=name, size=size, refcnt=refcnt)
+            holders = [h for h in holders.split(',') if h and h != '-']
+            if holders:
+                res += ' ' + ','.join(holders)
+            lines.append(res)
+    return '\n'.join(lines) + '\n'
+
+
+def _ls_time(mtime, now):
+    """
+    Format a modification time the way `ls -l` does in the C locale.
+    """
+    tm = time.localtime(mtime)
+    if now - SIX_MONTHS < mtime <= now:
+        return time.strftime('%b ', tm) + \
+            '{d:>2}'.format(d=tm.tm_mday) + time.strftime(' %H:%M', tm)
+    return time.strftime('%b ', tm) + \
+        '{d:>2}'.format(d=tm.tm_mday) + time.strftime('  %Y', tm)
+
+
+def _user(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def _group(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def ls_l(root, path):
+    """
+    Produce the output of `ls -l` for a directory.
+    """
+    dirname = _path(root, path)
+    now = time.time()
+    total = 0
+    entries = []
+    for name in sorted(os.listdir(dirname)):
+        fname = os.path.join(dirname, name)
+        st = os.lstat(fname)
+        total += (st.st_blocks * 512 + 1023) // 1024
+        if stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+            size = '{ma}, {mi}'.format(ma=os.major(st.st_rdev),
+                                       mi=os.minor(st.st_rdev))
+        else:
+            size = str(st.st_size)
+        if stat.S_ISLNK(st.st_mode):
+            name += ' -> ' + os.readlink(fname)
+        entries.append((stat.filemode(st.st_mode), str(st.st_nlink),
+                        _user(st.st_uid), _group(st.st_gid), size,
+                        _ls_time(st.st_mtime, now), name))
+
+    widths = [max([len(e[idx]) for e in entries] or [0])
+              for idx in range(5)]
+    lines = ['total {total}'.format(total=total)]
+    for e in entries:
+        lines.append(' '.join([
+            e[0],
+            e[1].rjust(widths[1]),
+            e[2].ljust(widths[2]),
+            e[3].ljust(widths[3]),
+            e[4].rjust(widths[4]),
+            e[5],
+            e[6],
+        ]))
+    return '\n'.join(lines) + '\n'
+
+
+def ls_sys_class_net(root='/'):
+    """
+    Produce the output of `ls -l /sys/class/net`.
+    """
+    return ls_l(root, '/sys/class/net')
+
+
+def ls_dev_disk_by_id(root='/'):
+    """
+    Produce the output of `ls -l /dev/disk/by-id`.
+    """
+    return ls_l(root, '/dev/disk/by-id')
+
+
+def ls_dev_disk_by_path(root='/'):
+    """
+    Produce the output of `ls -l /dev/disk/by-path`.
+    """
+    return ls_l(root, '/dev/disk/by-path')
+
+
+def human_size(size):
+    """
+    Format a size in bytes the way `lsblk` does.
+    """
+    exp = 0
+    while exp < 60 and size >= (1 << (exp + 10)):
+        exp += 10
+    dec = size >> exp
+    frac = size & ((1 << exp) - 1) if exp else 0
+    if frac:
+        frac = (frac // (1 << (exp - 10)) + 50) // 100
+        if frac == 10:
+            dec += 1
+            frac = 0
+    suffix = SIZE_SUFFIXES[exp // 10]
+    if frac:
+        return '{d}.{f}{s}'.format(d=dec, f=frac, s=suffix)
+    return '{d}{s}'.format(d=dec, s=suffix)
+
+
+def _unescape_mount(path):
+    """
+    Decode the octal escapes in a /proc/self/mountinfo path.
+    """
+    return RE_MOUNT_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), path)
+
+
+def read_mountpoints(root='/'):
+    """
+    Map block device numbers and names to their mount points.
+    """
+    res = {}
+    try:
+        with open(_path(root, '/proc/self/mountinfo'), mode='r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 4 and fields[2] not in res:
+                    res[fields[2]] = _unescape_mount(fields[4])
+    except OSError:
+        pass
+    try:
+        with open(_path(root, '/proc/swaps'), mode='r') as f:
+            for line in list(f)[1:]:
+                fields = line.split()
+                if fields and fields[0].startswith('/dev/'):
+                    res[os.path.basename(fields[0])] = '[SWAP]'
+    except OSError:
+        pass
+    return res
+
+
+def _block_type(sysdir, name):
+    """
+    Figure out the lsblk device type of a block device.
+    """
+    if os.path.exists(os.path.join(sysdir, 'partition')):
+        return 'part'
+    if name.startswith('loop'):
+        return 'loop'
+    uuid = _read(os.path.join(sysdir, 'dm', 'uuid'))
+    if uuid is not None:
+        if uuid.startswith('LVM-'):
+            return 'lvm'
+        if uuid.startswith('CRYPT-'):
+            return 'crypt'
+        if uuid.startswith('mpath-'):
+            return 'mpath'
+        return 'dm'
+    level = _read(os.path.join(sysdir, 'md', 'level'))
+    if level:
+        return level
+    if _read(os.path.join(sysdir, 'device', 'type')) == '5':
+        return 'rom'
+    return 'disk'
+
+
+def read_block_devices(root='/'):
+    """
+    Walk /sys/block and return a dictionary describing the block devices
+    and their partitions, keyed by kernel name.
+    """
+    devices = {}
+    sysblock = _path(root, '/sys/block')
+
+    def add(name, sysdir, parent):
+        dm_name = _read(os.path.join(sysdir, 'dm', 'name'))
+        devices[name] = {
+            'name': dm_name if dm_name else name,
+            'kname': name,
+            'dev': _read(os.path.join(sysdir, 'dev'), ''),
+            'rm': _read(os.path.join(sysdir, 'removable'),
+                        devices[parent]['rm'] if parent else '0'),
+            'size': int(_read(os.path.join(sysdir, 'size'), '0')) * 512,
+            'ro': _read(os.path.join(sysdir, 'ro'), '0'),
+            'type': _block_type(sysdir, name),
+            'parent': parent,
+            'partitions': [],
+            'holders': sorted(os.listdir(os.path.join(sysdir, 'holders')))
+            if os.path.isdir(os.path.join(sysdir, 'holders')) else [],
+            'slaves': sorted(os.listdir(os.path.join(sysdir, 'slaves')))
+            if os.path.isdir(os.path.join(sysdir, 'slaves')) else [],
+        }
+
+    for name in sorted(os.listdir(sysblock)):
+        sysdir = os.path.join(sysblock, name)
+        add(name, sysdir, None)
+        for part in sorted(os.listdir(sysdir)):
+            partdir = os.path.join(sysdir, part)
+            if os.path.isfile(os.path.join(partdir, 'partition')):
+                add(part, partdir, name)
+                devices[name]['partitions'].append(part)
+    return devices
+
+
+def disk_sizes(root='/'):
+    """
+    Return the exact sizes in bytes of the block devices in /sys/block,
+    keyed by kernel name.
+    """
+    sysblock = _path(root, '/sys/block')
+    return dict((name, int(_read(os.path.join(sysblock, name, 'size'),
+                                 '0')) * 512)
+                for name in sorted(os.listdir(sysblock)))
+
+
+def lsblk(root='/'):
+    """
+    Produce something very similar to the output of `lsblk`.
+    """
+    devices = read_block_devices(root)
+    mounts = read_mountpoints(root)
+    rows = []
+
+    def walk(name, prefix, last, top):
+        dev = devices[name]
+        if top:
+            label = dev['name']
+        else:
+            label = prefix + ('└─' if last else '├─') + \
+                dev['name']
+        (major, _, minor) = dev['dev'].partition(':')
+        rows.append([
+            label,
+            '{ma:>3}:{mi:<3}'.format(ma=major, mi=minor),
+            dev['rm'],
+            human_size(dev['size']),
+            dev['ro'],
+            dev['type'],
+            mounts.get(dev['dev'], mounts.get(name, '')),
+        ])
+        children = [c for c in dev['partitions'] + dev['holders']
+                    if c in devices]
+        if not top:
+            prefix += '  ' if last else '│ '
+        for idx, child in enumerate(children):
+            walk(child, prefix, idx == len(children) - 1, False)
+
+    for name in sorted(devices):
+        dev = devices[name]
+        if dev['parent'] is not None or dev['slaves']:
+            continue
+        # Like lsblk, skip RAM disks and unused loop devices
+        if dev['dev'].startswith('1:') or \
+           (dev['type'] == 'loop' and dev['size'] == 0):
+            continue
+        walk(name, '', False, True)
+
+    header = ['NAME', 'MAJ:MIN', 'RM', 'SIZE', 'RO', 'TYPE', 'MOUNTPOINT']
+    widths = [max(len(r[idx]) for r in rows + [header])
+              for idx in range(len(header))]
+    right = (False, False, True, True, True, False, False)
+    lines = []
+    for r in [header] + rows:
+        lines.append(' '.join(
+            value.rjust(widths[idx]) if right[idx]
+            else value.ljust(widths[idx])
+            for idx, value in enumerate(r)).rstrip())
+    return '\n'.join(lines) + '\n'
+
+
+NATIVE_COLLECTORS = {
+    'free-m': free_m,
+    'lsblk': lsblk,
+    'lsmod': lsmod,
+    'ls-dev-disk-by-id': ls_dev_disk_by_id,
+    'ls-dev-disk-by-path': ls_dev_disk_by_path,
+    'ls-sys-class-net': ls_sys_class_net,
+}
@@ -0,0 +1,132 @@
+"""
+Check whether the tools needed for the data collection are already
+installed, and cache the answer so that the package manager is only
+invoked when something is actually missing.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+
+from spinventory import store as spstore
+
+
+PACKAGES = {
+    'dmidecode': ['dmidecode'],
+    'lshw': ['lshw'],
+    'nvme-cli': ['nvme'],
+    'pciutils': ['lspci'],
+    'usbutils': ['lsusb'],
+}
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+SBIN_PATH = '/usr/local/sbin:/usr/sbin:/sbin'
+
+
+def find_binary(name):
+    """
+    Look for a tool in the search path, also trying the sbin directories.
+    """
+    path = os.environ.get('PATH', os.defpath) + ':' + SBIN_PATH
+    return shutil.which(name, path=path)
+
+
+def installed_packages(packages=None):
+    """
+    Ask dpkg which of the packages are installed, return a dictionary
+    mapping their names to their versions.
+    """
+    if packages is None:
+        packages = PACKAGES
+    try:
+        output = subprocess.check_output(
+            ['dpkg-query', '-W', '-f', '${Package} ${Status} ${Version}\\n'] +
+            sorted(packages), stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        # dpkg-query exits with code 1 if any of the packages is unknown
+        output = e.output
+    except OSError:
+        return {}
+
+    res = {}
+    for line in output.decode('UTF-8').splitlines():
+        fields = line.split()
+        if len(fields) == 5 and fields[1:4] == ['install', 'ok', 'installed']:
+            res[fields[0]] = fields[4]
+    return res
+
+
+def missing_packages(versions, packages=None):
+    """
+    Return the sorted names of the packages that are either not installed
+    or do not provide all of their tools.
+    """
+    if packages is None:
+        packages = PACKAGES
+    return sorted(name for (name, binaries) in packages.items()
+                  if name not in versions or
+                  any(find_binary(b) is None for b in binaries))
+
+
+def _dpkg_status_mtime():
+    try:
+        return os.stat(DPKG_STATUS).st_mtime
+    except OSError:
+        return None
+
+
+def save_cache(path, versions, packages=None):
+    """
+    Record the installed package versions and the paths to the tools.
+    """
+    if packages is None:
+        packages = PACKAGES
+    data = {
+        'dpkg_status_mtime': _dpkg_status_mtime(),
+        'packages': dict((name, versions.get(name)) for name in packages),
+        'binaries': dict((b, find_binary(b))
+                         for binaries in packages.values()
+                         for b in binaries),
+    }
+    spstore.atomic_write(path, json.dumps(data, sort_keys=True)
+                         .encode('utf-8'))
+
+
+def cache_valid(path, packages=None):
+    """
+    Check whether a previous run found all the packages installed and
+    nothing has changed since: the dpkg database has not been modified
+    and the tools are still in place.
+    """
+    if packages is None:
+        packages = PACKAGES
+    try:
+        with open(path, mode='r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(data, dict) or \
+       data.get('dpkg_status_mtime') != _dpkg_status_mtime():
+        return False
+
+    versions = data.get('packages', {})
+    if any(versions.get(name) is None for name in packages):
+        return False
+    paths = data.get('binaries', {})
+    for binaries in packages.values():
+        for b in binaries:
+            bpath = paths.get(b)
+            if bpath is None or not os.access(bpath, os.X_OK):
+                return False
+    return True
+
+
+def forget_cache(path):
+    """
+    Remove the cached answer so that the next check queries dpkg again.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
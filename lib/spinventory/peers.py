@@ -0,0 +1,105 @@
+"""
+Pass the collected data between the units over the peer relation so that
+the leader may submit the data of all the units in a single request.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+
+from spinventory import store as spstore
+
+
+RELATION = 'inventory-peers'
+
+KEY_NODE = 'inventory-node'
+KEY_HASH = 'inventory-hash'
+KEY_DATA = 'inventory-data'
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_hash(path):
+    """
+    Compute the content hash of a collected data file.
+    """
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_payload(path):
+    """
+    Compress a collected data file and encode it for the relation settings.
+    """
+    with open(path, mode='rb') as f:
+        data = f.read()
+    return base64.b64encode(gzip.compress(data)).decode('us-ascii')
+
+
+def decode_payload(text):
+    """
+    Decode the collected data published by another unit.
+    """
+    return gzip.decompress(base64.b64decode(text.encode('us-ascii')))
+
+
+def payload_chunks(text):
+    """
+    Decode the collected data published by another unit only when it is
+    actually needed, e.g. while it is being compressed for submission.
+    """
+    yield decode_payload(text)
+
+
+def published(settings):
+    """
+    Extract the node name, content hash, and encoded data from the relation
+    settings of a unit; return None if it has not published anything yet.
+    """
+    if not settings:
+        return None
+    values = tuple(settings.get(key)
+                   for key in (KEY_NODE, KEY_HASH, KEY_DATA))
+    if not all(values):
+        return None
+    return values
+
+
+def load_submitted(path):
+    """
+    Load the content hashes of the nodes' data last submitted by the leader.
+    """
+    try:
+        with open(path, mode='r') as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(hashes, dict):
+        return {}
+    return hashes
+
+
+def save_submitted(path, hashes):
+    """
+    Store the content hashes of the nodes' data submitted by the leader.
+    """
+    spstore.atomic_write(path, json.dumps(hashes, sort_keys=True)
+                         .encode('utf-8'))
+
+
+def forget_submitted(path):
+    """
+    Remove the stored hashes so that the leader submits all the data again.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,100 @@
+"""
+Keep the cProfile reports of the charm's hook handlers: the raw
+statistics in a `.prof` file and a summary of the most expensive
+functions in a `.txt` file next to it, only keeping the most recent ones.
+"""
+
+import io
+import os
+import pstats
+import re
+import shutil
+import time
+
+
+RE_REPORT = re.compile(r'^(?P<ts>[0-9]+\.[0-9]{6})-(?P<name>[A-Za-z0-9_.-]+)'
+                       r'\.prof$')
+RE_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+DEFAULT_TOP = 25
+
+
+def report_name(hook, handler):
+    """
+    Build the name of a report from the hook and handler names.
+    """
+    name = '{hook}.{handler}'.format(hook=hook, handler=handler)
+    return RE_UNSAFE.sub('_', name)
+
+
+def summarize(prof, top=DEFAULT_TOP):
+    """
+    List the `top` functions taking the most cumulative time.
+    """
+    out = io.StringIO()
+    stats = pstats.Stats(prof, stream=out)
+    stats.sort_stats('cumulative')
+    if top > 0:
+        stats.print_stats(top)
+    else:
+        stats.print_stats()
+    return out.getvalue()
+
+
+def reports(profdir):
+    """
+    Return a list of (timestamp, name, path) tuples for the stored
+    reports, oldest first; the path has no extension.
+    """
+    try:
+        names = os.listdir(profdir)
+    except FileNotFoundError:
+        return []
+    res = []
+    for name in names:
+        m = RE_REPORT.match(name)
+        if m:
+            res.append((float(m.group('ts')), m.group('name'),
+                        os.path.join(profdir, name[:-len('.prof')])))
+    return sorted(res)
+
+
+def rotate(profdir, keep):
+    """
+    Remove all but the `keep` most recent reports, return their paths.
+    """
+    removed = []
+    for (_, _, path) in reports(profdir)[:-max(keep, 1)]:
+        for ext in ('.prof', '.txt'):
+            try:
+                os.unlink(path + ext)
+            except FileNotFoundError:
+                pass
+        removed.append(path)
+    return removed
+
+
+def save(prof, profdir, name, keep, top=DEFAULT_TOP, timestamp=None):
+    """
+    Store the raw statistics and the summary of a profiler run, then
+    remove the oldest reports if there are more than `keep` of them;
+    return the path of the new report without an extension.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    os.makedirs(profdir, mode=0o700, exist_ok=True)
+    path = os.path.join(profdir, '{ts:.6f}-{name}'.format(ts=timestamp,
+                                                          name=name))
+    with open(path + '.txt', mode='w') as f:
+        f.write(summarize(prof, top))
+    prof.dump_stats(path + '.prof')
+    if keep > 0:
+        rotate(profdir, keep)
+    return path
+
+
+def forget(profdir):
+    """
+    Remove all the reports.
+    """
+    shutil.rmtree(profdir, ignore_errors=True)
@@ -0,0 +1,127 @@
+"""
+Keep track of when each collector was last run and which ones need to be
+run again, so that the cheap, volatile sections may be refreshed more
+often than the expensive, static ones.
+"""
+
+import json
+import os
+import time
+
+from spinventory import store as spstore
+
+
+TIER_VOLATILE = 'volatile'
+TIER_STATIC = 'static'
+
+VOLATILE_COLLECTORS = frozenset([
+    'free-m',
+    'ip-address-list',
+    'ip-details-address-list',
+    'ip-link-list',
+    'ls-dev-disk-by-id',
+    'ls-dev-disk-by-path',
+    'ls-sys-class-net',
+    'lsblk',
+    'lsmod',
+    'nvme-list',
+])
+
+
+def collector_tier(name):
+    """
+    Return the re-collection tier of the specified collector.
+    """
+    if name in VOLATILE_COLLECTORS:
+        return TIER_VOLATILE
+    return TIER_STATIC
+
+
+def load_state(path):
+    """
+    Load the schedule state: the time each collector was last run and
+    the list of collectors that have been requested to run again.
+    """
+    try:
+        with open(path, mode='r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = None
+    if not isinstance(state, dict):
+        state = {}
+    state.setdefault('last_run', {})
+    state.setdefault('pending', [])
+    return state
+
+
+def save_state(path, state):
+    """
+    Store the schedule state.
+    """
+    spstore.atomic_write(path, json.dumps(state, sort_keys=True)
+                         .encode('utf-8'))
+
+
+def record_run(path, names, now=None):
+    """
+    Note that the specified collectors have just been run.
+    """
+    if now is None:
+        now = time.time()
+    state = load_state(path)
+    for name in names:
+        state['last_run'][name] = now
+    save_state(path, state)
+
+
+def due_collectors(path, names, intervals, now=None):
+    """
+    Return the sorted names of the collectors that have never been run or
+    have not been run within the interval configured for their tier;
+    a missing or zero interval means that the tier is never re-collected
+    periodically.
+    """
+    if now is None:
+        now = time.time()
+    last_run = load_state(path)['last_run']
+    res = []
+    for name in names:
+        interval = intervals.get(collector_tier(name))
+        if not interval or interval <= 0:
+            continue
+        last = last_run.get(name)
+        if last is None or now - last >= interval:
+            res.append(name)
+    return sorted(res)
+
+
+def request(path, names):
+    """
+    Ask for the specified collectors to be run during the next collection.
+    """
+    state = load_state(path)
+    state['pending'] = sorted(set(state['pending']).union(names))
+    save_state(path, state)
+
+
+def take_pending(path):
+    """
+    Return and forget the list of collectors that have been requested to
+    run; an empty list means that all of them should be run.
+    """
+    state = load_state(path)
+    pending = state['pending']
+    if pending:
+        state['pending'] = []
+        save_state(path, state)
+    return pending
+
+
+def forget(path):
+    """
+    Remove the schedule state so that everything is collected anew.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,238 @@
+"""
+Send a prepared submission from a detached process and record
+the outcome in a state file, so that the hooks do not have to wait for
+the inventory server to respond.
+
+Run as `python3 -m spinventory.sender <directory>`.
+"""
+
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+
+from spinventory import backoff as spbackoff
+from spinventory import store as spstore
+from spinventory import submit as spsubmit
+
+
+JOB_FILE = 'job.json'
+BODY_FILE = 'body'
+PID_FILE = 'sender.pid'
+RESULT_FILE = 'result.json'
+LOG_FILE = 'sender.log'
+
+DEFAULT_TIMEOUT = 300
+
+# How long past its time budget a sender may still be considered running
+STALE_SLACK = 60
+
+
+def prepare(senderdir, url, chunks, encoding, content_type,
+            headers=None, check_fingerprint=None, filename=None,
+            timeout=DEFAULT_TIMEOUT, context=None):
+    """
+    Write the (compressed) submission document and a description of
+    the request into the sender's directory, replacing any previous
+    submission; `context` is stored along with them for the hook that
+    processes the outcome. If `check_fingerprint` is set, the sender
+    first asks the server whether it already has the data.
+    """
+    clear(senderdir)
+    os.makedirs(senderdir, mode=0o700)
+    headers = dict(headers or {})
+    with open(os.path.join(senderdir, BODY_FILE), mode='wb') as body:
+        if encoding == 'legacy':
+            for chunk in chunks:
+                body.write(chunk)
+            length = body.tell()
+            if content_type != spsubmit.CONTENT_JSON:
+                headers['Content-Type'] = content_type
+        else:
+            (_, length, encoding) = spsubmit.compress_chunks(chunks,
+                                                             encoding, body)
+            headers['Content-Type'] = content_type
+            headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = str(length)
+
+    job = {
+        'created': time.time(),
+        'url': url,
+        'headers': headers,
+        'encoding': encoding,
+        'content_type': content_type,
+        'length': length,
+        'check_fingerprint': check_fingerprint,
+        'filename': filename,
+        'timeout': timeout,
+        'context': context or {},
+    }
+    spstore.atomic_write(os.path.join(senderdir, JOB_FILE),
+                         json.dumps(job, sort_keys=True).encode('utf-8'))
+    return job
+
+
+def spawn(senderdir, libdir, python=None):
+    """
+    Start a sender process in a new session with no ties to the hook's
+    standard file descriptors; return its process ID.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = libdir if not env.get('PYTHONPATH') \
+        else libdir + os.pathsep + env['PYTHONPATH']
+    with open(os.path.join(senderdir, LOG_FILE), mode='ab') as log:
+        proc = subprocess.Popen([python or sys.executable, '-m',
+                                 'spinventory.sender', senderdir],
+                                stdin=subprocess.DEVNULL,
+                                stdout=log, stderr=log, cwd=senderdir,
+                                env=env, start_new_session=True)
+    save_pid(senderdir, proc.pid)
+    return proc.pid
+
+
+def run(senderdir):
+    """
+    Send the prepared submission and record the outcome.
+    """
+    with open(os.path.join(senderdir, JOB_FILE), mode='r') as f:
+        job = json.load(f)
+    if job['timeout'] > 0:
+        socket.setdefaulttimeout(job['timeout'])
+
+    result = {
+        'created': job['created'],
+        'started': time.time(),
+        'code': None,
+        'not_modified': False,
+        'retry_after': None,
+        'error': None,
+    }
+    try:
+        if job['check_fingerprint'] is not None and \
+           spsubmit.server_has(job['url'], job['filename'],
+                               job['check_fingerprint']):
+            result['code'] = 304
+            result['not_modified'] = True
+        else:
+            with open(os.path.join(senderdir, BODY_FILE), mode='rb') as body:
+                result['code'] = spsubmit.post(job['url'], body,
+                                               job['headers'])
+    except urllib.error.HTTPError as e:
+        result['code'] = e.code
+        result['error'] = str(e)
+        if e.code in spbackoff.RETRY_AFTER_CODES and e.headers is not None:
+            result['retry_after'] = spbackoff.parse_retry_after(
+                e.headers.get('Retry-After'))
+    except Exception as e:
+        result['error'] = str(e)
+    result['finished'] = time.time()
+    spstore.atomic_write(os.path.join(senderdir, RESULT_FILE),
+                         json.dumps(result, sort_keys=True).encode('utf-8'))
+    return result
+
+
+def _load(path):
+    """
+    Load a JSON state file, return None if it does not exist or
+    is not valid.
+    """
+    try:
+        with open(path, mode='r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def process_identity(pid):
+    """
+    Identify a running process by the boot ID and its start time, so that
+    an unrelated process that got the same PID later is not mistaken for
+    it; return None if there is no such process or it has exited.
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id', mode='r') as f:
+            boot_id = f.read().strip()
+        with open('/proc/{pid}/stat'.format(pid=pid), mode='r') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Skip the command name, it may contain spaces and parentheses
+    fields = stat[stat.rindex(')') + 2:].split()
+    if fields[0] in ('Z', 'X'):
+        return None
+    return '{boot}:{start}'.format(boot=boot_id, start=fields[19])
+
+
+def save_pid(senderdir, pid):
+    """
+    Record the process ID and the identity of the sender.
+    """
+    spstore.atomic_write(os.path.join(senderdir, PID_FILE), json.dumps({
+        'pid': pid,
+        'identity': process_identity(pid),
+    }).encode('utf-8'))
+
+
+def deadline(job):
+    """
+    Return the time after which the sender of a job is considered stuck,
+    or None if it may run for as long as it needs to.
+    """
+    if job['timeout'] <= 0:
+        return None
+    # The timeout applies to each of the HEAD and POST requests
+    return job['created'] + 2 * job['timeout'] + STALE_SLACK
+
+
+def status(senderdir, now=None):
+    """
+    Return the state of the background submission: "idle" if there is
+    none, "running", "done", or "lost" if the sender exited without
+    recording the outcome or has been running for far too long; along
+    with the job and the result, if any. A stuck sender is killed.
+    """
+    job = _load(os.path.join(senderdir, JOB_FILE))
+    if job is None:
+        return ('idle', None, None)
+    result = _load(os.path.join(senderdir, RESULT_FILE))
+    if result is not None and result.get('created') == job['created']:
+        return ('done', job, result)
+    sender = _load(os.path.join(senderdir, PID_FILE))
+    if not isinstance(sender, dict) or sender.get('identity') is None or \
+       process_identity(sender['pid']) != sender['identity']:
+        return ('lost', job, None)
+
+    limit = deadline(job)
+    if limit is not None and (time.time() if now is None else now) > limit:
+        try:
+            os.kill(sender['pid'], signal.SIGKILL)
+        except OSError:
+            pass
+        return ('lost', job, None)
+    return ('running', job, None)
+
+
+def clear(senderdir):
+    """
+    Remove the submission and its outcome.
+    """
+    shutil.rmtree(senderdir, ignore_errors=True)
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python3 -m spinventory.sender directory')
+    result = run(sys.argv[1])
+    print('{ts}: code {code}{err}'.format(
+        ts=time.strftime('%Y-%m-%d %H:%M:%S'), code=result['code'],
+        err='' if result['error'] is None
+        else ', error: {e}'.format(e=result['error'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Keep the collected data snapshots that could not be submitted in
+an on-disk spool so that they may all be sent once the inventory server
+is reachable again.
+"""
+
+import os
+import re
+import time
+
+
+RE_ENTRY = re.compile(r'^(?P<ts>[0-9]+\.[0-9]{6})\.json$')
+
+
+def entries(spooldir):
+    """
+    Return a list of (timestamp, path) tuples for the spooled snapshots,
+    oldest first.
+    """
+    try:
+        names = os.listdir(spooldir)
+    except FileNotFoundError:
+        return []
+    res = []
+    for name in names:
+        m = RE_ENTRY.match(name)
+        if m:
+            res.append((float(m.group('ts')), os.path.join(spooldir, name)))
+    return sorted(res)
+
+
+def add(spooldir, path, timestamp=None):
+    """
+    Move a collected data file into the spool, named after its
+    modification time unless a timestamp is specified.
+    """
+    if timestamp is None:
+        timestamp = os.stat(path).st_mtime
+    if not os.path.isdir(spooldir):
+        os.mkdir(spooldir, mode=0o700)
+    target = os.path.join(spooldir, '{ts:.6f}.json'.format(ts=timestamp))
+    os.rename(path, target)
+    return target
+
+
+def evict(spooldir, max_bytes, max_age, now=None):
+    """
+    Remove the snapshots older than `max_age` seconds, then the oldest
+    ones until the total size is no more than `max_bytes`; a zero value
+    disables the corresponding limit. Return the removed paths.
+    """
+    if now is None:
+        now = time.time()
+    sized = []
+    for (timestamp, path) in entries(spooldir):
+        try:
+            sized.append((timestamp, path, os.stat(path).st_size))
+        except FileNotFoundError:
+            pass
+
+    total = sum(size for (_, _, size) in sized)
+    removed = []
+    for (timestamp, path, size) in sized:
+        too_old = max_age > 0 and now - timestamp > max_age
+        too_big = max_bytes > 0 and total > max_bytes
+        if not too_old and not too_big:
+            break
+        remove([path])
+        removed.append(path)
+        total -= size
+    return removed
+
+
+def remove(paths):
+    """
+    Remove the specified snapshots, e.g. after they have been submitted.
+    """
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def clear(spooldir):
+    """
+    Remove all the spooled snapshots and the spool directory itself.
+    """
+    remove(path for (_, path) in entries(spooldir))
+    try:
+        os.rmdir(spooldir)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,175 @@
+"""
+Keep the collected data in a content-addressed store: each section is
+stored once, named after the hash of its contents, and each snapshot is
+a manifest mapping the section names to those hashes.
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+
+from spinventory import delta as spdelta
+
+
+RE_SNAPSHOT = re.compile(r'^(?P<ts>[0-9]+\.[0-9]{6})\.json$')
+
+
+def fsync_dir(path):
+    """
+    Make sure that a directory's entries have been written to disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """
+    Replace a file's contents so that readers see either the old or
+    the new data, never a partially written file, even if the system
+    crashes right afterwards.
+    """
+    dirname = os.path.dirname(path)
+    tempname = os.path.join(dirname, '.{name}.{pid}.tmp'.format(
+        name=os.path.basename(path), pid=os.getpid()))
+    try:
+        with open(tempname, mode='wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tempname, path)
+    except Exception:
+        try:
+            os.unlink(tempname)
+        except FileNotFoundError:
+            pass
+        raise
+    fsync_dir(dirname)
+
+
+def object_path(storedir, digest):
+    """
+    Return the path to the stored section with the specified hash.
+    """
+    return os.path.join(storedir, 'objects', digest[:2], digest)
+
+
+def snapshots(storedir):
+    """
+    Return a list of (timestamp, path) tuples for the stored snapshot
+    manifests, oldest first.
+    """
+    try:
+        names = os.listdir(os.path.join(storedir, 'snapshots'))
+    except FileNotFoundError:
+        return []
+    res = []
+    for name in names:
+        m = RE_SNAPSHOT.match(name)
+        if m:
+            res.append((float(m.group('ts')),
+                        os.path.join(storedir, 'snapshots', name)))
+    return sorted(res)
+
+
+def put_snapshot(storedir, collected, timestamp=None):
+    """
+    Store the sections that are not already there and a manifest for
+    the snapshot; return the manifest and the number of sections written.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    manifest = {}
+    written = 0
+    for (name, value) in collected.items():
+        digest = spdelta.section_hash(value)
+        manifest[name] = digest
+        path = object_path(storedir, digest)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        atomic_write(path, json.dumps(value, sort_keys=True).encode('utf-8'))
+        written += 1
+
+    snapdir = os.path.join(storedir, 'snapshots')
+    os.makedirs(snapdir, mode=0o700, exist_ok=True)
+    atomic_write(os.path.join(snapdir, '{ts:.6f}.json'.format(ts=timestamp)),
+                 json.dumps(manifest, sort_keys=True).encode('us-ascii'))
+    return (manifest, written)
+
+
+def load_manifest(path):
+    """
+    Load a snapshot manifest.
+    """
+    with open(path, mode='r') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError('Invalid snapshot manifest {path}'
+                         .format(path=path))
+    return manifest
+
+
+def latest_manifest(storedir):
+    """
+    Return the manifest of the most recent snapshot, or None.
+    """
+    snaps = snapshots(storedir)
+    if not snaps:
+        return None
+    return load_manifest(snaps[-1][1])
+
+
+def load_sections(storedir, manifest, names=None):
+    """
+    Load the specified sections (all of them by default) of a snapshot.
+    """
+    if names is None:
+        names = manifest.keys()
+    res = {}
+    for name in names:
+        with open(object_path(storedir, manifest[name]), mode='rb') as f:
+            res[name] = json.loads(f.read().decode('utf-8'))
+    return res
+
+
+def gc(storedir, keep):
+    """
+    Remove all but the `keep` most recent snapshots and the sections that
+    are no longer referenced by any of the remaining ones; return
+    the number of snapshots and sections removed.
+    """
+    snaps = snapshots(storedir)
+    keep = max(keep, 1)
+    removed_snaps = 0
+    for (_, path) in snaps[:-keep]:
+        os.unlink(path)
+        removed_snaps += 1
+
+    referenced = set()
+    for (_, path) in snaps[-keep:]:
+        referenced.update(load_manifest(path).values())
+
+    removed_objects = 0
+    objdir = os.path.join(storedir, 'objects')
+    try:
+        subdirs = os.listdir(objdir)
+    except FileNotFoundError:
+        subdirs = []
+    for sub in subdirs:
+        for name in os.listdir(os.path.join(objdir, sub)):
+            if name not in referenced:
+                os.unlink(os.path.join(objdir, sub, name))
+                removed_objects += 1
+    return (removed_snaps, removed_objects)
+
+
+def forget(storedir):
+    """
+    Remove the whole store.
+    """
+    shutil.rmtree(storedir, ignore_errors=True)
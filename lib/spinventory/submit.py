@@ -0,0 +1,305 @@
+"""
+Prepare the collected data for submission and send it to the inventory
+server.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from spinventory import cbor as spcbor
+from spinventory import store as spstore
+
+
+CHUNK_SIZE = 64 * 1024
+
+ENCODINGS = ('legacy', 'gzip', 'zstd')
+
+CONTENT_JSON = 'application/json'
+CONTENT_CBOR = 'application/cbor'
+
+# Sent along with the full data so that the server may use it as
+# the entity tag of the node's inventory
+FINGERPRINT_HEADER = 'X-Inventory-Fingerprint'
+
+# The responses of a server that does not accept CBOR documents
+UNSUPPORTED_TYPE_CODES = (406, 415)
+
+
+def legacy_body(filename, path):
+    """
+    Build the original submission format: the contents of the collected
+    data file encoded as a JSON string within a JSON object.
+    """
+    with open(path, mode='r', encoding='latin1') as f:
+        contents = f.read()
+    data = json.dumps({'filename': filename, 'contents': contents})
+    return data.encode('latin1')
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Read a file in chunks.
+    """
+    with open(path, mode='rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def full_chunks(filename, path, chunk_size=CHUNK_SIZE):
+    """
+    Generate the submission document containing the collected data file
+    as a JSON object, reading the file in chunks.
+    """
+    yield '{{"format": "full", "filename": {fn}, "collected": ' \
+        .format(fn=json.dumps(filename)).encode('us-ascii')
+    for chunk in file_chunks(path, chunk_size):
+        yield chunk
+    yield b'}'
+
+
+def batch_chunks(filename, snapshots, chunk_size=CHUNK_SIZE):
+    """
+    Generate the submission document containing several collected data
+    files, each one as a JSON object along with its timestamp, oldest
+    first; `snapshots` is a list of (timestamp, path) tuples.
+    """
+    yield '{{"format": "batch", "filename": {fn}, "snapshots": [' \
+        .format(fn=json.dumps(filename)).encode('us-ascii')
+    for (idx, (timestamp, path)) in enumerate(snapshots):
+        yield '{sep}{{"timestamp": {ts}, "collected": ' \
+            .format(sep=', ' if idx else '',
+                    ts=json.dumps(timestamp)).encode('us-ascii')
+        for chunk in file_chunks(path, chunk_size):
+            yield chunk
+        yield b'}'
+    yield b']}'
+
+
+def multi_chunks(nodes):
+    """
+    Generate the submission document containing the collected data of
+    several nodes; `nodes` is a list of (filename, chunks) tuples, where
+    the chunks form the contents of the collected data file.
+    """
+    yield b'{"format": "multi", "nodes": ['
+    for (idx, (filename, chunks)) in enumerate(nodes):
+        yield '{sep}{{"filename": {fn}, "collected": ' \
+            .format(sep=', ' if idx else '',
+                    fn=json.dumps(filename)).encode('us-ascii')
+        for chunk in chunks:
+            yield chunk
+        yield b'}'
+    yield b']}'
+
+
+def raw_sections(sections):
+    """
+    Convert the collected output sections back into the raw bytes
+    that the tools produced.
+    """
+    return dict((name, value.encode('latin1')
+                 if name.endswith(('.txt', '.err')) and
+                 isinstance(value, str) else value)
+                for (name, value) in sections.items())
+
+
+def snapshot_chunks(filename, path, encoding, content_type=CONTENT_JSON):
+    """
+    Generate the submission document containing the collected data file:
+    the legacy or the full JSON format, or the full format as CBOR with
+    the sections stored as raw bytes.
+    """
+    if content_type == CONTENT_CBOR:
+        with open(path, mode='r', encoding='latin1') as f:
+            collected = json.load(f)
+        return [spcbor.dumps({
+            'format': 'full',
+            'filename': filename,
+            'collected': raw_sections(collected),
+        })]
+    elif encoding == 'legacy':
+        return [legacy_body(filename, path)]
+    return full_chunks(filename, path)
+
+
+def delta_chunks(delta, content_type=CONTENT_JSON):
+    """
+    Generate the submission document containing the changed sections
+    as JSON or as CBOR with the sections stored as raw bytes.
+    """
+    if content_type == CONTENT_CBOR:
+        return [spcbor.dumps(dict(delta,
+                                  sections=raw_sections(delta['sections'])))]
+    return [json.dumps(delta).encode('latin1')]
+
+
+def compress_chunks(chunks, encoding, body=None):
+    """
+    Compress the submission document into the specified file or
+    a temporary one, return the file, the compressed size, and
+    the encoding actually used, which may be "gzip" if "zstd" was
+    requested, but is not available.
+    """
+    if encoding == 'zstd' and zstandard is None:
+        encoding = 'gzip'
+
+    if body is None:
+        body = tempfile.TemporaryFile(prefix='storpool-inventory.')
+    try:
+        if encoding == 'zstd':
+            cobj = zstandard.ZstdCompressor().compressobj()
+            for chunk in chunks:
+                body.write(cobj.compress(chunk))
+            body.write(cobj.flush())
+        elif encoding == 'gzip':
+            with gzip.GzipFile(fileobj=body, mode='wb') as writer:
+                for chunk in chunks:
+                    writer.write(chunk)
+        else:
+            raise ValueError('Unsupported submission encoding "{enc}"'
+                             .format(enc=encoding))
+        length = body.tell()
+        body.seek(0)
+    except Exception:
+        body.close()
+        raise
+    return (body, length, encoding)
+
+
+def post(url, data, headers=None):
+    """
+    Send the data to the inventory server, return the HTTP response code.
+    """
+    req = urllib.request.Request(url, data=data, headers=headers or {})
+    with urllib.request.urlopen(req) as resp:
+        return resp.getcode()
+
+
+def post_compressed(url, chunks, encoding, content_type=CONTENT_JSON,
+                    headers=None):
+    """
+    Compress the submission document and stream it to the inventory
+    server, return the HTTP response code, the number of bytes sent,
+    and the encoding actually used.
+    """
+    (body, length, encoding) = compress_chunks(chunks, encoding)
+    with body:
+        code = post(url, body, dict(headers or {}, **{
+            'Content-Type': content_type,
+            'Content-Encoding': encoding,
+            'Content-Length': str(length),
+        }))
+    return (code, length, encoding)
+
+
+def send(url, chunks, encoding, content_type=CONTENT_JSON, headers=None):
+    """
+    Send the submission document as is if the encoding is "legacy" or
+    compressed otherwise, return the HTTP response code, the number of
+    bytes sent, and the encoding actually used.
+    """
+    if encoding != 'legacy':
+        return post_compressed(url, chunks, encoding, content_type, headers)
+    data = b''.join(chunks)
+    if content_type == CONTENT_JSON:
+        # The original submission did not specify a content type
+        return (post(url, data, headers), len(data), encoding)
+    return (post(url, data, dict(headers or {},
+                                 **{'Content-Type': content_type})),
+            len(data), encoding)
+
+
+def server_has(url, filename, fingerprint):
+    """
+    Send a HEAD request with the hardware fingerprint as an entity tag
+    in the If-None-Match header; return True if the server responds
+    with 304 Not Modified, i.e. it already has the data of this exact
+    node, and False on any other response.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode({'filename': filename})
+    req = urllib.request.Request(
+        urllib.parse.urlunsplit(parts._replace(
+            query=parts.query + '&' + query if parts.query else query)),
+        headers={'If-None-Match': '"{fp}"'.format(fp=fingerprint)},
+        method='HEAD')
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.getcode() == 304
+    except urllib.error.HTTPError as e:
+        return e.code == 304
+
+
+def load_negotiated(path, url):
+    """
+    Return the content type that the server at the specified URL was
+    last found to accept, or None if it is not known.
+    """
+    try:
+        with open(path, mode='r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data.get(url)
+
+
+def save_negotiated(path, url, content_type):
+    """
+    Remember the content type that the server at the specified URL
+    accepts, forgetting about any other servers.
+    """
+    spstore.atomic_write(path, json.dumps({url: content_type})
+                         .encode('utf-8'))
+
+
+def forget_negotiated(path):
+    """
+    Forget the content types accepted by the servers.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def post_negotiated(url, build, encoding, path, headers=None):
+    """
+    Send the submission document as CBOR unless the server is known not
+    to accept it, falling back to JSON if the server rejects it with
+    a 406 or 415 response code and remembering that for the next time.
+    The `build` function is passed the content type and returns
+    the chunks of the document. Return the HTTP response code,
+    the number of bytes sent, the encoding, and the content type.
+    """
+    content_type = load_negotiated(path, url)
+    if content_type != CONTENT_JSON:
+        try:
+            (code, length, encoding) = send(url, build(CONTENT_CBOR),
+                                            encoding, CONTENT_CBOR, headers)
+        except urllib.error.HTTPError as e:
+            if e.code not in UNSUPPORTED_TYPE_CODES:
+                raise
+        else:
+            if content_type is None and code >= 200 and code < 300:
+                save_negotiated(path, url, CONTENT_CBOR)
+            return (code, length, encoding, CONTENT_CBOR)
+        save_negotiated(path, url, CONTENT_JSON)
+
+    (code, length, encoding) = send(url, build(CONTENT_JSON), encoding,
+                                    headers=headers)
+    return (code, length, encoding, CONTENT_JSON)
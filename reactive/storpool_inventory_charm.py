@@ -5,14 +5,17 @@ A Juju charm that collects system information and sends it to the StorPool
 
 from __future__ import print_function
 
+import cProfile
+import functools
 import json
 import os
 import platform
-import subprocess
 import tempfile
-import urllib.request
+import time
+import urllib.error
 
 from charms import reactive
+from charms.reactive import bus as rbus
 from charms.reactive import helpers as rhelpers
 
 from charmhelpers.core import hookenv
@@ -21,29 +24,42 @@ from spcharms import repo as sprepo
 from spcharms import status as spstatus
 from spcharms import utils as sputils
 
+from spinventory import backoff as spbackoff
+from spinventory import collect as spcollect
+from spinventory import delta as spdelta
+from spinventory import fingerprint as spfingerprint
+from spinventory import history as sphistory
+from spinventory import hotplug as sphotplug
+from spinventory import model as spmodel
+from spinventory import native as spnative
+from spinventory import packages as sppackages
+from spinventory import peers as sppeers
+from spinventory import profiling as spprofiling
+from spinventory import schedule as spschedule
+from spinventory import sender as spsender
+from spinventory import spool as spspool
+from spinventory import store as spstore
+from spinventory import submit as spsubmit
+
 datadir = '/var/lib/storpool'
 datafile = datadir + '/collect.json'
-collect_commands = """#!/bin/bash
-
-cd {w} || exit 1
-[[ $UID -ne 0 ]] && p=sudo
-
-$p dmidecode > dmidecode.txt 2>dmidecode.err
-$p free -m > free-m.txt 2>free-m.err
-$p lsblk > lsblk.txt 2>lsblk.err
-$p lspci > lspci.txt 2>lspci.err
-$p lspci -vv > lspci-vv.txt 2>lspci-vv.err
-$p lspci -vvnnqD > lspci-vvnnqD.txt 2>lspci-vvnnqD.err
-$p lshw > lshw.txt 2>lshw.err
-$p lscpu > lscpu.txt 2>lscpu.err
-$p lsmod > lsmod.txt 2>lsmod.err
-$p nvme list > nvme-list.txt 2>nvme-list.err
-$p ls -l /dev/disk/by-id > ls-dev-disk-by-id.txt 2>ls-dev-disk-by-id.err
-$p ls -l /dev/disk/by-path > ls-dev-disk-by-path.txt 2>ls-dev-disk-by-path.err
-$p ls -l /sys/class/net > ls-sys-class-net.txt 2>ls-sys-class-net.err
-$p ip address list > ip-address-list.txt 2>ip-address-list.err
-$p ip link list > ip-link-list.txt 2>ip-link-list.err
-"""
+aggregatefile = datadir + '/inventory-aggregated.json'
+backofffile = datadir + '/inventory-backoff.json'
+fingerprintfile = datadir + '/inventory-fingerprint.json'
+historydir = datadir + '/inventory-history'
+manifestfile = datadir + '/submitted-manifest.json'
+negotiatefile = datadir + '/inventory-content-type.json'
+pkgcachefile = datadir + '/inventory-packages.json'
+profiledir = datadir + '/inventory-profiles'
+queuefile = datadir + '/inventory-hotplug.queue'
+schedulefile = datadir + '/inventory-schedule.json'
+senderdir = datadir + '/inventory-sender'
+spooldir = datadir + '/inventory-spool'
+storedir = datadir + '/inventory-store'
+summaryfile = datadir + '/inventory-summary.txt'
+udevrulesfile = sphotplug.RULES_FILE
+
+profiler_active = False
 
 
 def rdebug(s):
@@ -53,7 +69,198 @@ def rdebug(s):
     sputils.rdebug(s, prefix='inventory-charm')
 
 
+def profiled(func):
+    """
+    Run a reactive handler under cProfile if the `profile_hooks`
+    configuration setting is enabled and store the report.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global profiler_active
+        config = hookenv.config()
+        if profiler_active or not config.get('profile_hooks', False):
+            return func(*args, **kwargs)
+
+        prof = cProfile.Profile()
+        profiler_active = True
+        try:
+            return prof.runcall(func, *args, **kwargs)
+        finally:
+            profiler_active = False
+            name = spprofiling.report_name(hookenv.hook_name(),
+                                           func.__name__)
+            try:
+                path = spprofiling.save(
+                    prof, profiledir, name, config.get('profile_keep', 0),
+                    config.get('profile_top', spprofiling.DEFAULT_TOP))
+                rdebug('saved the profile of {name} to {path}.prof'
+                       .format(name=name, path=path))
+            except Exception as e:
+                rdebug('could not save the profile of {name}: {e}'
+                       .format(name=name, e=e))
+
+    # All the wrappers share the same code object, so let charms.reactive
+    # identify the handlers by the wrapped functions instead.
+    wrapper._action_id = rbus._action_id(func)
+    wrapper._short_action_id = rbus._short_action_id(func)
+    return wrapper
+
+
+def read_collected():
+    """
+    Read the previously collected data, if there is any: the most recent
+    snapshot in the store or, if there is none, the collected data file.
+    """
+    try:
+        manifest = spstore.latest_manifest(storedir)
+        if manifest is not None:
+            return spstore.load_sections(storedir, manifest)
+    except (OSError, ValueError) as e:
+        rdebug('could not read the latest snapshot from {sd}: {e}'
+               .format(sd=storedir, e=e))
+
+    try:
+        with open(datafile, mode='r', encoding='latin1') as f:
+            collected = json.load(f)
+    except (OSError, ValueError) as e:
+        rdebug('could not read {df}: {e}'.format(df=datafile, e=e))
+        return None
+    if not isinstance(collected, dict):
+        return None
+    return collected
+
+
+def collected_manifest():
+    """
+    Return the manifest of the most recent snapshot in the store or,
+    if there is none, compute it from the collected data file.
+    """
+    manifest = spstore.latest_manifest(storedir)
+    if manifest is not None:
+        return manifest
+    rdebug('about to read {df}'.format(df=datafile))
+    with open(datafile, mode='r', encoding='latin1') as f:
+        return spdelta.build_manifest(json.load(f))
+
+
+def load_collected_sections(manifest, names):
+    """
+    Load the specified sections of the most recent snapshot, either from
+    the store or from the collected data file.
+    """
+    if spstore.latest_manifest(storedir) == manifest:
+        return spstore.load_sections(storedir, manifest, names)
+    with open(datafile, mode='r', encoding='latin1') as f:
+        collected = json.load(f)
+    return dict((name, collected[name]) for name in names)
+
+
+def submitted_status():
+    """
+    Describe the submitted data in the unit's workload status.
+    """
+    try:
+        with open(summaryfile, mode='r') as f:
+            summary = f.read().strip()
+    except OSError:
+        summary = ''
+    if not summary:
+        return 'here, have a blob of data'
+    return 'submitted, ' + summary
+
+
+def unit_name():
+    """
+    Return a name identifying this unit, used to spread the submissions.
+    """
+    try:
+        return hookenv.local_unit()
+    except KeyError:
+        return platform.node()
+
+
+def publish_to_peers(relids):
+    """
+    Publish the collected data on the peer relation for the leader to
+    submit along with that of the other units.
+    """
+    settings = {
+        sppeers.KEY_NODE: platform.node(),
+        sppeers.KEY_HASH: sppeers.file_hash(datafile),
+        sppeers.KEY_DATA: sppeers.encode_payload(datafile),
+    }
+    rdebug('publishing {ln} characters of data with hash {h} on {rids}'
+           .format(ln=len(settings[sppeers.KEY_DATA]),
+                   h=settings[sppeers.KEY_HASH], rids=' '.join(relids)))
+    for rid in relids:
+        hookenv.relation_set(rid, settings)
+
+
+def aggregated_nodes():
+    """
+    Gather the collected data of this unit and of the ones that published
+    theirs on the peer relation; return the (filename, chunks) tuples for
+    the nodes whose data has changed since the last submission, and
+    the content hashes of all the nodes' data.
+    """
+    submitted = sppeers.load_submitted(aggregatefile)
+    node = platform.node()
+    hashes = {node: sppeers.file_hash(datafile)}
+    nodes = []
+    if submitted.get(node) != hashes[node]:
+        nodes.append((node, spsubmit.file_chunks(datafile)))
+
+    for rid in hookenv.relation_ids(sppeers.RELATION):
+        for unit in hookenv.related_units(rid):
+            data = sppeers.published(hookenv.relation_get(rid=rid,
+                                                          unit=unit))
+            if data is None:
+                rdebug('nothing published by {unit} yet'.format(unit=unit))
+                continue
+            (name, phash, payload) = data
+            if name in hashes:
+                continue
+            hashes[name] = phash
+            if submitted.get(name) != phash:
+                nodes.append((name, sppeers.payload_chunks(payload)))
+    return (nodes, hashes)
+
+
+def payload_version():
+    """
+    Return the configured version of the collected data format.
+    """
+    version = hookenv.config().get('payload_version', 1)
+    if version not in spcollect.PAYLOAD_VERSIONS:
+        rdebug('unsupported payload_version {v}, using 1'.format(v=version))
+        return 1
+    return version
+
+
+def configured_collectors():
+    """
+    Return the collectors to run for the configured payload version.
+    """
+    return spcollect.collectors(
+        native=hookenv.config().get('native_collectors', True),
+        version=payload_version())
+
+
+def recollect_intervals():
+    """
+    Return the configured re-collection interval for each tier.
+    """
+    config = hookenv.config()
+    return {
+        spschedule.TIER_VOLATILE:
+            config.get('recollect_volatile_interval', 0),
+        spschedule.TIER_STATIC:
+            config.get('recollect_static_interval', 0),
+    }
+
+
 @reactive.hook('install')
+@profiled
 def first_install():
     """
     On initial installation, note that we need to collect and submit the data.
@@ -67,7 +274,29 @@ def first_install():
     spstatus.npset('maintenance', 'setting up')
 
 
+def setup_hotplug_watch():
+    """
+    Install or remove the udev rules recording the hotplug events.
+    """
+    if hookenv.config().get('hotplug_watch', False):
+        if not os.path.isdir(datadir):
+            os.mkdir(datadir, mode=0o700)
+        changed = sphotplug.install_rules(udevrulesfile, queuefile)
+        if changed:
+            rdebug('installed the udev rules in {path}'
+                   .format(path=udevrulesfile))
+    else:
+        changed = sphotplug.remove_rules(udevrulesfile)
+        if changed:
+            rdebug('removed the udev rules from {path}'
+                   .format(path=udevrulesfile))
+        sphotplug.forget(queuefile)
+    if changed:
+        sphotplug.reload_udev()
+
+
 @reactive.hook('config-changed')
+@profiled
 def have_config():
     """
     Check whether the `submit_url` configuration parameter has been set or
@@ -75,6 +304,16 @@ def have_config():
     """
     rdebug('config-changed')
     config = hookenv.config()
+    setup_hotplug_watch()
+
+    if config.changed('payload_version') and \
+       rhelpers.is_state('storpool-inventory.collected'):
+        rdebug('the payload version changed, collecting everything anew')
+        spschedule.forget(schedulefile)
+        reactive.remove_state('storpool-inventory.collected')
+        reactive.set_state('storpool-inventory.collecting')
+        reactive.set_state('storpool-inventory.submitting')
+        reactive.remove_state('storpool-inventory.submitted')
 
     url = config.get('submit_url', None)
     if url is not None and url != '':
@@ -84,6 +323,15 @@ def have_config():
             reactive.set_state('storpool-inventory.configured')
             rdebug('we have a new submission URL address: {url}'
                    .format(url=url))
+            spdelta.forget_manifest(manifestfile)
+            sppeers.forget_submitted(aggregatefile)
+            if not os.path.isdir(datadir):
+                os.mkdir(datadir, mode=0o700)
+            delay = spbackoff.defer(backofffile, unit_name(),
+                                    config.get('submit_splay', 0))
+            if delay > 0:
+                rdebug('putting off the submission for {d:.0f} seconds'
+                       .format(d=delay))
             reactive.set_state('storpool-inventory.submitting')
             reactive.remove_state('storpool-inventory.submitted')
 
@@ -109,36 +357,48 @@ def have_config():
 
 @reactive.when('storpool-inventory.collecting')
 @reactive.when_not('storpool-inventory.collected')
+@profiled
 def collect():
     """
-    Generate and run a shell script invoking various system tools to
-    collect some information.
+    Run various system tools in parallel to collect some information.
     """
     spstatus.reset()
     rdebug('about to collect some data, are we not')
     reactive.remove_state('storpool-inventory.collecting')
 
-    spstatus.npset('maintenance', 'installing packages for data collection')
-    try:
-        (err, newly_installed) = sprepo.install_packages({
-            'dmidecode': '*',
-            'lshw': '*',
-            'nvme-cli': '*',
-            'pciutils': '*',
-            'usbutils': '*',
-        })
-        if err is not None:
-            raise Exception('{e}'.format(e=err))
-        if newly_installed:
-            rdebug('it seems we installed some new packages: {lst}'
-                   .format(lst=' '.join(newly_installed)))
-        else:
-            rdebug('it seems we already had everything we needed')
-        sprepo.record_packages('storpool-inventory-charm', newly_installed)
-        spstatus.npset('maintenance', '')
-    except Exception as e:
-        sputils.err('failed to install the OS packages')
-        return
+    if sppackages.cache_valid(pkgcachefile):
+        rdebug('the data collection tools are already installed')
+    else:
+        spstatus.npset('maintenance',
+                       'installing packages for data collection')
+        try:
+            versions = sppackages.installed_packages()
+            missing = sppackages.missing_packages(versions)
+            if missing:
+                rdebug('some packages seem to be missing: {lst}'
+                       .format(lst=' '.join(missing)))
+                (err, newly_installed) = sprepo.install_packages(
+                    dict((name, '*') for name in sppackages.PACKAGES))
+                if err is not None:
+                    raise Exception('{e}'.format(e=err))
+                if newly_installed:
+                    rdebug('it seems we installed some new packages: {lst}'
+                           .format(lst=' '.join(newly_installed)))
+                else:
+                    rdebug('it seems we already had everything we needed')
+                sprepo.record_packages('storpool-inventory-charm',
+                                       newly_installed)
+                versions = sppackages.installed_packages()
+            else:
+                rdebug('it seems we already had everything we needed')
+
+            if not os.path.isdir(datadir):
+                os.mkdir(datadir, mode=0o700)
+            sppackages.save_cache(pkgcachefile, versions)
+            spstatus.npset('maintenance', '')
+        except Exception as e:
+            sputils.err('failed to install the OS packages')
+            return
 
     spstatus.npset('maintenance', 'collecting data')
     try:
@@ -156,49 +416,158 @@ def collect():
             """
             workdir = d
 
-            collect_script = workdir + '/collect.sh'
-            with open(collect_script, mode='w') as f:
-                print(collect_commands.format(w=workdir), end='', file=f)
-            os.chmod(collect_script, 0o700)
-            rdebug('running the collect script'.format(cs=collect_script))
-            subprocess.call([
-                             'sh',
-                             '-c',
-                             "{cs} > '{w}/collect.txt' 2>'{w}/collect.err'"
-                             .format(cs=collect_script, w=workdir)
-                            ])
-
-            collected = {}
+            config = hookenv.config()
+            concurrency = config.get('collect_concurrency',
+                                     spcollect.DEFAULT_CONCURRENCY)
+            timeout = config.get('collect_timeout',
+                                 spcollect.DEFAULT_TIMEOUT)
+            if timeout is not None and timeout <= 0:
+                timeout = None
+            try:
+                timeouts = spcollect.parse_timeouts(
+                    config.get('collect_timeouts', ''))
+            except ValueError as e:
+                rdebug('ignoring the collect_timeouts setting: {e}'
+                       .format(e=e))
+                timeouts = {}
+            collectors = configured_collectors()
+            previous = read_collected()
+            pending = spschedule.take_pending(schedulefile)
+            partial = bool(pending) and previous is not None
+            if partial:
+                collectors = [col for col in collectors
+                              if col.name in pending]
+                rdebug('only re-collecting {lst}'
+                       .format(lst=' '.join(col.name
+                                            for col in collectors)))
+            rdebug('running {n} collectors ({nn} native), {c} at a time, '
+                   'time budget {t} seconds'
+                   .format(n=len(collectors),
+                           nn=len([col for col in collectors
+                                   if col.func is not None]),
+                           c=concurrency, t=timeout))
+            start = time.monotonic()
+            results = spcollect.run_collectors(collectors, workdir,
+                                               concurrency, timeout,
+                                               timeouts)
+            duration = time.monotonic() - start
+            for res in results:
+                rdebug('- {name}: exit code {code}{to}, {d:.3f}s, '
+                       '{out}/{err} bytes of output'
+                       .format(name=res.name, code=res.returncode,
+                               to=' (timed out)' if res.timed_out else '',
+                               d=res.duration, out=res.stdout_bytes,
+                               err=res.stderr_bytes))
+            summary = spcollect.summarize(results, duration)
+            rdebug(summary)
+
             rdebug('scanning the {w} directory now'.format(w=workdir))
-            for e in os.scandir(workdir):
-                if not e.is_file():
-                    continue
-                rdebug('- {name}'.format(name=e.name))
-                with open(workdir + '/' + e.name, mode='r',
-                          encoding='latin1') as f:
-                    collected[e.name] = ''.join(f.readlines())
+            section_max = config.get('section_max_bytes', 0)
+            collected = spcollect.read_sections(workdir, section_max)
+            timed_out = [res.name for res in results if res.timed_out]
+            truncated = spcollect.truncated_sections(results, section_max)
+            if partial:
+                names = set(col.name for col in collectors)
+                timed_out.extend(name
+                                 for name in previous.get('_timeouts', [])
+                                 if name not in names)
+                for (name, size) in previous.get('_truncated', {}).items():
+                    if name not in collected:
+                        truncated[name] = size
+                merged = dict(previous)
+                merged.update(collected)
+                collected = merged
+            collected['_timeouts'] = sorted(timed_out)
+            collected['_truncated'] = truncated
+            collected['_version'] = payload_version()
+            collected['_meta'] = spcollect.build_meta(
+                results, duration,
+                previous.get('_meta') if partial else None)
+            if collected['_timeouts']:
+                rdebug('some collectors timed out: {lst}'
+                       .format(lst=' '.join(collected['_timeouts'])))
+            try:
+                collected['structured'] = spmodel.build_structured(
+                    collected, spnative.disk_sizes())
+            except Exception as e:
+                rdebug('could not parse the collected data: {e}'
+                       .format(e=e))
             rdebug('collected {ln} entries: {ks}'
                    .format(ln=len(collected), ks=sorted(collected.keys())))
-            data = json.dumps(collected)
+            data = spcollect.fit_payload(collected,
+                                         config.get('payload_max_bytes', 0),
+                                         truncated)
             rdebug('and dumped them to {ln} characters of data'
                    .format(ln=len(data)))
+            if truncated:
+                rdebug('some sections were cut short: {lst}'
+                       .format(lst=' '.join(sorted(truncated.keys()))))
 
             global datafile
+            changed = previous is not None and \
+                spdelta.snapshot_changed(previous, collected)
+            # The data being sent in the background is not lost either
+            if changed and config.get('submit_spool', False) and \
+               not rhelpers.is_state('storpool-inventory.submitted') and \
+               not rhelpers.is_state('storpool-inventory.sending') and \
+               os.path.isfile(datafile):
+                spooled = spspool.add(spooldir, datafile)
+                rdebug('spooled the unsubmitted data as {sp}'
+                       .format(sp=spooled))
+                for path in spspool.evict(spooldir,
+                                          config.get('spool_max_bytes', 0),
+                                          config.get('spool_max_age', 0)):
+                    rdebug('evicted {path} from the spool'.format(path=path))
+
             rdebug('about to write {df}'.format(df=datafile))
             if not os.path.isdir(datadir):
                 os.mkdir(datadir, mode=0o700)
-            with open(datafile, mode='w', encoding='latin1') as f:
-                rdebug('about to write to the file')
-                print(data, file=f)
-                rdebug('done writing to the file, it seems')
+            (_, written) = spstore.put_snapshot(storedir, collected)
+            rdebug('stored {w} new sections out of {n} in {sd}'
+                   .format(w=written, n=len(collected), sd=storedir))
+            spstore.atomic_write(datafile, (data + '\n').encode('latin1'))
             rdebug('about to check the size of the collect file')
             st = os.stat(datafile)
             rdebug('it seems we wrote {ln} bytes to the file'
                    .format(ln=st.st_size))
+            (snaps, objects) = spstore.gc(
+                storedir, config.get('store_keep_snapshots', 5))
+            if snaps or objects:
+                rdebug('removed {s} old snapshots and {o} unreferenced '
+                       'sections from the store'.format(s=snaps, o=objects))
+            if config.get('keep_history', False):
+                try:
+                    recorded = sphistory.record(
+                        historydir, collected, collected['_meta']['timestamp'],
+                        previous)
+                    if recorded is None:
+                        rdebug('started a new history in {hd}'
+                               .format(hd=historydir))
+                    elif recorded:
+                        rdebug('recorded the changes in {lst}'
+                               .format(lst=' '.join(recorded)))
+                    folded = sphistory.prune(
+                        historydir, config.get('history_max_entries', 0),
+                        config.get('history_max_age', 0))
+                    if folded:
+                        rdebug('folded {n} old history entries into the base'
+                               .format(n=folded))
+                except Exception as e:
+                    rdebug('could not record the history: {e}'.format(e=e))
+            else:
+                sphistory.forget(historydir)
+            spschedule.record_run(schedulefile,
+                                  [col.name for col in collectors])
+            spstore.atomic_write(summaryfile, (summary + '\n').encode('utf-8'))
+
+            if changed:
+                rdebug('the collected data changed, resubmitting it')
+                reactive.set_state('storpool-inventory.submitting')
+                reactive.remove_state('storpool-inventory.submitted')
 
             rdebug('we seem to be done here!')
             reactive.set_state('storpool-inventory.collected')
-            spstatus.npset('maintenance', '')
+            spstatus.npset('maintenance', summary)
     except Exception as e:
         rdebug('something bad happened: {e}'.format(e=e))
         sputils.err('maintenance', 'failed to collect the data')
@@ -208,6 +577,7 @@ def collect():
 @reactive.when('storpool-inventory.collected')
 @reactive.when('storpool-inventory.submitting')
 @reactive.when_not('storpool-inventory.submitted')
+@profiled
 def nowhere_to_submit_to():
     """
     Note that we still need the `submit_url` parameter to be set.
@@ -219,49 +589,329 @@ def nowhere_to_submit_to():
 @reactive.when('storpool-inventory.collected')
 @reactive.when('storpool-inventory.submitting')
 @reactive.when_not('storpool-inventory.submitted')
+@profiled
 def try_to_submit():
     """
     Once the data has been collected and `submit_url` is set, go ahead.
     """
     url = hookenv.config().get('submit_url', None)
     rdebug('trying to submit to {url}'.format(url=url))
+    if rhelpers.is_state('storpool-inventory.sending'):
+        rdebug('a background submission is still in progress')
+        return
     reactive.remove_state('storpool-inventory.submitting')
 
     if url is None:
         rdebug('erm, how did we get here with no submit URL?')
         return
 
+    config = hookenv.config()
+    delay = spbackoff.remaining(backofffile)
+    if delay > 0:
+        rdebug('not trying to submit for another {d:.0f} seconds'
+               .format(d=delay))
+        spstatus.npset('maintenance',
+                       'waiting {d:.0f} seconds before submitting the data'
+                       .format(d=delay))
+        return
+
+    aggregate = False
+    if config.get('submit_via_leader', False):
+        try:
+            relids = hookenv.relation_ids(sppeers.RELATION)
+            if relids:
+                publish_to_peers(relids)
+            if hookenv.is_leader():
+                rdebug('we are the leader, submitting the data of all '
+                       'the units')
+                aggregate = True
+            elif relids:
+                reactive.set_state('storpool-inventory.submitted')
+                spstatus.set('active', 'published to the leader, ' +
+                             submitted_status())
+                return
+            else:
+                rdebug('no peer relation yet, submitting directly')
+        except Exception as e:
+            rdebug('could not publish the data: {e}'.format(e=e))
+            sputils.err('failed to publish the collected data')
+            return
+
     spstatus.npset('maintenance', 'submitting the collected data')
+    code = None
+    retry_after = None
     try:
-        global datafile
-        rdebug('about to read {df}'.format(df=datafile))
-        with open(datafile, mode='r', encoding='latin1') as f:
-            contents = ''.join(f.readlines())
-        rdebug('read {ln} characters of data from the collect file'
-               .format(ln=len(contents)))
-        data = json.dumps({'filename': platform.node(), 'contents': contents})
-        rdebug('encoded stuff into {ln} characters of data to submit'
-               .format(ln=len(data)))
-        data_enc = data.encode('latin1')
-        rdebug('submitting {ln} bytes of data to {url}'
-               .format(ln=len(data_enc), url=url))
-        with urllib.request.urlopen(url, data=data_enc) as resp:
-            rdebug('got some kind of an HTTP response')
-            code = resp.getcode()
-            rdebug('got response code {code}'.format(code=code))
-            if code is not None and code >= 200 and code < 300:
-                rdebug('success!')
+        encoding = config.get('submit_encoding', 'legacy')
+        if encoding not in spsubmit.ENCODINGS:
+            rdebug('unsupported submit_encoding "{enc}", using "legacy"'
+                   .format(enc=encoding))
+            encoding = 'legacy'
+
+        manifest = None
+        hashes = None
+        spooled = []
+        build = None
+        fprint = None
+        check = False
+        headers = None
+        background = config.get('submit_async', False)
+        if config.get('submit_spool', False) and not aggregate:
+            for path in spspool.evict(spooldir,
+                                      config.get('spool_max_bytes', 0),
+                                      config.get('spool_max_age', 0)):
+                rdebug('evicted {path} from the spool'.format(path=path))
+            spooled = spspool.entries(spooldir)
+
+        if aggregate:
+            (nodes, hashes) = aggregated_nodes()
+            if not nodes:
+                rdebug('nothing changed for any of the {n} nodes'
+                       .format(n=len(hashes)))
                 reactive.set_state('storpool-inventory.submitted')
-                spstatus.set('active', 'here, have a blob of data')
+                spstatus.set('active', submitted_status())
+                return
+            rdebug('submitting the data of {lst}'
+                   .format(lst=' '.join(name for (name, _) in nodes)))
+            chunks = spsubmit.multi_chunks(nodes)
+            if encoding == 'legacy':
+                encoding = 'gzip'
+        elif spooled:
+            rdebug('submitting {n} spooled snapshots along with {df}'
+                   .format(n=len(spooled), df=datafile))
+            if config.get('submit_delta', False):
+                manifest = collected_manifest()
+            chunks = spsubmit.batch_chunks(
+                platform.node(),
+                spooled + [(os.stat(datafile).st_mtime, datafile)])
+        elif config.get('submit_delta', False):
+            manifest = collected_manifest()
+            previous = spdelta.load_manifest(manifestfile)
+            collected = load_collected_sections(
+                manifest, spdelta.changed_sections(previous, manifest))
+            delta = spdelta.build_delta(platform.node(), collected,
+                                        manifest, previous)
+            rdebug('submitting {ch} changed and {rm} removed sections '
+                   'out of {total}'
+                   .format(ch=len(delta['sections']),
+                           rm=len(delta['removed']), total=len(manifest)))
+            build = functools.partial(spsubmit.delta_chunks, delta)
+        else:
+            if config.get('submit_conditional', False):
+                fprint = spfingerprint.fingerprint(read_collected() or {})
+            check = fprint is not None and \
+                spfingerprint.load_acknowledged(fingerprintfile,
+                                                url) is None
+            if check and not background:
+                rdebug('asking {url} whether it already has the data with '
+                       'the {fp} fingerprint'.format(url=url, fp=fprint))
+                if spsubmit.server_has(url, platform.node(), fprint):
+                    rdebug('it does, not submitting the data again')
+                    submission_succeeded(url, [], None, None, fprint)
+                    return
+            if fprint is not None:
+                headers = {spsubmit.FINGERPRINT_HEADER: fprint}
+            rdebug('about to read {df}'.format(df=datafile))
+            build = functools.partial(spsubmit.snapshot_chunks,
+                                      platform.node(), datafile, encoding)
+
+        if background:
+            content_type = spsubmit.CONTENT_JSON
+            if build is not None:
+                if config.get('submit_binary', False) and \
+                   spsubmit.load_negotiated(negotiatefile, url) != \
+                   spsubmit.CONTENT_JSON:
+                    content_type = spsubmit.CONTENT_CBOR
+                chunks = build(content_type)
+            job = spsender.prepare(
+                senderdir, url, chunks, encoding, content_type, headers,
+                fprint if check else None, platform.node(),
+                config.get('submit_timeout', spsender.DEFAULT_TIMEOUT),
+                {
+                    'spooled': [path for (_, path) in spooled],
+                    'hashes': hashes,
+                    'manifest': manifest,
+                    'fingerprint': fprint,
+                })
+            pid = spsender.spawn(senderdir,
+                                 os.path.join(hookenv.charm_dir(), 'lib'))
+            rdebug('started the background sender, pid {pid}, for {ln} '
+                   'bytes of {ct} data ({enc})'
+                   .format(pid=pid, ln=job['length'], ct=content_type,
+                           enc=job['encoding']))
+            reactive.set_state('storpool-inventory.sending')
+            spstatus.npset('maintenance',
+                           'submitting the collected data in the background')
+            return
+
+        try:
+            if build is not None and config.get('submit_binary', False):
+                (code, length, encoding, content_type) = \
+                    spsubmit.post_negotiated(url, build, encoding,
+                                             negotiatefile, headers)
+            else:
+                if build is not None:
+                    chunks = build(spsubmit.CONTENT_JSON)
+                content_type = spsubmit.CONTENT_JSON
+                (code, length, encoding) = spsubmit.send(
+                    url, chunks, encoding, headers=headers)
+            rdebug('submitted {ln} bytes of {ct} data ({enc}) to {url}'
+                   .format(ln=length, ct=content_type, enc=encoding,
+                           url=url))
+        except urllib.error.HTTPError as e:
+            code = e.code
+            if code in spbackoff.RETRY_AFTER_CODES and e.headers is not None:
+                retry_after = spbackoff.parse_retry_after(
+                    e.headers.get('Retry-After'))
+            rdebug('the server rejected the submission: {e}'.format(e=e))
+            sputils.err('failed to submit the collected data')
+        rdebug('got response code {code}'.format(code=code))
+        if code is not None and code >= 200 and code < 300:
+            submission_succeeded(url, [path for (_, path) in spooled],
+                                 hashes, manifest, fprint)
+            return
     except Exception as e:
         rdebug('could not submit the data: {e}'.format(e=e))
         sputils.err('failed to submit the collected data')
 
+    submission_failed(code, retry_after)
+
+
+def submission_succeeded(url, spooled, hashes, manifest, fprint):
+    """
+    Record a successful submission: forget about any earlier failures,
+    remove the submitted spooled snapshots, and remember what the server
+    now has.
+    """
+    rdebug('success!')
+    spbackoff.forget(backofffile)
+    spspool.remove(spooled)
+    if hashes is not None:
+        sppeers.save_submitted(aggregatefile, hashes)
+    if manifest is not None:
+        spdelta.save_manifest(manifestfile, manifest)
+    if fprint is not None:
+        spfingerprint.save_acknowledged(fingerprintfile, url, fprint)
+    reactive.set_state('storpool-inventory.submitted')
+    spstatus.set('active', submitted_status())
+
+
+def submission_failed(code, retry_after):
+    """
+    Put off the next submission attempt after a failed one.
+    """
+    config = hookenv.config()
+    delay = spbackoff.record_failure(
+        backofffile, unit_name(), config.get('submit_backoff_base', 0),
+        config.get('submit_backoff_max', 0), retry_after)
+    rdebug('the submission failed{code}{ra}, next attempt in '
+           '{d:.0f} seconds'
+           .format(code='' if code is None
+                   else ' with code {code}'.format(code=code),
+                   ra='' if retry_after is None
+                   else ', the server asked us to wait {ra:.0f} seconds'
+                   .format(ra=retry_after),
+                   d=delay))
+
+
+@reactive.when('storpool-inventory.sending')
+@profiled
+def check_background_submission():
+    """
+    Process the outcome of the background submission once it is known.
+    """
+    (state, job, result) = spsender.status(senderdir)
+    if state == 'running':
+        rdebug('the background submission is still in progress')
+        spstatus.npset('maintenance',
+                       'submitting the collected data in the background')
+        return
+
+    rdebug('the background submission is {state}'.format(state=state))
+    reactive.remove_state('storpool-inventory.sending')
+    spsender.clear(senderdir)
+    if state == 'idle':
+        reactive.set_state('storpool-inventory.submitting')
+        reactive.remove_state('storpool-inventory.submitted')
+        return
+
+    code = None if result is None else result['code']
+    if result is not None and result['error'] is not None:
+        rdebug('the background sender reported: {e}'
+               .format(e=result['error']))
+    context = job['context']
+    if result is not None and result['not_modified']:
+        rdebug('the server already has the data, it was not sent again')
+        submission_succeeded(job['url'], [], None, None,
+                             context['fingerprint'])
+    elif code is not None and code >= 200 and code < 300:
+        submission_succeeded(job['url'], context['spooled'],
+                             context['hashes'], context['manifest'],
+                             context['fingerprint'])
+    elif code in spsubmit.UNSUPPORTED_TYPE_CODES and \
+            job['content_type'] == spsubmit.CONTENT_CBOR:
+        rdebug('the server does not accept CBOR, sending JSON instead')
+        spsubmit.save_negotiated(negotiatefile, job['url'],
+                                 spsubmit.CONTENT_JSON)
+        reactive.set_state('storpool-inventory.submitting')
+        return
+    else:
+        sputils.err('failed to submit the collected data')
+        submission_failed(code, result and result['retry_after'])
+        return
+
+    # Something changed while the data was being sent
+    if rhelpers.is_state('storpool-inventory.submitting'):
+        rdebug('the collected data changed in the meantime')
+        reactive.remove_state('storpool-inventory.submitted')
+
+
+@reactive.hook('leader-elected',
+               'inventory-peers-relation-changed',
+               'inventory-peers-relation-departed')
+@profiled
+def peers_changed():
+    """
+    Let the leader submit the data that the other units have published.
+    """
+    if not hookenv.config().get('submit_via_leader', False):
+        return
+    if not hookenv.is_leader():
+        rdebug('the peers changed, but we are not the leader')
+        return
+    rdebug('the peers changed, submitting the data of all the units')
+    reactive.set_state('storpool-inventory.submitting')
+    reactive.remove_state('storpool-inventory.submitted')
+
+
+@reactive.when('storpool-inventory.collected')
+@reactive.when_not('storpool-inventory.collecting')
+@profiled
+def process_hotplug_events():
+    """
+    Re-collect the sections affected by any recorded hotplug events.
+    """
+    events = sphotplug.take_events(queuefile)
+    if not events:
+        return
+    rdebug('processing {n} hotplug events: {lst}'
+           .format(n=len(events),
+                   lst=', '.join(' '.join(ev) for ev in events)))
+    names = sphotplug.affected_collectors(
+        events, [col.name for col in configured_collectors()])
+    if not names:
+        return
+    rdebug('triggering a re-collection of {lst}'.format(lst=' '.join(names)))
+    spschedule.request(schedulefile, names)
+    reactive.remove_state('storpool-inventory.collected')
+    reactive.set_state('storpool-inventory.collecting')
+
 
 @reactive.hook('update-status')
+@profiled
 def submit_if_needed():
     """
-    Retry collecting and/or submitting the data if the last attempt failed.
+    Retry collecting and/or submitting the data if the last attempt failed,
+    re-collect any sections that are due for a refresh.
     """
     rdebug('update-status invoked')
 
@@ -270,7 +920,18 @@ def submit_if_needed():
         spstatus.reset()
         reactive.set_state('storpool-inventory.collecting')
     else:
-        rdebug('already collected!')
+        due = spschedule.due_collectors(
+            schedulefile, [col.name for col in configured_collectors()],
+            recollect_intervals())
+        if due:
+            rdebug('triggering a re-collection of {lst}'
+                   .format(lst=' '.join(due)))
+            spschedule.request(schedulefile, due)
+            spstatus.reset()
+            reactive.remove_state('storpool-inventory.collected')
+            reactive.set_state('storpool-inventory.collecting')
+        else:
+            rdebug('already collected!')
 
     if not rhelpers.is_state('storpool-inventory.submitted'):
         rdebug('triggering a new submission attempt')
@@ -281,6 +942,7 @@ def submit_if_needed():
 
 
 @reactive.hook('upgrade-charm')
+@profiled
 def recollect_and_resubmit():
     """
     On charm upgrade, note that we need to collect and submit the data.
@@ -292,8 +954,16 @@ def recollect_and_resubmit():
     reactive.set_state('storpool-inventory.submitting')
     reactive.remove_state('storpool-inventory.submitted')
     reactive.remove_state('storpool-inventory.configured')
+    spdelta.forget_manifest(manifestfile)
+    spsubmit.forget_negotiated(negotiatefile)
+    spfingerprint.forget(fingerprintfile)
+    sppeers.forget_submitted(aggregatefile)
+    sppackages.forget_cache(pkgcachefile)
+    spschedule.forget(schedulefile)
+    spbackoff.forget(backofffile)
 
 
+# Not profiled: the reports are removed along with the rest of the data.
 @reactive.hook('stop')
 def stop():
     """
@@ -305,6 +975,25 @@ def stop():
         os.unlink(datafile)
     except Exception as e:
         rdebug('could not remove {name}: {e}'.format(name=datafile, e=e))
+    spdelta.forget_manifest(manifestfile)
+    spsubmit.forget_negotiated(negotiatefile)
+    spfingerprint.forget(fingerprintfile)
+    sppeers.forget_submitted(aggregatefile)
+    sppackages.forget_cache(pkgcachefile)
+    spschedule.forget(schedulefile)
+    spbackoff.forget(backofffile)
+    spspool.clear(spooldir)
+    spstore.forget(storedir)
+    if sphotplug.remove_rules(udevrulesfile):
+        sphotplug.reload_udev()
+    sphotplug.forget(queuefile)
+    spprofiling.forget(profiledir)
+    sphistory.forget(historydir)
+    spsender.clear(senderdir)
+    try:
+        os.unlink(summaryfile)
+    except FileNotFoundError:
+        pass
 
     rdebug('uninstalling any inventory-related packages')
     sprepo.unrecord_packages('storpool-inventory-charm')
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory charm actions.
+"""
+
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+import mock
+
+from http import client as http_client
+
+from unit_tests.test_inventory import mock_reactive_states, r_config, \
+    r_state, testee
+
+
+spec = importlib.util.spec_from_file_location(
+    'inventory_actions', os.path.realpath('actions/actions.py'))
+actions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(actions)
+
+
+class TestActions(unittest.TestCase):
+    def setUp(self):
+        super(TestActions, self).setUp()
+        r_state.r_clear_states()
+        r_config.r_clear_config()
+
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        datadir = tempdir.name
+        patcher = mock.patch.multiple(
+            testee,
+            datadir=datadir,
+            datafile=datadir + '/collect.json',
+            aggregatefile=datadir + '/inventory-aggregated.json',
+            backofffile=datadir + '/inventory-backoff.json',
+            fingerprintfile=datadir + '/inventory-fingerprint.json',
+            historydir=datadir + '/inventory-history',
+            manifestfile=datadir + '/submitted-manifest.json',
+            negotiatefile=datadir + '/inventory-content-type.json',
+            pkgcachefile=datadir + '/inventory-packages.json',
+            profiledir=datadir + '/inventory-profiles',
+            queuefile=datadir + '/inventory-hotplug.queue',
+            schedulefile=datadir + '/inventory-schedule.json',
+            senderdir=datadir + '/inventory-sender',
+            spooldir=datadir + '/inventory-spool',
+            storedir=datadir + '/inventory-store',
+            summaryfile=datadir + '/inventory-summary.txt',
+            udevrulesfile=datadir + '/90-storpool-inventory.rules',
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.params = {}
+        for name in ('action_get', 'action_set', 'action_fail'):
+            patcher = mock.patch('charmhelpers.core.hookenv.' + name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.action_get.side_effect = lambda key: self.params.get(key)
+
+        r_config.r_set('native_collectors', False, False)
+        self.collectors = testee.spcollect.COLLECTORS
+        self.collected = dict((col.name + '.txt', 'old ' + col.name)
+                              for col in self.collectors)
+        with open(testee.datafile, mode='w') as f:
+            json.dump(self.collected, f)
+
+    def test_unknown(self):
+        self.params['sections'] = 'lsblk something-else'
+        with self.assertRaises(ValueError):
+            actions.collect_now(testee)
+        with self.assertRaises(ValueError):
+            actions.submit_now(testee)
+
+    @mock_reactive_states
+    @mock.patch('spinventory.packages.cache_valid')
+    @mock.patch('subprocess.Popen')
+    def test_collect_now(self, sub_popen, pkg_cache_valid):
+        sub_popen.return_value.wait.return_value = 0
+        pkg_cache_valid.return_value = True
+        self.params['sections'] = 'nvme-list lsblk'
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+
+        actions.collect_now(testee)
+        self.assertEqual(0, self.action_fail.call_count)
+        self.assertEqual(2, sub_popen.call_count)
+        self.assertEqual(set(['storpool-inventory.collected',
+                              'storpool-inventory.submitting']),
+                         r_state.r_get_states())
+        results = self.action_set.call_args[0][0]
+        self.assertEqual('lsblk nvme-list', results['collected'])
+        self.assertEqual('true', results['changed'])
+        self.assertEqual('0', results['timings.nvme-list.returncode'])
+        self.assertIn('timings.lsblk.duration', results)
+
+        data = testee.read_collected()
+        self.assertEqual('', data['lsblk.txt'])
+        self.assertEqual('old lshw', data['lshw.txt'])
+
+    @mock_reactive_states
+    @mock.patch('urllib.request.urlopen')
+    def test_submit_now(self, urlopen):
+        r_config.r_set('submit_url', 'http://inventory.example.com/', False)
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+        urlopen.return_value = mock_client
+
+        # Only the requested sections
+        self.params['sections'] = 'lsblk'
+        actions.submit_now(testee)
+        self.assertEqual(0, self.action_fail.call_count)
+        data = json.loads(urlopen.call_args[0][0].data.decode('latin1'))
+        self.assertEqual('sections', data['format'])
+        self.assertEqual({'lsblk.txt': 'old lsblk'}, data['sections'])
+        results = self.action_set.call_args[0][0]
+        self.assertEqual('200', results['code'])
+        self.assertEqual('1', results['sections'])
+
+        # Everything, even if the last attempt failed just now
+        testee.spbackoff.record_failure(testee.backofffile, 'unit', 3600, 0)
+        self.params['sections'] = ''
+        r_state.r_set_states(set(['storpool-inventory.configured',
+                                  'storpool-inventory.collected']))
+        actions.submit_now(testee)
+        self.assertEqual(0, self.action_fail.call_count)
+        self.assertEqual(2, urlopen.call_count)
+        data = json.loads(urlopen.call_args[0][0].data.decode('latin1'))
+        self.assertEqual(self.collected, json.loads(data['contents']))
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        self.assertIn('duration', self.action_set.call_args[0][0])
+
+        # Nothing collected yet
+        r_state.r_set_states(set(['storpool-inventory.configured']))
+        actions.submit_now(testee)
+        self.assertEqual(1, self.action_fail.call_count)
+
+    @mock_reactive_states
+    def test_get_profiles(self):
+        self.params['count'] = 2
+        actions.get_profiles(testee)
+        self.assertEqual({'count': '0'}, self.action_set.call_args[0][0])
+
+        r_config.r_set('profile_hooks', True, False)
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+        for _ in range(3):
+            testee.submit_if_needed()
+        actions.get_profiles(testee)
+        results = self.action_set.call_args[0][0]
+        self.assertEqual('2', results['count'])
+        reports = testee.spprofiling.reports(testee.profiledir)
+        self.assertEqual(reports[-1][2] + '.prof',
+                         results['reports.1.file'])
+        self.assertEqual(reports[-2][2] + '.prof',
+                         results['reports.2.file'])
+        self.assertIn('submit_if_needed', results['reports.1.summary'])
+        self.assertNotIn('reports.3.file', results)
+
+        self.params['clear'] = True
+        self.params['count'] = 0
+        actions.get_profiles(testee)
+        self.assertEqual('3', self.action_set.call_args[0][0]['count'])
+        self.assertEqual([], testee.spprofiling.reports(testee.profiledir))
+
+    @mock_reactive_states
+    @mock.patch('spinventory.packages.cache_valid')
+    @mock.patch('subprocess.Popen')
+    def test_show_history(self, sub_popen, pkg_cache_valid):
+        sub_popen.return_value.wait.return_value = 0
+        pkg_cache_valid.return_value = True
+        r_config.r_set('keep_history', True, False)
+        self.params['sections'] = 'lsblk'
+        r_state.r_set_states(set(['storpool-inventory.collected']))
+
+        self.assertRaises(ValueError, actions.show_history, testee)
+        actions.collect_now(testee)
+        first = testee.read_collected()
+        self.assertEqual(first['_meta']['timestamp'],
+                         testee.sphistory.load_base(
+                             testee.historydir)['timestamp'])
+
+        second = dict(first, **{'lsblk.txt': 'sdb 8:16 0 1.8T 0 disk\n',
+                                'lshw.txt': 'new lshw\n'})
+        testee.sphistory.record(testee.historydir, second,
+                                first['_meta']['timestamp'] + 60, first)
+        self.params['sections'] = ''
+        actions.show_history(testee)
+        results = self.action_set.call_args[0][0]
+        self.assertEqual('1', results['entries'])
+        self.assertEqual('lsblk.txt lshw.txt', results['changed'])
+        self.assertIn('+sdb 8:16 0 1.8T 0 disk\n', results['diff'])
+
+        self.params['sections'] = 'lshw'
+        self.params['to'] = '{ts:.6f}'.format(
+            ts=first['_meta']['timestamp'] + 30)
+        actions.show_history(testee)
+        results = self.action_set.call_args[0][0]
+        self.assertEqual('', results['changed'])
+        self.assertEqual(results['from'], results['to'])
+
+        # Disabling the history removes it
+        r_config.r_set('keep_history', False, False)
+        actions.collect_now(testee)
+        self.assertFalse(os.path.exists(testee.historydir))
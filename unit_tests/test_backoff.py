@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory submission backoff.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import backoff as spbackoff
+
+
+class TestBackoff(unittest.TestCase):
+    def setUp(self):
+        super(TestBackoff, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'backoff.json')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestBackoff, self).tearDown()
+
+    def test_jitter(self):
+        first = spbackoff.jitter('storpool-inventory/0', 1)
+        self.assertEqual(first, spbackoff.jitter('storpool-inventory/0', 1))
+        self.assertNotEqual(first,
+                            spbackoff.jitter('storpool-inventory/1', 1))
+        self.assertNotEqual(first,
+                            spbackoff.jitter('storpool-inventory/0', 2))
+        self.assertTrue(0 <= first < 1)
+
+    def test_delay(self):
+        self.assertEqual(0, spbackoff.backoff_delay(0, 60, 3600, 0.5))
+        self.assertEqual(0, spbackoff.backoff_delay(3, 0, 3600, 0.5))
+        self.assertEqual(30, spbackoff.backoff_delay(1, 60, 3600, 0))
+        self.assertEqual(60, spbackoff.backoff_delay(1, 60, 3600, 1))
+        self.assertEqual(180, spbackoff.backoff_delay(3, 60, 3600, 0.5))
+        self.assertEqual(3600, spbackoff.backoff_delay(20, 60, 3600, 1))
+        self.assertEqual(60 * 2 ** 19,
+                         spbackoff.backoff_delay(20, 60, 0, 1))
+
+    def test_retry_after(self):
+        self.assertIsNone(spbackoff.parse_retry_after(None))
+        self.assertIsNone(spbackoff.parse_retry_after('soon'))
+        self.assertEqual(120, spbackoff.parse_retry_after(' 120 '))
+        self.assertEqual(90, spbackoff.parse_retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT', now=1445412390))
+        self.assertEqual(0, spbackoff.parse_retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT', now=1445412600))
+
+    def test_state(self):
+        unit = 'storpool-inventory/0'
+        self.assertEqual(0, spbackoff.remaining(self.path, now=1000))
+
+        delays = [spbackoff.record_failure(self.path, unit, 60, 300,
+                                           now=1000)
+                  for _ in range(5)]
+        self.assertTrue(30 <= delays[0] < 60)
+        self.assertTrue(60 <= delays[1] < 120)
+        self.assertTrue(120 <= delays[2] < 240)
+        self.assertTrue(150 <= delays[3] < 300)
+        self.assertTrue(150 <= delays[4] < 300)
+        self.assertAlmostEqual(delays[4],
+                               spbackoff.remaining(self.path, now=1000))
+        self.assertEqual(0, spbackoff.remaining(self.path, now=1300))
+
+        # The server knows better
+        delay = spbackoff.record_failure(self.path, unit, 60, 300,
+                                         retry_after=600, now=1000)
+        self.assertTrue(600 <= delay < 660)
+        self.assertEqual(6, spbackoff.load_state(self.path)['failures'])
+
+        # A configuration change resets the failure count
+        delay = spbackoff.defer(self.path, unit, 300, now=1000)
+        self.assertTrue(0 <= delay < 300)
+        self.assertEqual(0, spbackoff.load_state(self.path)['failures'])
+        self.assertAlmostEqual(delay,
+                               spbackoff.remaining(self.path, now=1000))
+        self.assertEqual(0, spbackoff.defer(self.path, unit, 0, now=1000))
+        self.assertEqual(0, spbackoff.remaining(self.path, now=1000))
+
+        spbackoff.forget(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        spbackoff.forget(self.path)
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory CBOR encoder.
+"""
+
+import os
+import sys
+import unittest
+
+import mock
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import cbor as spcbor
+
+
+@mock.patch('spinventory.cbor.cbor2', new=None)
+class TestCBOR(unittest.TestCase):
+    def test_encode(self):
+        """
+        Check the encoding against the examples in RFC 8949, appendix A.
+        """
+        for (value, encoded) in (
+            (0, '00'),
+            (23, '17'),
+            (24, '1818'),
+            (1000, '1903e8'),
+            (1000000, '1a000f4240'),
+            (1000000000000, '1b000000e8d4a51000'),
+            (-1, '20'),
+            (-1000, '3903e7'),
+            (1.1, 'fb3ff199999999999a'),
+            (False, 'f4'),
+            (True, 'f5'),
+            (None, 'f6'),
+            (b'', '40'),
+            (b'\x01\x02\x03\x04', '4401020304'),
+            ('', '60'),
+            ('ü', '62c3bc'),
+            ([], '80'),
+            ([1, [2, 3], [4, 5]], '8301820203820405'),
+            ({'a': 1, 'b': [2, 3]}, 'a26161016162820203'),
+        ):
+            self.assertEqual(encoded, spcbor.dumps(value).hex())
+            self.assertEqual(value, spcbor.loads(spcbor.dumps(value)))
+
+        self.assertRaises(TypeError, spcbor.dumps, set())
+        self.assertRaises(ValueError, spcbor.dumps, 1 << 64)
+
+    def test_decode(self):
+        """
+        Decode the other float widths, reject invalid data.
+        """
+        self.assertEqual(1.5, spcbor.loads(bytes.fromhex('f93e00')))
+        self.assertEqual(100000.0, spcbor.loads(bytes.fromhex('fa47c35000')))
+        for data in ('', '1a000f42', '4401', 'f6f6', '1f', 'c0'):
+            self.assertRaises(ValueError, spcbor.loads, bytes.fromhex(data))
+
+        sections = {
+            'lshw.txt': bytes(range(256)) * 1000,
+            '_meta': {'duration': 0.5, 'last_run': ['lshw']},
+        }
+        self.assertEqual(sections, spcbor.loads(spcbor.dumps(sections)))
@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory collector engine.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import collect as spcollect
+
+
+class TestCollect(unittest.TestCase):
+    @mock.patch('spinventory.collect.command_prefix', new=lambda: [])
+    def test_run_collectors(self):
+        """
+        Run a couple of collectors and make sure their output ends up
+        in the right files.
+        """
+        collectors = [
+            spcollect.Collector('hello', ['echo', 'hello']),
+            spcollect.Collector('oops',
+                                ['sh', '-c', 'echo oops 1>&2; exit 3']),
+            spcollect.Collector('missing', ['/nonexistent/tool']),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            results = spcollect.run_collectors(collectors, d, 2)
+            self.assertEqual(['hello', 'oops', 'missing'],
+                             [res.name for res in results])
+            self.assertEqual([0, 3, 127],
+                             [res.returncode for res in results])
+            self.assertEqual([6, 0, 0],
+                             [res.stdout_bytes for res in results])
+            self.assertEqual(5, results[1].stderr_bytes)
+
+            collected = spcollect.read_sections(d)
+            self.assertEqual(set(['hello.txt', 'hello.err',
+                                  'oops.txt', 'oops.err',
+                                  'missing.txt', 'missing.err']),
+                             set(collected.keys()))
+            self.assertEqual('hello\n', collected['hello.txt'])
+            self.assertEqual('', collected['hello.err'])
+            self.assertEqual('oops\n', collected['oops.err'])
+            self.assertIn('/nonexistent/tool', collected['missing.err'])
+
+    @mock.patch('spinventory.collect.command_prefix', new=lambda: [])
+    def test_run_parallel(self):
+        """
+        Make sure the collectors actually run at the same time.
+        """
+        collectors = [spcollect.Collector('sleep-{i}'.format(i=i),
+                                          ['sleep', '0.5'])
+                      for i in range(4)]
+        with tempfile.TemporaryDirectory() as d:
+            start = time.time()
+            spcollect.run_collectors(collectors, d, 4)
+            self.assertLess(time.time() - start, 1.5)
+
+    @mock.patch('spinventory.collect.command_prefix', new=lambda: [])
+    def test_timeout(self):
+        """
+        Make sure a hung collector is killed and the rest still run.
+        """
+        collectors = [
+            spcollect.Collector('hung', ['sh', '-c', 'sleep 30; echo no']),
+            spcollect.Collector('quick', ['echo', 'yes']),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            start = time.time()
+            results = spcollect.run_collectors(collectors, d, 2,
+                                               timeout=30,
+                                               timeouts={'hung': 0.5})
+            self.assertLess(time.time() - start, 10)
+            self.assertEqual([True, False],
+                             [res.timed_out for res in results])
+
+            collected = spcollect.read_sections(d)
+            self.assertEqual('', collected['hung.txt'])
+            self.assertIn('timed out', collected['hung.err'])
+            self.assertEqual('yes\n', collected['quick.txt'])
+
+    @mock.patch('spinventory.collect.command_prefix', new=lambda: [])
+    @mock.patch('spinventory.collect.kill_collector')
+    def test_timeout_unkillable(self, kill_collector):
+        """
+        Abandon a collector that cannot be reaped after it was killed.
+        """
+        procs = []
+
+        def stuck(proc):
+            procs.append(proc)
+            return False
+
+        kill_collector.side_effect = stuck
+        collectors = [
+            spcollect.Collector('hung', ['sleep', '30']),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            try:
+                start = time.time()
+                results = spcollect.run_collectors(collectors, d, 1,
+                                                   timeout=0.5)
+                self.assertLess(time.time() - start, 10)
+            finally:
+                for proc in procs:
+                    proc.kill()
+                    proc.wait()
+            self.assertEqual([(True, None)],
+                             [(res.timed_out, res.returncode)
+                              for res in results])
+            collected = spcollect.read_sections(d)
+            self.assertIn('could not be killed', collected['hung.err'])
+
+    def test_kill_collector(self):
+        """
+        Do not wait forever for a killed process to go away.
+        """
+        proc = mock.Mock(pid=-1)
+        proc.wait.side_effect = subprocess.TimeoutExpired(['nvme'],
+                                                          spcollect.KILL_GRACE)
+        with mock.patch('os.killpg') as killpg:
+            self.assertFalse(spcollect.kill_collector(proc))
+            killpg.assert_called_once_with(-1, signal.SIGKILL)
+        proc.wait.assert_called_once_with(timeout=spcollect.KILL_GRACE)
+
+        proc = subprocess.Popen(['sleep', '30'], start_new_session=True)
+        self.assertTrue(spcollect.kill_collector(proc))
+        self.assertEqual(-signal.SIGKILL, proc.returncode)
+
+    def test_parse_timeouts(self):
+        """
+        Parse the per-collector timeout overrides.
+        """
+        self.assertEqual({}, spcollect.parse_timeouts(''))
+        self.assertEqual({}, spcollect.parse_timeouts(None))
+        self.assertEqual({'lshw': 300.0, 'nvme-list': 2.5},
+                         spcollect.parse_timeouts(' lshw=300\tnvme-list=2.5'))
+        self.assertRaises(ValueError, spcollect.parse_timeouts, 'lshw')
+        self.assertRaises(ValueError, spcollect.parse_timeouts, '=3')
+        self.assertRaises(ValueError, spcollect.parse_timeouts, 'lshw=x')
+
+    def test_native(self):
+        """
+        Run collector functions instead of external tools.
+        """
+        def broken():
+            raise OSError('no such file')
+
+        collectors = [
+            spcollect.Collector('good', None, lambda: 'native\n'),
+            spcollect.Collector('bad', None, broken),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            results = spcollect.run_collectors(collectors, d, 2)
+            self.assertEqual([0, 1], [res.returncode for res in results])
+            collected = spcollect.read_sections(d)
+            self.assertEqual('native\n', collected['good.txt'])
+            self.assertEqual('', collected['good.err'])
+            self.assertEqual('no such file\n', collected['bad.err'])
+
+    def test_native_timeout(self):
+        """
+        Stop waiting for a collector function that hangs.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def hung():
+            release.wait(30)
+            return 'no\n'
+
+        collectors = [
+            spcollect.Collector('hung', None, hung),
+            spcollect.Collector('quick', None, lambda: 'yes\n'),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            start = time.time()
+            results = spcollect.run_collectors(collectors, d, 2,
+                                               timeout=30,
+                                               timeouts={'hung': 0.5})
+            self.assertLess(time.time() - start, 10)
+            self.assertEqual([True, False],
+                             [res.timed_out for res in results])
+            self.assertEqual([None, 0], [res.returncode for res in results])
+
+            collected = spcollect.read_sections(d)
+            self.assertEqual('', collected['hung.txt'])
+            self.assertIn('timed out', collected['hung.err'])
+            self.assertEqual('yes\n', collected['quick.txt'])
+
+    def test_collectors(self):
+        """
+        Replace some of the tools with native collectors if requested.
+        """
+        names = [col.name for col in spcollect.COLLECTORS]
+        plain = spcollect.collectors(False, derive=False)
+        self.assertEqual(names, [col.name for col in plain])
+        self.assertEqual([], [col for col in plain if col.func is not None])
+
+        native = spcollect.collectors(True, derive=False)
+        self.assertEqual(names, [col.name for col in native])
+        self.assertEqual(set(['free-m', 'lsblk', 'lsmod', 'ls-sys-class-net',
+                              'ls-dev-disk-by-id', 'ls-dev-disk-by-path']),
+                         set([col.name for col in native
+                              if col.func is not None]))
+
+        derived = spcollect.collectors(False)
+        self.assertEqual(names, [col.name for col in derived])
+        self.assertEqual([('lspci', 'lspci-vv')],
+                         [(col.name, col.source) for col in derived
+                          if col.source is not None])
+
+    def test_payload_version(self):
+        """
+        Payload version 2 drops the redundant sections.
+        """
+        names = [col.name for col in spcollect.collectors(version=2)]
+        self.assertIn('lspci-vvnnqD', names)
+        self.assertIn('ip-details-address-list', names)
+        for name in ('lspci', 'lspci-vv', 'ip-address-list', 'ip-link-list'):
+            self.assertNotIn(name, names)
+        self.assertEqual([], [col for col in spcollect.collectors(version=2)
+                              if col.source is not None])
+        with self.assertRaises(ValueError):
+            spcollect.collectors(version=3)
+
+    @mock.patch('spinventory.collect.command_prefix', new=lambda: [])
+    def test_run_derived(self):
+        """
+        Derive a section from another one, or run the command if
+        the source collector is not run this time.
+        """
+        upper = spcollect.Collector('upper', ['echo', 'by itself'],
+                                    func=lambda text: text.upper(),
+                                    source='hello')
+        hello = spcollect.Collector('hello',
+                                    ['sh', '-c', 'echo hello; echo oops 1>&2'])
+        with tempfile.TemporaryDirectory() as d:
+            results = spcollect.run_collectors([upper, hello], d)
+            self.assertEqual(['upper', 'hello'],
+                             [res.name for res in results])
+            collected = spcollect.read_sections(d)
+            self.assertEqual('HELLO\n', collected['upper.txt'])
+            self.assertEqual('oops\n', collected['upper.err'])
+
+        with tempfile.TemporaryDirectory() as d:
+            results = spcollect.run_collectors([upper], d)
+            self.assertEqual(0, results[0].returncode)
+            collected = spcollect.read_sections(d)
+            self.assertEqual('by itself\n', collected['upper.txt'])
+
+    def test_size_caps(self):
+        """
+        Cut the sections that are too long, and then the largest ones
+        until the whole data fits.
+        """
+        collectors = [
+            spcollect.Collector('big', None, lambda: 'line\n' * 1000),
+            spcollect.Collector('small', None, lambda: 'tiny\n'),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            results = spcollect.run_collectors(collectors, d, 2)
+            self.assertEqual(spcollect.read_sections(d),
+                             spcollect.read_sections(d, 5000))
+            collected = spcollect.read_sections(d, 1000)
+            truncated = spcollect.truncated_sections(results, 1000)
+        self.assertEqual({'big.txt': 5000}, truncated)
+        self.assertEqual({}, spcollect.truncated_sections(results, 0))
+        self.assertEqual('tiny\n', collected['small.txt'])
+        big = collected['big.txt']
+        self.assertLessEqual(len(big), 1000)
+        self.assertTrue(big.startswith('line\nline\n'))
+        self.assertTrue(big.endswith(spcollect.truncation_marker(5000)))
+        self.assertEqual('', big[:-len(spcollect.truncation_marker(5000))]
+                         .replace('line\n', ''))
+
+        collected = {
+            'big.txt': 'a' * 2000,
+            'bigger.txt': 'b' * 3000,
+            'small.txt': 'c' * 10,
+            '_meta': {'duration': 1},
+        }
+        truncated = {}
+        data = spcollect.fit_payload(dict(collected), 0, truncated)
+        self.assertEqual(collected, json.loads(data))
+        self.assertEqual({}, truncated)
+
+        data = spcollect.fit_payload(collected, 3000, truncated)
+        self.assertLessEqual(len(data), 3000)
+        self.assertEqual(collected, json.loads(data))
+        self.assertEqual({'bigger.txt': 3000}, truncated)
+        self.assertEqual('c' * 10, collected['small.txt'])
+
+        data = spcollect.fit_payload(collected, 500, truncated)
+        self.assertLessEqual(len(data), 500)
+        self.assertEqual({'big.txt': 2000, 'bigger.txt': 3000}, truncated)
+        self.assertTrue(collected['bigger.txt'].endswith(
+            spcollect.truncation_marker(3000)))
+
+        # Cannot cut any more
+        data = spcollect.fit_payload(collected, 10, truncated)
+        self.assertEqual(collected, json.loads(data))
+
+        # Escaped characters take up more room in the JSON representation
+        for text in ('x\n' * 50000, '\xe9\n' * 50000, 'x"\t' * 33334):
+            collected = {
+                'escaped.txt': text,
+                'plain.txt': 'p' * 29999 + '\n',
+            }
+            truncated = {}
+            data = spcollect.fit_payload(collected, 20000, truncated)
+            self.assertLessEqual(len(data), 20000)
+            self.assertGreater(len(data), 19000)
+            self.assertEqual(collected, json.loads(data))
+            self.assertEqual({'escaped.txt': len(text), 'plain.txt': 30000},
+                             truncated)
+            self.assertGreater(len(collected['plain.txt']), 19000)
+
+            collected = {
+                'escaped.txt': text,
+                'plain.txt': 'p' * 29999 + '\n',
+            }
+            truncated = {}
+            data = spcollect.fit_payload(collected, 100000, truncated)
+            self.assertLessEqual(len(data), 100000)
+            self.assertGreater(len(data), 99000)
+            self.assertEqual({'escaped.txt': len(text)}, truncated)
+            self.assertEqual('p' * 29999 + '\n', collected['plain.txt'])
+
+    def test_meta(self):
+        """
+        Record the timing and size of each collector run.
+        """
+        results = [
+            spcollect.CollectorResult(name='lshw', returncode=0,
+                                      timed_out=False, timestamp=1000.0,
+                                      duration=3.14159, stdout_bytes=100,
+                                      stderr_bytes=0),
+            spcollect.CollectorResult(name='lsblk', returncode=1,
+                                      timed_out=True, timestamp=1000.5,
+                                      duration=0.5, stdout_bytes=10,
+                                      stderr_bytes=20),
+        ]
+        self.assertEqual('collected 2 sections in 4.2s, slowest: lshw 3.1s, '
+                         'timed out: lsblk',
+                         spcollect.summarize(results, 4.2))
+        self.assertEqual('collected 0 sections in 0.0s',
+                         spcollect.summarize([], 0))
+
+        meta = spcollect.build_meta(results[:1], 4.2)
+        self.assertEqual(['lshw'], meta['last_run'])
+        self.assertEqual({
+            'returncode': 0,
+            'timed_out': False,
+            'timestamp': 1000.0,
+            'duration': 3.142,
+            'stdout_bytes': 100,
+            'stderr_bytes': 0,
+        }, meta['collectors']['lshw'])
+
+        meta = spcollect.build_meta(results[1:], 0.5, meta)
+        self.assertEqual(['lsblk'], meta['last_run'])
+        self.assertEqual(set(['lshw', 'lsblk']),
+                         set(meta['collectors'].keys()))
+        self.assertEqual(0.5, meta['duration'])
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory delta submission routines.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import delta as spdelta
+
+
+class TestDelta(unittest.TestCase):
+    def test_delta(self):
+        """
+        Only the changed sections should end up in the delta.
+        """
+        first = {
+            'lsblk.txt': 'sda 8:0',
+            'ip-address-list.txt': '10.0.0.1',
+            'lsmod.txt': 'ext4',
+            '_timeouts': [],
+        }
+        manifest = spdelta.build_manifest(first)
+        self.assertEqual(set(first.keys()), set(manifest.keys()))
+
+        full = spdelta.build_delta('node', first, manifest, None)
+        self.assertIsNone(full['base'])
+        self.assertEqual(first, full['sections'])
+        self.assertEqual([], full['removed'])
+
+        second = dict(first)
+        second['ip-address-list.txt'] = '10.0.0.2'
+        del second['lsmod.txt']
+        second_manifest = spdelta.build_manifest(second)
+        self.assertEqual(manifest['lsblk.txt'],
+                         second_manifest['lsblk.txt'])
+
+        delta = spdelta.build_delta('node', second, second_manifest,
+                                    manifest)
+        self.assertEqual('delta', delta['format'])
+        self.assertEqual('node', delta['filename'])
+        self.assertEqual(spdelta.manifest_id(manifest), delta['base'])
+        self.assertEqual(second_manifest, delta['manifest'])
+        self.assertEqual({'ip-address-list.txt': '10.0.0.2'},
+                         delta['sections'])
+        self.assertEqual(['lsmod.txt'], delta['removed'])
+
+    def test_snapshot_changed(self):
+        """
+        Ignore the metadata and the constantly changing values.
+        """
+        first = {
+            'free-m.txt':
+                '              total        used        free\n'
+                'Mem:          15907        4123        8654\n'
+                'Swap:          2047           0        2047\n',
+            'ip-address-list.txt':
+                '2: eth0: <UP> mtu 1500 state UP\n'
+                '    inet 10.0.0.1/24 scope global dynamic eth0\n'
+                '       valid_lft 86123sec preferred_lft 86123sec\n',
+            'lsmod.txt': 'ext4',
+            '_meta': {'timestamp': 1000},
+        }
+        second = {
+            'free-m.txt':
+                '              total        used        free\n'
+                'Mem:          15907        5021        7756\n'
+                'Swap:          2047          12        2035\n',
+            'ip-address-list.txt':
+                '2: eth0: <UP> mtu 1500 state UP\n'
+                '    inet 10.0.0.1/24 scope global dynamic eth0\n'
+                '       valid_lft 82523sec preferred_lft 82523sec\n',
+            'lsmod.txt': 'ext4',
+            '_meta': {'timestamp': 4600},
+        }
+        self.assertFalse(spdelta.snapshot_changed(first, second))
+
+        third = dict(second)
+        third['free-m.txt'] = second['free-m.txt'].replace('15907', '31814')
+        self.assertTrue(spdelta.snapshot_changed(second, third))
+
+        third = dict(second)
+        third['ip-address-list.txt'] = \
+            second['ip-address-list.txt'].replace('10.0.0.1', '10.0.0.2')
+        self.assertTrue(spdelta.snapshot_changed(second, third))
+
+        third = dict(second)
+        del third['lsmod.txt']
+        self.assertTrue(spdelta.snapshot_changed(second, third))
+
+    def test_manifest_file(self):
+        """
+        Store, load and forget a manifest.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'manifest.json')
+            self.assertIsNone(spdelta.load_manifest(path))
+
+            manifest = spdelta.build_manifest({'a': 'b'})
+            spdelta.save_manifest(path, manifest)
+            self.assertEqual(manifest, spdelta.load_manifest(path))
+
+            spdelta.forget_manifest(path)
+            self.assertFalse(os.path.exists(path))
+            spdelta.forget_manifest(path)
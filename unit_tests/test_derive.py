@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory derived sections.
+"""
+
+import os
+import sys
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import derive as spderive
+
+
+LSPCI_VV = """00:00.0 Host bridge: Intel Corporation Xeon E3-1200 v6/7th Gen Core Processor Host Bridge/DRAM Registers (rev 05)
+\tSubsystem: Dell Device 07a1
+\tControl: I/O- Mem+ BusMaster+ SpecCycle- MemWINV- VGASnoop- ParErr- Stepping- SERR- FastB2B- DisINTx-
+\tLatency: 0
+\tCapabilities: <access denied>
+
+00:17.0 SATA controller: Intel Corporation Sunrise Point-H SATA controller [AHCI mode] (rev 31) (prog-if 01 [AHCI 1.0])
+\tSubsystem: Dell Device 07a1
+\tInterrupt: pin A routed to IRQ 125
+\tKernel driver in use: ahci
+
+00:1f.3 Audio device: Intel Corporation CM238 HD Audio Controller (rev 31) (prog-if 80)
+\tKernel driver in use: snd_hda_intel
+
+"""  # noqa: E501
+
+LSPCI = """00:00.0 Host bridge: Intel Corporation Xeon E3-1200 v6/7th Gen Core Processor Host Bridge/DRAM Registers (rev 05)
+00:17.0 SATA controller: Intel Corporation Sunrise Point-H SATA controller [AHCI mode] (rev 31)
+00:1f.3 Audio device: Intel Corporation CM238 HD Audio Controller (rev 31)
+"""  # noqa: E501
+
+
+class TestDerive(unittest.TestCase):
+    def test_lspci(self):
+        self.assertEqual(LSPCI, spderive.lspci_from_verbose(LSPCI_VV))
+        self.assertEqual('', spderive.lspci_from_verbose(''))
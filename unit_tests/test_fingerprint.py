@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory hardware fingerprint.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import fingerprint as spfingerprint
+
+
+DMIDECODE = """# dmidecode 3.0
+Handle 0x0001, DMI type 1, 27 bytes
+System Information
+\tManufacturer: Supermicro
+\tSerial Number: S123456X
+\tUUID: 00000000-0000-0000-0000-0CC47A123456
+
+Handle 0x0002, DMI type 2, 15 bytes
+Base Board Information
+\tSerial Number: To be filled by O.E.M.
+
+Handle 0x0011, DMI type 17, 40 bytes
+Memory Device
+\tSerial Number: 12345678
+\tPart Number: M393A4K40BB1-CRC
+"""
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        super(TestFingerprint, self).setUp()
+        self.collected = {
+            'dmidecode.txt': DMIDECODE,
+            'free-m.txt': 'Mem: 64000 1000 63000\n',
+            'structured': {
+                'disks': [{'name': 'sda', 'serial': 'WD-1234'},
+                          {'name': 'sr0', 'serial': None}],
+                'nvme': [{'node': '/dev/nvme0n1', 'serial': 'S3EV1234'}],
+                'pci': [{'slot': '0000:01:00.0', 'vendor_id': '8086',
+                         'device_id': '1572', 'subsystem_vendor_id': '8086',
+                         'subsystem_device_id': '0007'}],
+                'nics': [
+                    {'name': 'lo', 'mac': '00:00:00:00:00:00'},
+                    {'name': 'eth0', 'mac': '0C:C4:7A:12:34:56'},
+                    {'name': 'eth0v0', 'mac': '02:42:ac:11:00:02'},
+                    {'name': 'ib0', 'mac': '80:00:02:08:fe:80:00:00'},
+                ],
+            },
+        }
+
+    def test_identity(self):
+        """
+        Only the parts that identify the hardware are used.
+        """
+        self.assertEqual({
+            'dmi': [
+                'Serial Number: 12345678',
+                'Serial Number: S123456X',
+                'UUID: 00000000-0000-0000-0000-0CC47A123456',
+            ],
+            'pci': ['0000:01:00.0 8086:1572 8086:0007'],
+            'disks': ['S3EV1234', 'WD-1234'],
+            'macs': ['0c:c4:7a:12:34:56'],
+        }, spfingerprint.hardware_identity(self.collected))
+
+    def test_fingerprint(self):
+        """
+        The fingerprint changes along with the hardware, but not with
+        the rest of the data.
+        """
+        fprint = spfingerprint.fingerprint(self.collected)
+        self.assertRegex(fprint, '^[0-9a-f]{64}$')
+
+        self.collected['free-m.txt'] = 'Mem: 64000 2000 62000\n'
+        self.collected['structured']['nics'].reverse()
+        self.assertEqual(fprint, spfingerprint.fingerprint(self.collected))
+
+        self.collected['structured']['disks'].append(
+            {'name': 'sdb', 'serial': 'WD-5678'})
+        self.assertNotEqual(fprint,
+                            spfingerprint.fingerprint(self.collected))
+
+        self.assertIsNone(spfingerprint.fingerprint({}))
+        self.assertIsNone(spfingerprint.fingerprint(
+            {'dmidecode.txt': 'Serial Number: Not Specified\n'}))
+
+    def test_acknowledged(self):
+        """
+        Remember the fingerprint along with the server URL.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'fingerprint.json')
+            url = 'http://inventory.example.com/'
+            self.assertIsNone(spfingerprint.load_acknowledged(path, url))
+            spfingerprint.save_acknowledged(path, url, 'abc')
+            self.assertEqual('abc',
+                             spfingerprint.load_acknowledged(path, url))
+            self.assertIsNone(spfingerprint.load_acknowledged(
+                path, 'http://other.example.com/'))
+            spfingerprint.forget(path)
+            spfingerprint.forget(path)
+            self.assertEqual([], os.listdir(d))
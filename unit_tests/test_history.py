@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory local history.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import history as sphistory
+
+
+LSBLK = ''.join('sd{c} 8:{n} 0 1.8T 0 disk\n'
+                .format(c=chr(ord('a') + n), n=n * 16)
+                for n in range(8))
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.historydir = os.path.join(self.tempdir.name, 'history')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestHistory, self).tearDown()
+
+    def test_diff(self):
+        """
+        Apply the line-based diffs.
+        """
+        rnd = random.Random(42)
+        lines = ['line {n}\n'.format(n=n) for n in range(200)]
+        for _ in range(50):
+            new = list(lines)
+            for _ in range(rnd.randint(0, 5)):
+                pos = rnd.randint(0, len(new))
+                op = rnd.choice(('insert', 'delete', 'replace'))
+                if op == 'insert':
+                    new.insert(pos, 'new {r}\n'.format(r=rnd.random()))
+                elif pos < len(new):
+                    del new[pos]
+                    if op == 'replace':
+                        new.insert(pos, 'changed\n')
+            old_text = ''.join(lines)
+            new_text = ''.join(new)
+            ops = sphistory.line_diff(old_text, new_text)
+            self.assertEqual(new_text, sphistory.apply_diff(old_text, ops))
+            self.assertLessEqual(len(ops), 5)
+            lines = new
+
+        self.assertEqual([], sphistory.line_diff('a\nb\n', 'a\nb\n'))
+        self.assertEqual([[0, 0, ['a\n']]], sphistory.line_diff('', 'a\n'))
+        self.assertEqual('no newline',
+                         sphistory.apply_diff('a\n', sphistory.line_diff(
+                             'a\n', 'no newline')))
+
+    def test_record(self):
+        """
+        Record the changes, compare the states at different times.
+        """
+        first = {
+            'lsblk.txt': LSBLK,
+            'lsblk.err': '',
+            'free-m.txt': 'Mem: 1000\n',
+            'structured': {'disks': []},
+            '_meta': {'timestamp': 1000.0},
+        }
+        self.assertRaises(ValueError, sphistory.changes, self.historydir)
+        self.assertIsNone(sphistory.record(self.historydir, first, 1000.0))
+        self.assertEqual([], sphistory.record(self.historydir,
+                                              dict(first), 2000.0, first))
+
+        # A disk disappears, the memory usage changes
+        second = dict(first)
+        second['lsblk.txt'] = LSBLK.replace('sdc 8:32 0 1.8T 0 disk\n', '')
+        second['free-m.txt'] = 'Mem: 2000\n'
+        self.assertEqual(['free-m.txt', 'lsblk.txt'],
+                         sphistory.record(self.historydir, second, 3000.0,
+                                          first))
+
+        # An NVMe drive appears, the error output is gone; no previous
+        # data to compare against
+        third = dict(second)
+        third['nvme-list.txt'] = '/dev/nvme0n1 S3EV1234\n'
+        del third['lsblk.err']
+        self.assertEqual(['lsblk.err', 'nvme-list.txt'],
+                         sphistory.record(self.historydir, third, 4000.0))
+        self.assertEqual([3000.0, 4000.0],
+                         [ts for (ts, _) in
+                          sphistory.entries(self.historydir)])
+
+        (ts, state) = sphistory.state_at(self.historydir)
+        self.assertEqual(4000.0, ts)
+        self.assertEqual(sphistory.tracked_sections(third), state)
+        (ts, state) = sphistory.state_at(self.historydir, 3500.0)
+        self.assertEqual(3000.0, ts)
+        self.assertEqual(sphistory.tracked_sections(second), state)
+        self.assertEqual((None, None),
+                         sphistory.state_at(self.historydir, 500.0))
+
+        (old_ts, new_ts, diffs) = sphistory.changes(self.historydir)
+        self.assertEqual((1000.0, 4000.0), (old_ts, new_ts))
+        self.assertEqual(['free-m.txt', 'lsblk.err', 'lsblk.txt',
+                          'nvme-list.txt'], sorted(diffs.keys()))
+        self.assertIn('-sdc 8:32 0 1.8T 0 disk\n', diffs['lsblk.txt'])
+        self.assertIn('+/dev/nvme0n1 S3EV1234\n', diffs['nvme-list.txt'])
+
+        (old_ts, new_ts, diffs) = sphistory.changes(self.historydir,
+                                                    3500.0, 3600.0)
+        self.assertEqual((3000.0, 3000.0, {}), (old_ts, new_ts, diffs))
+        self.assertRaises(ValueError, sphistory.changes, self.historydir,
+                          None, 500.0)
+
+        # Fold the oldest entry into the base
+        self.assertEqual(0, sphistory.prune(self.historydir, 0, 0))
+        self.assertEqual(0, sphistory.prune(self.historydir, 2, 0))
+        self.assertEqual(1, sphistory.prune(self.historydir, 0, 500, 4400.0))
+        self.assertEqual(3000.0,
+                         sphistory.load_base(self.historydir)['timestamp'])
+        self.assertEqual(sphistory.tracked_sections(third),
+                         sphistory.state_at(self.historydir)[1])
+        self.assertEqual(1, sphistory.prune(self.historydir, 0, 500, 5000.0))
+        self.assertEqual([], sphistory.entries(self.historydir))
+        self.assertEqual(sphistory.tracked_sections(third),
+                         sphistory.load_base(self.historydir)['sections'])
+
+        sphistory.forget(self.historydir)
+        self.assertFalse(os.path.exists(self.historydir))
+
+    def test_parse_time(self):
+        self.assertIsNone(sphistory.parse_time(''))
+        self.assertIsNone(sphistory.parse_time(None))
+        self.assertEqual(1500.5, sphistory.parse_time('1500.5'))
+        self.assertEqual(1709294400.0,
+                         sphistory.parse_time('2024-03-01T12:00'))
+        self.assertEqual(1709251200.0, sphistory.parse_time('2024-03-01'))
+        self.assertRaises(ValueError, sphistory.parse_time, 'yesterday')
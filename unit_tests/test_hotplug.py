@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory hotplug event handling.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import hotplug as sphotplug
+
+
+class TestHotplug(unittest.TestCase):
+    def setUp(self):
+        super(TestHotplug, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.rules = os.path.join(self.tempdir.name, 'inventory.rules')
+        self.queue = os.path.join(self.tempdir.name, 'hotplug.queue')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestHotplug, self).tearDown()
+
+    def test_rules(self):
+        self.assertFalse(sphotplug.remove_rules(self.rules))
+        self.assertTrue(sphotplug.install_rules(self.rules, self.queue))
+        self.assertFalse(sphotplug.install_rules(self.rules, self.queue))
+        with open(self.rules, mode='r') as f:
+            rules = f.read()
+        self.assertEqual(sphotplug.udev_rules(self.queue), rules)
+        self.assertIn('>> {q}\'"'.format(q=self.queue), rules)
+        self.assertTrue(sphotplug.install_rules(self.rules,
+                                                self.queue + '.other'))
+        self.assertTrue(sphotplug.remove_rules(self.rules))
+        self.assertFalse(os.path.exists(self.rules))
+
+    def test_events(self):
+        self.assertEqual([], sphotplug.take_events(self.queue))
+
+        with open(self.queue + '.processing', mode='w') as f:
+            f.write('add block sdc\n')
+        with open(self.queue, mode='w') as f:
+            f.write('remove block sdb\nadd\nmove net enp3s0f1\n')
+        events = sphotplug.take_events(self.queue)
+        self.assertEqual([
+            ('add', 'block', 'sdc'),
+            ('remove', 'block', 'sdb'),
+            ('move', 'net', 'enp3s0f1'),
+        ], events)
+        self.assertEqual([], os.listdir(self.tempdir.name))
+        self.assertEqual([], sphotplug.take_events(self.queue))
+
+        names = ['lsblk', 'lshw', 'ip-address-list', 'ip-link-list',
+                 'ls-sys-class-net', 'nvme-list']
+        self.assertEqual(['ip-address-list', 'ip-link-list',
+                          'ls-sys-class-net', 'lsblk', 'nvme-list'],
+                         sphotplug.affected_collectors(events, names))
+        self.assertEqual(['lsblk', 'nvme-list'],
+                         sphotplug.affected_collectors(events[:1], names))
+        self.assertEqual([], sphotplug.affected_collectors(
+            [('add', 'usb', '1-1')], names))
+
+        with open(self.queue, mode='w') as f:
+            f.write('add block sdc\n')
+        sphotplug.forget(self.queue)
+        sphotplug.forget(self.queue)
+        self.assertEqual([], os.listdir(self.tempdir.name))
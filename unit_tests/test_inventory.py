@@ -6,11 +6,16 @@ A set of unit tests for the storpool-inventory charm.
 
 import os
 import sys
+import tempfile
+import time
+import gzip
 import unittest
+import urllib.error
 
 import json
 import mock
 
+from email import message as email_message
 from http import client as http_client
 
 from charmhelpers.core import hookenv
@@ -23,6 +28,10 @@ lib_path = os.path.realpath('unit_tests/lib')
 if lib_path not in sys.path:
     sys.path.insert(0, lib_path)
 
+charm_lib_path = os.path.realpath('lib')
+if charm_lib_path not in sys.path:
+    sys.path.append(charm_lib_path)
+
 
 class MockReactive(object):
     def r_clear_states(self):
@@ -114,6 +123,32 @@ class TestInventory(unittest.TestCase):
         r_state.r_clear_states()
         r_config.r_clear_config()
 
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        datadir = tempdir.name
+        patcher = mock.patch.multiple(
+            testee,
+            datadir=datadir,
+            datafile=datadir + '/collect.json',
+            aggregatefile=datadir + '/inventory-aggregated.json',
+            backofffile=datadir + '/inventory-backoff.json',
+            fingerprintfile=datadir + '/inventory-fingerprint.json',
+            historydir=datadir + '/inventory-history',
+            manifestfile=datadir + '/submitted-manifest.json',
+            negotiatefile=datadir + '/inventory-content-type.json',
+            pkgcachefile=datadir + '/inventory-packages.json',
+            profiledir=datadir + '/inventory-profiles',
+            queuefile=datadir + '/inventory-hotplug.queue',
+            schedulefile=datadir + '/inventory-schedule.json',
+            senderdir=datadir + '/inventory-sender',
+            spooldir=datadir + '/inventory-spool',
+            storedir=datadir + '/inventory-store',
+            summaryfile=datadir + '/inventory-summary.txt',
+            udevrulesfile=datadir + '/90-storpool-inventory.rules',
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock_reactive_states
     @mock.patch('spcharms.utils.rdebug')
     def test_hook_install(self, rdebug):
@@ -200,14 +235,19 @@ class TestInventory(unittest.TestCase):
     @mock.patch('spcharms.utils.err')
     @mock.patch('spcharms.repo.install_packages')
     @mock.patch('spcharms.repo.record_packages')
-    @mock.patch('subprocess.call')
-    def test_collect_and_submit(self, sub_call, sprepo_record, sprepo_install,
-                                sputils_err, urlopen):
+    @mock.patch('subprocess.Popen')
+    @mock.patch('spinventory.packages.installed_packages')
+    def test_collect_and_submit(self, pkg_installed, sub_popen,
+                                sprepo_record, sprepo_install, sputils_err,
+                                urlopen):
         installed = ('a-package', 'another-package')
         sprepo_install.return_value = (None, installed)
+        pkg_installed.return_value = {}
 
         sputils_err.side_effect = lambda *args: self.fail_on_err(*args)
+        sub_popen.return_value.wait.return_value = 0
 
+        r_config.r_set('native_collectors', False, False)
         r_state.r_set_states(set(['storpool-inventory.collecting']))
         testee.collect()
         self.assertEquals(set(['storpool-inventory.collected']),
@@ -216,17 +256,42 @@ class TestInventory(unittest.TestCase):
         self.assertEquals(1, sprepo_install.call_count)
         sprepo_record.assert_called_once_with('storpool-inventory-charm',
                                               installed)
-        self.assertEquals(1, sub_call.call_count)
+        collectors = testee.spcollect.COLLECTORS
+        self.assertEquals(len([col for col in testee.configured_collectors()
+                               if col.source is None]),
+                          sub_popen.call_count)
+        self.assertEquals(len(collectors) - 1, sub_popen.call_count)
 
         # We did not actually run any commands, so it has not collected
         # any data, but still it should have created a file.
         datafile = testee.datafile
         self.assertTrue(os.path.isfile(datafile))
+        with open(datafile, mode='r') as f:
+            self.assertEquals(testee.spdelta.build_manifest(json.load(f)),
+                              testee.spstore.latest_manifest(
+                                  testee.storedir))
         with open(datafile, mode='r') as f:
             data = json.loads(f.read())
             self.assertIsInstance(data, dict)
-            self.assertEquals(1, len(data))
-            self.assertEquals('collect.sh', list(data.keys())[0])
+            expected = set([col.name + ext
+                            for col in collectors
+                            for ext in ('.txt', '.err')])
+            expected.update(['_timeouts', '_truncated', '_version',
+                             '_meta', 'structured'])
+            self.assertEquals(expected, set(data.keys()))
+            self.assertEquals([], data.pop('_timeouts'))
+            self.assertEquals({}, data.pop('_truncated'))
+            self.assertEquals(1, data.pop('_version'))
+            meta = data.pop('_meta')
+            self.assertEquals(sorted(col.name for col in collectors),
+                              meta['last_run'])
+            self.assertEquals(set(col.name for col in collectors),
+                              set(meta['collectors'].keys()))
+            self.assertEquals(0, meta['collectors']['lshw']['stdout_bytes'])
+            self.assertEquals({'disks': [], 'nvme': [], 'pci': [],
+                               'nics': []},
+                              data.pop('structured'))
+            self.assertEquals(set(['']), set(data.values()))
 
         # First, a submission with no config URL
         r_state.set_state('storpool-inventory.submitting')
@@ -236,7 +301,8 @@ class TestInventory(unittest.TestCase):
         self.assertEquals(0, urlopen.call_count)
 
         # Now make the submission fail
-        r_config.r_set('submit_url', 'something', False)
+        r_config.r_set('submit_url', 'http://inventory.example.com/',
+                       False)
         mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
         mock_client.getcode.return_value = 300
         mock_client.__enter__.return_value = mock_client
@@ -259,3 +325,552 @@ class TestInventory(unittest.TestCase):
                           r_state.r_get_states())
         self.assertEquals(2, urlopen.call_count)
         self.assertEquals(2, mock_client.getcode.call_count)
+
+    @mock_reactive_states
+    @mock.patch('spcharms.utils.err')
+    @mock.patch('spinventory.packages.cache_valid')
+    @mock.patch('subprocess.Popen')
+    def test_recollect(self, sub_popen, pkg_cache_valid, sputils_err):
+        sputils_err.side_effect = lambda *args: self.fail_on_err(*args)
+        sub_popen.return_value.wait.return_value = 0
+        pkg_cache_valid.return_value = True
+        r_config.r_set('native_collectors', False, False)
+        r_config.r_set('recollect_volatile_interval', 3600, False)
+        r_config.r_set('recollect_static_interval', 86400, False)
+
+        collectors = testee.spcollect.COLLECTORS
+        collected = dict((col.name + '.txt', 'old ' + col.name)
+                         for col in collectors)
+        with open(testee.datafile, mode='w') as f:
+            json.dump(collected, f)
+
+        # Nothing is due yet
+        now = time.time()
+        testee.spschedule.record_run(testee.schedulefile,
+                                     [col.name for col in collectors],
+                                     now - 1800)
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+        testee.submit_if_needed()
+        self.assertEquals(set(['storpool-inventory.collected',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+
+        # The volatile sections are due
+        testee.spschedule.record_run(testee.schedulefile,
+                                     [col.name for col in collectors],
+                                     now - 7200)
+        testee.submit_if_needed()
+        self.assertEquals(set(['storpool-inventory.collecting',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+
+        testee.collect()
+        volatile = testee.spschedule.VOLATILE_COLLECTORS.intersection(
+            col.name for col in collectors)
+        self.assertEquals(len(volatile), sub_popen.call_count)
+        self.assertEquals(set(['storpool-inventory.collected',
+                               'storpool-inventory.submitting']),
+                          r_state.r_get_states())
+
+        with open(testee.datafile, mode='r') as f:
+            data = json.load(f)
+        for col in collectors:
+            if col.name in volatile:
+                self.assertEquals('', data[col.name + '.txt'])
+                self.assertEquals('', data[col.name + '.err'])
+            else:
+                self.assertEquals('old ' + col.name,
+                                  data[col.name + '.txt'])
+                self.assertNotIn(col.name + '.err', data)
+        self.assertEquals(sorted(volatile), data['_meta']['last_run'])
+
+        # Nothing is due any more
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+        testee.submit_if_needed()
+        self.assertEquals(set(['storpool-inventory.collected',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+
+    @mock_reactive_states
+    @mock.patch('spcharms.utils.err')
+    @mock.patch('spinventory.packages.cache_valid')
+    @mock.patch('subprocess.Popen')
+    def test_recollect_volatile(self, sub_popen, pkg_cache_valid,
+                                sputils_err):
+        sputils_err.side_effect = lambda *args: self.fail_on_err(*args)
+        pkg_cache_valid.return_value = True
+        r_config.r_set('native_collectors', False, False)
+        r_config.r_set('recollect_volatile_interval', 3600, False)
+        r_config.r_set('recollect_static_interval', 86400, False)
+        output = {
+            'free': 'Mem:  15907  4123  8654\nSwap:  2047  0  2047\n',
+        }
+
+        def run_tool(cmd, stdout, **kwargs):
+            stdout.write(output.get(cmd[0], '').encode('latin1'))
+            proc = mock.Mock()
+            proc.wait.return_value = 0
+            return proc
+
+        sub_popen.side_effect = run_tool
+        testee.collect()
+        count = sub_popen.call_count
+        now = time.time()
+        testee.spschedule.record_run(testee.schedulefile, ['free-m'],
+                                     now - 7200)
+
+        # Only the used and free memory figures changed
+        output['free'] = 'Mem:  15907  5021  7756\nSwap:  2047  12  2035\n'
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+        testee.submit_if_needed()
+        testee.collect()
+        self.assertEquals(count + 1, sub_popen.call_count)
+        self.assertEquals(set(['storpool-inventory.collected',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+        self.assertEquals(output['free'],
+                          testee.read_collected()['free-m.txt'])
+
+        # Some memory was added
+        testee.spschedule.record_run(testee.schedulefile, ['free-m'],
+                                     now - 7200)
+        output['free'] = 'Mem:  31814  5021  7756\nSwap:  2047  12  2035\n'
+        testee.submit_if_needed()
+        testee.collect()
+        self.assertEquals(count + 2, sub_popen.call_count)
+        self.assertEquals(set(['storpool-inventory.collected',
+                               'storpool-inventory.submitting']),
+                          r_state.r_get_states())
+
+    @mock_reactive_states
+    @mock.patch('urllib.request.urlopen')
+    @mock.patch('spcharms.utils.err')
+    def test_submit_backoff(self, sputils_err, urlopen):
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'x86_64'}, f)
+        r_config.r_set('submit_url', 'http://inventory.example.com/', True)
+        r_config.r_set('submit_backoff_base', 60, False)
+        r_config.r_set('submit_backoff_max', 3600, False)
+        r_config.r_set('submit_splay', 300, False)
+        submit_states = set(['storpool-inventory.configured',
+                             'storpool-inventory.collected',
+                             'storpool-inventory.submitting'])
+
+        # A configuration change puts off the submission
+        r_state.r_set_states(set(['storpool-inventory.collected']))
+        testee.have_config()
+        self.assertEquals(submit_states, r_state.r_get_states())
+        state = testee.spbackoff.load_state(testee.backofffile)
+        self.assertEquals(0, state['failures'])
+        self.assertGreater(state['not_before'], time.time())
+        testee.try_to_submit()
+        self.assertEquals(0, urlopen.call_count)
+
+        # The server is overloaded and asks us to come back later
+        testee.spbackoff.forget(testee.backofffile)
+        headers = email_message.Message()
+        headers['Retry-After'] = '1800'
+        urlopen.side_effect = urllib.error.HTTPError(
+            'http://inventory.example.com/', 503, 'Service Unavailable',
+            headers, None)
+        r_state.r_set_states(submit_states)
+        testee.try_to_submit()
+        self.assertEquals(1, urlopen.call_count)
+        self.assertEquals(1, sputils_err.call_count)
+        state = testee.spbackoff.load_state(testee.backofffile)
+        self.assertEquals(1, state['failures'])
+        self.assertGreaterEqual(state['not_before'], time.time() + 1790)
+
+        # The next update-status hook does not try again yet
+        testee.submit_if_needed()
+        testee.try_to_submit()
+        self.assertEquals(1, urlopen.call_count)
+
+        # Once the time has come, it succeeds
+        state['not_before'] = time.time() - 1
+        testee.spbackoff.save_state(testee.backofffile, state)
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+        urlopen.side_effect = None
+        urlopen.return_value = mock_client
+        r_state.r_set_states(submit_states)
+        testee.try_to_submit()
+        self.assertEquals(2, urlopen.call_count)
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        self.assertFalse(os.path.exists(testee.backofffile))
+
+    @mock_reactive_states
+    @mock.patch('urllib.request.urlopen')
+    @mock.patch('spcharms.utils.err')
+    @mock.patch('spinventory.packages.cache_valid')
+    @mock.patch('subprocess.Popen')
+    def test_spool(self, sub_popen, pkg_cache_valid, sputils_err, urlopen):
+        sub_popen.return_value.wait.return_value = 0
+        pkg_cache_valid.return_value = True
+        r_config.r_set('native_collectors', False, False)
+        r_config.r_set('submit_spool', True, False)
+        r_config.r_set('submit_url', 'http://inventory.example.com/', False)
+
+        # The previous snapshot was never submitted
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'old'}, f)
+        r_state.r_set_states(set(['storpool-inventory.collecting',
+                                  'storpool-inventory.configured']))
+        testee.collect()
+        spooled = testee.spspool.entries(testee.spooldir)
+        self.assertEquals(1, len(spooled))
+        with open(spooled[0][1], mode='r') as f:
+            self.assertEquals({'lscpu.txt': 'old'}, json.load(f))
+
+        # Send both of them at once
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+        urlopen.return_value = mock_client
+        testee.try_to_submit()
+        self.assertEquals(1, urlopen.call_count)
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        data = json.loads(urlopen.call_args[0][0].data.decode('latin1'))
+        self.assertEquals('batch', data['format'])
+        self.assertEquals([{'lscpu.txt': 'old'}, testee.read_collected()],
+                          [snap['collected'] for snap in data['snapshots']])
+        self.assertEquals([], testee.spspool.entries(testee.spooldir))
+
+        # The previous snapshot is being sent in the background
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'sending'}, f)
+        testee.spstore.forget(testee.storedir)
+        r_state.r_set_states(set(['storpool-inventory.collecting',
+                                  'storpool-inventory.configured',
+                                  'storpool-inventory.sending']))
+        testee.collect()
+        self.assertIn('storpool-inventory.submitting', r_state.r_get_states())
+        self.assertEquals([], testee.spspool.entries(testee.spooldir))
+
+    @mock_reactive_states
+    @mock.patch('platform.node')
+    @mock.patch('urllib.request.urlopen')
+    @mock.patch('spcharms.utils.err')
+    @mock.patch('charmhelpers.core.hookenv.relation_set')
+    @mock.patch('charmhelpers.core.hookenv.relation_get')
+    @mock.patch('charmhelpers.core.hookenv.related_units')
+    @mock.patch('charmhelpers.core.hookenv.relation_ids')
+    @mock.patch('charmhelpers.core.hookenv.is_leader')
+    def test_via_leader(self, is_leader, relation_ids, related_units,
+                        relation_get, relation_set, sputils_err, urlopen,
+                        platform_node):
+        sputils_err.side_effect = lambda *args: self.fail_on_err(*args)
+        r_config.r_set('submit_via_leader', True, False)
+        r_config.r_set('submit_url', 'http://inventory.example.com/', False)
+        relation_ids.return_value = ['inventory-peers:1']
+        related_units.return_value = ['storpool-inventory/1']
+        submit_states = set(['storpool-inventory.configured',
+                             'storpool-inventory.collected',
+                             'storpool-inventory.submitting'])
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'node-1'}, f)
+
+        # A unit that is not the leader only publishes its data
+        platform_node.return_value = 'node-1'
+        is_leader.return_value = False
+        r_state.r_set_states(submit_states)
+        testee.try_to_submit()
+        self.assertEquals(0, urlopen.call_count)
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        relation_set.assert_called_once_with('inventory-peers:1', mock.ANY)
+        published = relation_set.call_args[0][1]
+        self.assertEquals('node-1', published['inventory-node'])
+
+        # The leader submits the data of all the units at once
+        platform_node.return_value = 'node-0'
+        is_leader.return_value = True
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'node-0'}, f)
+        relation_get.return_value = published
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+        bodies = []
+        urlopen.side_effect = lambda req: \
+            (bodies.append(req.data.read()), mock_client)[1]
+        r_state.r_set_states(submit_states)
+        testee.try_to_submit()
+        self.assertEquals(1, urlopen.call_count)
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        req = urlopen.call_args[0][0]
+        self.assertEquals('gzip', req.get_header('Content-encoding'))
+        data = json.loads(gzip.decompress(bodies[0]).decode('latin1'))
+        self.assertEquals({
+            'format': 'multi',
+            'nodes': [
+                {'filename': 'node-0', 'collected': {'lscpu.txt': 'node-0'}},
+                {'filename': 'node-1', 'collected': {'lscpu.txt': 'node-1'}},
+            ],
+        }, data)
+
+        # Nothing changed, nothing to submit
+        testee.peers_changed()
+        self.assertEquals(submit_states, r_state.r_get_states())
+        testee.try_to_submit()
+        self.assertEquals(1, urlopen.call_count)
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+
+    @mock_reactive_states
+    @mock.patch('urllib.request.urlopen')
+    def test_submit_binary(self, urlopen):
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'x86_64', '_timeouts': []}, f)
+        r_config.r_set('submit_url', 'http://inventory.example.com/', False)
+        r_config.r_set('submit_binary', True, False)
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+        urlopen.return_value = mock_client
+
+        r_state.r_set_states(set(['storpool-inventory.configured',
+                                  'storpool-inventory.collected',
+                                  'storpool-inventory.submitting']))
+        testee.try_to_submit()
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        self.assertEquals(1, urlopen.call_count)
+        req = urlopen.call_args[0][0]
+        self.assertEquals(testee.spsubmit.CONTENT_CBOR,
+                          req.get_header('Content-type'))
+        data = testee.spsubmit.spcbor.loads(req.data)
+        self.assertEquals({'lscpu.txt': b'x86_64', '_timeouts': []},
+                          data['collected'])
+        self.assertEquals(testee.spsubmit.CONTENT_CBOR,
+                          testee.spsubmit.load_negotiated(
+                              testee.negotiatefile,
+                              'http://inventory.example.com/'))
+
+    @mock_reactive_states
+    @mock.patch('urllib.request.urlopen')
+    def test_submit_conditional(self, urlopen):
+        url = 'http://inventory.example.com/'
+        collected = {
+            'lscpu.txt': 'x86_64',
+            'structured': {'nics': [{'name': 'eth0',
+                                     'mac': '0c:c4:7a:12:34:56'}]},
+        }
+        with open(testee.datafile, mode='w') as f:
+            json.dump(collected, f)
+        fprint = testee.spfingerprint.fingerprint(collected)
+        r_config.r_set('submit_url', url, False)
+        r_config.r_set('submit_conditional', True, False)
+        submit_states = set(['storpool-inventory.configured',
+                             'storpool-inventory.collected',
+                             'storpool-inventory.submitting'])
+
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+        requests = []
+
+        def respond(req):
+            requests.append(req)
+            if req.get_method() == 'HEAD':
+                raise urllib.error.HTTPError(req.full_url, 304,
+                                             'Not Modified', {}, None)
+            return mock_client
+
+        # The server already has it
+        urlopen.side_effect = respond
+        r_state.r_set_states(set(submit_states))
+        testee.try_to_submit()
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        self.assertEquals(['HEAD'], [req.get_method() for req in requests])
+        self.assertEquals('"{fp}"'.format(fp=fprint),
+                          requests[0].get_header('If-none-match'))
+        self.assertEquals(fprint, testee.spfingerprint.load_acknowledged(
+            testee.fingerprintfile, url))
+
+        # The data changed later, no need to ask again
+        r_state.r_set_states(set(submit_states))
+        testee.try_to_submit()
+        self.assertIn('storpool-inventory.submitted', r_state.r_get_states())
+        self.assertEquals(['HEAD', 'POST'],
+                          [req.get_method() for req in requests])
+        self.assertEquals(fprint, requests[1].get_header(
+            'X-inventory-fingerprint'))
+
+        # After an upgrade, ask again; the server does not have it
+        testee.recollect_and_resubmit()
+        urlopen.side_effect = None
+        urlopen.return_value = mock_client
+        r_state.r_set_states(set(submit_states))
+        testee.try_to_submit()
+        self.assertEquals(['HEAD', 'POST'],
+                          [call[0][0].get_method()
+                           for call in urlopen.call_args_list[-2:]])
+        self.assertEquals(fprint, testee.spfingerprint.load_acknowledged(
+            testee.fingerprintfile, url))
+
+    @mock_reactive_states
+    @mock.patch('urllib.request.urlopen')
+    @mock.patch('spcharms.utils.err')
+    @mock.patch('spinventory.sender.spawn')
+    @mock.patch('charmhelpers.core.hookenv.charm_dir')
+    def test_submit_async(self, charm_dir, spawn, sputils_err, urlopen):
+        url = 'http://inventory.example.com/'
+        with open(testee.datafile, mode='w') as f:
+            json.dump({'lscpu.txt': 'x86_64', '_timeouts': []}, f)
+        charm_dir.return_value = '/var/lib/juju/charm'
+        spawn.return_value = 42
+        r_config.r_set('submit_url', url, False)
+        r_config.r_set('submit_async', True, False)
+        r_config.r_set('submit_binary', True, False)
+        r_config.r_set('submit_encoding', 'gzip', False)
+        r_config.r_set('submit_backoff_base', 60, False)
+        r_config.r_set('submit_backoff_max', 3600, False)
+        submit_states = set(['storpool-inventory.configured',
+                             'storpool-inventory.collected',
+                             'storpool-inventory.submitting'])
+        sending_states = set(['storpool-inventory.configured',
+                              'storpool-inventory.collected',
+                              'storpool-inventory.sending'])
+
+        mock_client = mock.MagicMock(spec=http_client.HTTPResponse)
+        mock_client.getcode.return_value = 200
+        mock_client.__enter__.return_value = mock_client
+
+        # The hook only starts the sender
+        r_state.r_set_states(set(submit_states))
+        testee.try_to_submit()
+        self.assertEquals(sending_states, r_state.r_get_states())
+        spawn.assert_called_once_with(testee.senderdir,
+                                      '/var/lib/juju/charm/lib')
+        self.assertEquals(0, urlopen.call_count)
+        (state, job, _) = testee.spsender.status(testee.senderdir)
+        self.assertEquals('lost', state)
+        self.assertEquals(testee.spsubmit.CONTENT_CBOR, job['content_type'])
+        self.assertEquals('gzip', job['headers']['Content-Encoding'])
+
+        # The data changes while the sender is still running
+        testee.spsender.save_pid(testee.senderdir, os.getpid())
+        r_state.set_state('storpool-inventory.submitting')
+        testee.try_to_submit()
+        testee.check_background_submission()
+        self.assertEquals(sending_states | submit_states,
+                          r_state.r_get_states())
+        self.assertEquals(1, spawn.call_count)
+
+        # The server does not accept CBOR
+        urlopen.side_effect = urllib.error.HTTPError(
+            url, 415, 'Unsupported Media Type', {}, None)
+        testee.spsender.run(testee.senderdir)
+        testee.check_background_submission()
+        self.assertEquals(submit_states, r_state.r_get_states())
+        self.assertFalse(os.path.exists(testee.senderdir))
+        self.assertEquals(testee.spsubmit.CONTENT_JSON,
+                          testee.spsubmit.load_negotiated(
+                              testee.negotiatefile, url))
+
+        # Send JSON instead
+        urlopen.side_effect = None
+        urlopen.return_value = mock_client
+        testee.try_to_submit()
+        self.assertEquals(sending_states, r_state.r_get_states())
+        testee.spsender.run(testee.senderdir)
+        req = urlopen.call_args[0][0]
+        self.assertEquals(testee.spsubmit.CONTENT_JSON,
+                          req.get_header('Content-type'))
+        with open(os.path.join(testee.senderdir,
+                               testee.spsender.BODY_FILE), mode='rb') as f:
+            self.assertEquals(
+                {'lscpu.txt': 'x86_64', '_timeouts': []},
+                json.loads(gzip.decompress(f.read()).decode())['collected'])
+        testee.check_background_submission()
+        self.assertEquals(set(['storpool-inventory.configured',
+                               'storpool-inventory.collected',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+        self.assertEquals(0, sputils_err.call_count)
+
+        # The sender dies without recording the outcome
+        r_state.r_set_states(set(submit_states))
+        testee.try_to_submit()
+        testee.check_background_submission()
+        self.assertEquals(set(['storpool-inventory.configured',
+                               'storpool-inventory.collected']),
+                          r_state.r_get_states())
+        self.assertEquals(1, sputils_err.call_count)
+        state = testee.spbackoff.load_state(testee.backofffile)
+        self.assertEquals(1, state['failures'])
+
+        # Nothing happens without a submission in progress
+        r_state.set_state('storpool-inventory.sending')
+        testee.check_background_submission()
+        self.assertIn('storpool-inventory.submitting', r_state.r_get_states())
+        self.assertNotIn('storpool-inventory.sending',
+                         r_state.r_get_states())
+
+    @mock_reactive_states
+    @mock.patch('charmhelpers.core.hookenv.hook_name')
+    def test_profile_hooks(self, hook_name):
+        hook_name.return_value = 'update-status'
+        self.assertNotEqual(
+            testee.rbus._action_id(testee.collect),
+            testee.rbus._action_id(testee.try_to_submit))
+        self.assertEqual('submit_if_needed', testee.submit_if_needed.__name__)
+
+        # Not profiling by default
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+        testee.submit_if_needed()
+        self.assertEquals([], testee.spprofiling.reports(testee.profiledir))
+
+        r_config.r_set('profile_hooks', True, False)
+        r_config.r_set('profile_keep', 2, False)
+        for _ in range(3):
+            testee.submit_if_needed()
+        reports = testee.spprofiling.reports(testee.profiledir)
+        self.assertEquals(['update-status.submit_if_needed'] * 2,
+                          [name for (_, name, _) in reports])
+        with open(reports[-1][2] + '.txt', mode='r') as f:
+            self.assertIn('submit_if_needed', f.read())
+        self.assertFalse(testee.profiler_active)
+
+    @mock_reactive_states
+    @mock.patch('spinventory.hotplug.reload_udev')
+    def test_hotplug(self, reload_udev):
+        # No watching by default
+        testee.have_config()
+        self.assertFalse(os.path.exists(testee.udevrulesfile))
+        self.assertEquals(0, reload_udev.call_count)
+
+        r_config.r_set('hotplug_watch', True, True)
+        testee.have_config()
+        self.assertTrue(os.path.exists(testee.udevrulesfile))
+        self.assertEquals(1, reload_udev.call_count)
+        testee.have_config()
+        self.assertEquals(1, reload_udev.call_count)
+
+        # Nothing happened
+        r_state.r_set_states(set(['storpool-inventory.collected',
+                                  'storpool-inventory.submitted']))
+        testee.process_hotplug_events()
+        self.assertEquals(set(['storpool-inventory.collected',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+
+        # A disk was added
+        with open(testee.queuefile, mode='a') as f:
+            f.write('add block sdc\nadd block sdc1\n')
+        testee.process_hotplug_events()
+        self.assertEquals(set(['storpool-inventory.collecting',
+                               'storpool-inventory.submitted']),
+                          r_state.r_get_states())
+        self.assertEquals(['ls-dev-disk-by-id', 'ls-dev-disk-by-path',
+                           'lsblk', 'nvme-list'],
+                          testee.spschedule.take_pending(
+                              testee.schedulefile))
+
+        r_config.r_set('hotplug_watch', False, True)
+        testee.have_config()
+        self.assertFalse(os.path.exists(testee.udevrulesfile))
+        self.assertEquals(2, reload_udev.call_count)
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory structured data parsers.
+"""
+
+import os
+import sys
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import model as spmodel
+
+
+LSBLK = """NAME        MAJ:MIN RM   SIZE RO TYPE MOUNTPOINT
+sda           8:0    0 223.6G  0 disk
+├─sda1        8:1    0   512M  0 part /boot/efi
+└─sda2        8:2    0 223.1G  0 part
+  └─vg-root 253:0    0 223.1G  0 lvm  /
+nvme0n1     259:0    0 232.9G  0 disk
+sr0          11:0    1  1024M  0 rom
+"""
+
+SIZES = {
+    'sda': 240057409536,
+    'nvme0n1': 250059350016,
+    'sr0': 1073741312,
+}
+
+BY_ID = """total 0
+lrwxrwxrwx 1 root root  9 Oct 16 10:00 ata-SAMSUNG_SSD_850_S21NX0AG123 -> ../../sda
+lrwxrwxrwx 1 root root 10 Oct 16 10:00 ata-SAMSUNG_SSD_850_S21NX0AG123-part1 -> ../../sda1
+lrwxrwxrwx 1 root root 13 Oct 16 10:00 nvme-Samsung_SSD_960_EVO_S3EW -> ../../nvme0n1
+lrwxrwxrwx 1 root root  9 Oct 16 10:00 wwn-0x5002538d40123456 -> ../../sda
+"""  # noqa: E501
+
+NVME_LIST = """Node             SN                   Model                                    Namespace Usage                      Format           FW Rev
+---------------- -------------------- ---------------------------------------- --------- -------------------------- ---------------- --------
+/dev/nvme0n1     S3EWNX0K123456       Samsung SSD 960 EVO 250GB                1          40.01  GB / 250.06  GB    512   B +  0 B   2B7QCXE7
+"""  # noqa: E501
+
+NVME_LIST_2 = """Node                  Generic               SN                   Model                                    Namespace Usage                      Format           FW Rev
+--------------------- --------------------- -------------------- ---------------------------------------- --------- -------------------------- ---------------- --------
+/dev/nvme0n1          /dev/ng0n1            S3EWNX0K123456       Samsung SSD 960 EVO 250GB                0x1        40.01  GB / 250.06  GB    512   B +  0 B   2B7QCXE7
+"""  # noqa: E501
+
+LSPCI = """0000:00:1f.2 SATA controller [0106]: Intel Corporation 82801JI (ICH10 Family) SATA AHCI Controller [8086:3a22] (rev 02) (prog-if 01 [AHCI 1.0])
+\tSubsystem: Red Hat, Inc. QEMU Virtual Machine [1af4:1100]
+\tControl: I/O+ Mem+ BusMaster+ SpecCycle- MemWINV- VGASnoop- ParErr-
+\tKernel driver in use: ahci
+
+0000:03:00.0 Ethernet controller [0200]: Mellanox Technologies MT27710 Family [ConnectX-4 Lx] [15b3:1015]
+\tSubsystem: Mellanox Technologies Stand-up ConnectX-4 Lx EN [15b3:0003]
+\tKernel driver in use: mlx5_core
+\tKernel modules: mlx5_core
+"""  # noqa: E501
+
+IP_ADDRESS = """1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN group default qlen 1000
+    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00
+    inet 127.0.0.1/8 scope host lo
+       valid_lft forever preferred_lft forever
+    inet6 ::1/128 scope host
+       valid_lft forever preferred_lft forever
+2: eth0@if7: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 9000 qdisc noqueue state UP group default qlen 1000
+    link/ether 52:54:00:12:34:56 brd ff:ff:ff:ff:ff:ff link-netnsid 0
+    inet 10.1.2.3/24 brd 10.1.2.255 scope global eth0
+       valid_lft forever preferred_lft forever
+"""  # noqa: E501
+
+
+class TestModel(unittest.TestCase):
+    def test_disks(self):
+        links = spmodel.parse_disk_links(BY_ID)
+        nvme = spmodel.parse_nvme_list(NVME_LIST)
+        self.assertEqual([
+            spmodel.Disk(name='sda', size=240057409536,
+                         model='SAMSUNG SSD 850', serial='S21NX0AG123',
+                         by_id=[
+                             '/dev/disk/by-id/'
+                             'ata-SAMSUNG_SSD_850_S21NX0AG123',
+                             '/dev/disk/by-id/wwn-0x5002538d40123456',
+                         ]),
+            spmodel.Disk(name='nvme0n1', size=250059350016,
+                         model='Samsung SSD 960 EVO 250GB',
+                         serial='S3EWNX0K123456',
+                         by_id=[
+                             '/dev/disk/by-id/nvme-Samsung_SSD_960_EVO_S3EW',
+                         ]),
+        ], spmodel.parse_lsblk(LSBLK, links, nvme, SIZES))
+        self.assertEqual([None, None],
+                         [d.size for d in spmodel.parse_lsblk(LSBLK)])
+
+    def test_nvme(self):
+        self.assertEqual([
+            spmodel.NVMeNamespace(node='/dev/nvme0n1',
+                                  serial='S3EWNX0K123456',
+                                  model='Samsung SSD 960 EVO 250GB',
+                                  namespace='1',
+                                  usage='40.01 GB / 250.06 GB',
+                                  format='512 B + 0 B',
+                                  firmware='2B7QCXE7'),
+        ], spmodel.parse_nvme_list(NVME_LIST))
+        self.assertEqual([], spmodel.parse_nvme_list(''))
+
+        # nvme-cli 2.x adds a column for the generic device
+        self.assertEqual([
+            spmodel.NVMeNamespace(node='/dev/nvme0n1',
+                                  serial='S3EWNX0K123456',
+                                  model='Samsung SSD 960 EVO 250GB',
+                                  namespace='0x1',
+                                  usage='40.01 GB / 250.06 GB',
+                                  format='512 B + 0 B',
+                                  firmware='2B7QCXE7'),
+        ], spmodel.parse_nvme_list(NVME_LIST_2))
+
+        # Not the output of any known version
+        self.assertEqual([], spmodel.parse_nvme_list(
+            NVME_LIST_2.replace(' SN ', ' ID ')))
+
+    def test_pci(self):
+        devs = spmodel.parse_lspci(LSPCI)
+        self.assertEqual(2, len(devs))
+        self.assertEqual({
+            'slot': '0000:00:1f.2',
+            'cls': 'SATA controller',
+            'cls_id': '0106',
+            'name': 'Intel Corporation 82801JI (ICH10 Family) '
+                    'SATA AHCI Controller',
+            'vendor_id': '8086',
+            'device_id': '3a22',
+            'subsystem_vendor_id': '1af4',
+            'subsystem_device_id': '1100',
+            'rev': '02',
+            'driver': 'ahci',
+        }, devs[0].to_dict())
+        self.assertEqual('Mellanox Technologies MT27710 Family '
+                         '[ConnectX-4 Lx]', devs[1].name)
+        self.assertEqual(('15b3', '1015', None, 'mlx5_core'),
+                         (devs[1].vendor_id, devs[1].device_id,
+                          devs[1].rev, devs[1].driver))
+
+    def test_nics(self):
+        self.assertEqual([
+            spmodel.NIC(name='lo', mac='00:00:00:00:00:00', mtu=65536,
+                        state='UNKNOWN', addresses=['127.0.0.1/8', '::1/128']),
+            spmodel.NIC(name='eth0', mac='52:54:00:12:34:56', mtu=9000,
+                        state='UP', addresses=['10.1.2.3/24']),
+        ], spmodel.parse_ip_address(IP_ADDRESS))
+
+    def test_build_structured(self):
+        data = spmodel.build_structured({
+            'lsblk.txt': LSBLK,
+            'ls-dev-disk-by-id.txt': BY_ID,
+            'nvme-list.txt': NVME_LIST,
+            'lspci-vvnnqD.txt': LSPCI,
+            'ip-address-list.txt': IP_ADDRESS,
+        }, SIZES)
+        self.assertEqual([('sda', 240057409536),
+                          ('nvme0n1', 250059350016)],
+                         [(d['name'], d['size']) for d in data['disks']])
+        self.assertEqual(1, len(data['nvme']))
+        self.assertEqual(['0000:00:1f.2', '0000:03:00.0'],
+                         [d['slot'] for d in data['pci']])
+        self.assertEqual(['lo', 'eth0'], [n['name'] for n in data['nics']])
+
+    def test_record(self):
+        self.assertRaises(TypeError, spmodel.NIC, name='eth0', speed=10)
+        nic = spmodel.NIC(name='eth0')
+        self.assertIsNone(nic.mac)
+        self.assertRaises(AttributeError, setattr, nic, 'speed', 10)
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory native collectors.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import native as spnative
+
+
+MEMINFO = """MemTotal:       16288852 kB
+MemFree:         8862204 kB
+MemAvailable:   11723492 kB
+Buffers:          300116 kB
+Cached:          3240612 kB
+SwapCached:            0 kB
+Shmem:            589100 kB
+SReclaimable:     233872 kB
+SwapTotal:       2097148 kB
+SwapFree:        2097148 kB
+"""
+
+MODULES = """nls_utf8 16384 1 - Live 0x0000000000000000
+isofs 49152 1 - Live 0x0000000000000000
+ext4 737280 2 - Live 0x0000000000000000
+mbcache 16384 1 ext4, Live 0x0000000000000000
+jbd2 131072 1 ext4, Live 0x0000000000000000
+"""
+
+MOUNTINFO = """21 1 253:0 / / rw shared:1 - ext4 /dev/mapper/vg-root rw
+22 21 8:1 / /boot/my\\040efi rw,relatime shared:2 - vfat /dev/sda1 rw
+"""
+
+SWAPS = """Filename\t\t\t\tType\t\tSize\tUsed\tPriority
+/dev/sdb1                               partition\t2097148\t0\t-2
+"""
+
+
+class TestNative(unittest.TestCase):
+    def write(self, path, contents):
+        fname = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, mode='w') as f:
+            f.write(contents)
+
+    def symlink(self, path, target):
+        fname = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        os.symlink(target, fname)
+
+    def block(self, path, dev, size, **attrs):
+        self.write(os.path.join(path, 'dev'), dev + '\n')
+        self.write(os.path.join(path, 'size'), str(size) + '\n')
+        self.write(os.path.join(path, 'ro'), '0\n')
+        os.makedirs(os.path.join(self.root, path, 'holders'))
+        os.makedirs(os.path.join(self.root, path, 'slaves'))
+        for (name, value) in attrs.items():
+            self.write(os.path.join(path, name.replace('__', '/')),
+                       value + '\n')
+
+    def setUp(self):
+        """
+        Build a fake root directory with the relevant procfs and sysfs
+        files.
+        """
+        super(TestNative, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = self.tempdir.name
+
+        self.write('proc/meminfo', MEMINFO)
+        self.write('proc/modules', MODULES)
+        self.write('proc/self/mountinfo', MOUNTINFO)
+        self.write('proc/swaps', SWAPS)
+
+        self.symlink('sys/class/net/eth0',
+                     '../../devices/pci0000:00/0000:00:03.0/net/eth0')
+        self.symlink('sys/class/net/lo', '../../devices/virtual/net/lo')
+        self.symlink('dev/disk/by-id/ata-SAMSUNG_SSD_850_S21', '../../sda')
+        self.symlink('dev/disk/by-id/ata-SAMSUNG_SSD_850_S21-part1',
+                     '../../sda1')
+        self.symlink('dev/disk/by-path/pci-0000:00:1f.2-ata-1', '../../sda')
+
+        self.block('sys/block/sda', '8:0', 468862128, removable='0')
+        self.block('sys/block/sda/sda1', '8:1', 1048576, partition='1')
+        self.block('sys/block/sda/sda2', '8:2', 467811328, partition='2')
+        self.write('sys/block/sda/sda2/holders/dm-0', '')
+        self.block('sys/block/sdb', '8:16', 4194304, removable='1')
+        self.block('sys/block/sdb/sdb1', '8:17', 4192256, partition='1')
+        self.block('sys/block/dm-0', '253:0', 467808256,
+                   dm__name='vg-root', dm__uuid='LVM-abcdef')
+        self.write('sys/block/dm-0/slaves/sda2', '')
+        self.block('sys/block/loop0', '7:0', 0)
+        self.block('sys/block/ram0', '1:0', 131072)
+        self.block('sys/block/sr0', '11:0', 2097151, removable='1',
+                   device__type='5')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestNative, self).tearDown()
+
+    def test_free_m(self):
+        self.assertEqual(
+            '              total        used        free      shared'
+            '  buff/cache   available\n'
+            'Mem:          15907        3566        8654         575'
+            '        3686       11448\n'
+            'Swap:          2047           0        2047\n',
+            spnative.free_m(self.root))
+
+    def test_lsmod(self):
+        self.assertEqual(
+            'Module                  Size  Used by\n'
+            'nls_utf8               16384  1\n'
+            'isofs                  49152  1\n'
+            'ext4                  737280  2\n'
+            'mbcache                16384  1 ext4\n'
+            'jbd2                  131072  1 ext4\n',
+            spnative.lsmod(self.root))
+
+    def test_ls(self):
+        lines = spnative.ls_sys_class_net(self.root).splitlines()
+        self.assertEqual('total 0', lines[0])
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('lrwxrwxrwx 1 '))
+        self.assertTrue(lines[1].endswith(
+            ' eth0 -> ../../devices/pci0000:00/0000:00:03.0/net/eth0'))
+        self.assertTrue(lines[2].endswith(
+            ' lo -> ../../devices/virtual/net/lo'))
+
+        lines = spnative.ls_dev_disk_by_id(self.root).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].endswith(
+            ' ata-SAMSUNG_SSD_850_S21 -> ../../sda'))
+        self.assertTrue(lines[2].endswith(
+            ' ata-SAMSUNG_SSD_850_S21-part1 -> ../../sda1'))
+
+        lines = spnative.ls_dev_disk_by_path(self.root).splitlines()
+        self.assertEqual(2, len(lines))
+
+    def test_human_size(self):
+        self.assertEqual('0B', spnative.human_size(0))
+        self.assertEqual('512M', spnative.human_size(512 << 20))
+        self.assertEqual('223.6G', spnative.human_size(240057409536))
+        self.assertEqual('1024M', spnative.human_size(1073741312))
+
+    def test_disk_sizes(self):
+        sizes = spnative.disk_sizes(self.root)
+        self.assertEqual(240057409536, sizes['sda'])
+        self.assertEqual(1073741312, sizes['sr0'])
+        self.assertNotIn('sda1', sizes)
+
+    def test_lsblk(self):
+        self.assertEqual(
+            'NAME        MAJ:MIN RM   SIZE RO TYPE MOUNTPOINT\n'
+            'sda           8:0    0 223.6G  0 disk\n'
+            '├─sda1        8:1    0   512M  0 part /boot/my efi\n'
+            '└─sda2        8:2    0 223.1G  0 part\n'
+            '  └─vg-root 253:0    0 223.1G  0 lvm  /\n'
+            'sdb           8:16   1     2G  0 disk\n'
+            '└─sdb1        8:17   1     2G  0 part [SWAP]\n'
+            'sr0          11:0    1  1024M  0 rom\n',
+            spnative.lsblk(self.root))
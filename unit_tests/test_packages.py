@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory package checks.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mock
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import packages as sppackages
+
+
+DPKG_OUTPUT = b"""dmidecode install ok installed 3.0-2ubuntu0.1
+lshw install ok installed 02.17-1.1ubuntu3.5
+nvme-cli deinstall ok config-files 0.5-1
+pciutils install ok installed 1:3.3.1-1.1ubuntu1.2
+"""
+
+
+class TestPackages(unittest.TestCase):
+    def setUp(self):
+        super(TestPackages, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.tempdir.name, 'packages.json')
+        self.status = os.path.join(self.tempdir.name, 'status')
+        with open(self.status, mode='w') as f:
+            f.write('Package: dmidecode\n')
+
+        self.bindir = os.path.join(self.tempdir.name, 'bin')
+        os.mkdir(self.bindir)
+        for binaries in sppackages.PACKAGES.values():
+            for b in binaries:
+                path = os.path.join(self.bindir, b)
+                with open(path, mode='w') as f:
+                    f.write('#!/bin/sh\n')
+                os.chmod(path, 0o755)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestPackages, self).tearDown()
+
+    @mock.patch('subprocess.check_output')
+    def test_installed(self, check_output):
+        check_output.side_effect = subprocess.CalledProcessError(
+            1, 'dpkg-query', output=DPKG_OUTPUT)
+        self.assertEqual({
+            'dmidecode': '3.0-2ubuntu0.1',
+            'lshw': '02.17-1.1ubuntu3.5',
+            'pciutils': '1:3.3.1-1.1ubuntu1.2',
+        }, sppackages.installed_packages())
+
+        with mock.patch('spinventory.packages.find_binary',
+                        new=lambda name: '/usr/bin/' + name):
+            self.assertEqual(['nvme-cli', 'usbutils'],
+                             sppackages.missing_packages(
+                                 sppackages.installed_packages()))
+
+    def test_cache(self):
+        versions = dict((name, '1.0') for name in sppackages.PACKAGES)
+        find = lambda name: os.path.join(self.bindir, name)  # noqa: E731
+        with mock.patch('spinventory.packages.DPKG_STATUS', new=self.status), \
+                mock.patch('spinventory.packages.find_binary', new=find):
+            self.assertFalse(sppackages.cache_valid(self.cache))
+
+            sppackages.save_cache(self.cache, versions)
+            self.assertTrue(sppackages.cache_valid(self.cache))
+
+            # A tool disappeared
+            os.unlink(os.path.join(self.bindir, 'lshw'))
+            self.assertFalse(sppackages.cache_valid(self.cache))
+
+            # The dpkg database changed
+            with open(os.path.join(self.bindir, 'lshw'), mode='w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(os.path.join(self.bindir, 'lshw'), 0o755)
+            self.assertTrue(sppackages.cache_valid(self.cache))
+            st = os.stat(self.status)
+            os.utime(self.status, (st.st_atime, st.st_mtime + 10))
+            self.assertFalse(sppackages.cache_valid(self.cache))
+
+            # Something was not installed at all
+            del versions['usbutils']
+            sppackages.save_cache(self.cache, versions)
+            self.assertFalse(sppackages.cache_valid(self.cache))
+
+            sppackages.forget_cache(self.cache)
+            self.assertFalse(os.path.exists(self.cache))
+            sppackages.forget_cache(self.cache)
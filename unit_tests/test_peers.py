@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory peer relation helpers.
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import peers as sppeers
+
+
+class TestPeers(unittest.TestCase):
+    def setUp(self):
+        super(TestPeers, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.datafile = os.path.join(self.tempdir.name, 'collect.json')
+        self.data = b'{"lspci.txt": "' + b'x' * 200000 + b'"}\n'
+        with open(self.datafile, mode='wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestPeers, self).tearDown()
+
+    def test_payload(self):
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(),
+                         sppeers.file_hash(self.datafile))
+        text = sppeers.encode_payload(self.datafile)
+        self.assertIsInstance(text, str)
+        self.assertLess(len(text), len(self.data) / 10)
+        self.assertEqual(self.data, sppeers.decode_payload(text))
+        self.assertEqual([self.data], list(sppeers.payload_chunks(text)))
+
+    def test_published(self):
+        self.assertIsNone(sppeers.published(None))
+        self.assertIsNone(sppeers.published({}))
+        self.assertIsNone(sppeers.published({
+            sppeers.KEY_NODE: 'node',
+            sppeers.KEY_HASH: 'abc',
+        }))
+        self.assertEqual(('node', 'abc', 'data'), sppeers.published({
+            sppeers.KEY_NODE: 'node',
+            sppeers.KEY_HASH: 'abc',
+            sppeers.KEY_DATA: 'data',
+            'private-address': '10.1.1.1',
+        }))
+
+    def test_submitted(self):
+        path = os.path.join(self.tempdir.name, 'aggregated.json')
+        self.assertEqual({}, sppeers.load_submitted(path))
+        sppeers.save_submitted(path, {'node': 'abc'})
+        self.assertEqual({'node': 'abc'}, sppeers.load_submitted(path))
+        sppeers.forget_submitted(path)
+        self.assertFalse(os.path.exists(path))
+        sppeers.forget_submitted(path)
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory profiling reports.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import profiling as spprofiling
+
+
+def busy(count):
+    return sum(range(count))
+
+
+class TestProfiling(unittest.TestCase):
+    def test_report_name(self):
+        self.assertEqual('config-changed.have_config',
+                         spprofiling.report_name('config-changed',
+                                                 'have_config'))
+        self.assertEqual('_usr_bin_python3.collect',
+                         spprofiling.report_name('/usr/bin/python3',
+                                                 'collect'))
+
+    def test_save(self):
+        """
+        Store the reports, keep only the most recent ones.
+        """
+        prof = cProfile.Profile()
+        self.assertEqual(4950, prof.runcall(busy, 100))
+        with tempfile.TemporaryDirectory() as d:
+            profdir = os.path.join(d, 'profiles')
+            self.assertEqual([], spprofiling.reports(profdir))
+            paths = [spprofiling.save(prof, profdir, 'hook.busy', 3, 5,
+                                      timestamp=1000.0 + idx)
+                     for idx in range(4)]
+            self.assertEqual(
+                [(1000.0 + idx, 'hook.busy', paths[idx])
+                 for idx in range(1, 4)],
+                spprofiling.reports(profdir))
+            self.assertFalse(os.path.exists(paths[0] + '.txt'))
+
+            with open(paths[-1] + '.txt', mode='r') as f:
+                summary = f.read()
+            self.assertIn('busy', summary)
+            self.assertIn('cumulative', summary)
+            stats = pstats.Stats(paths[-1] + '.prof')
+            self.assertTrue(any(func[2] == 'busy' for func in stats.stats))
+
+            self.assertEqual(paths[1:3], spprofiling.rotate(profdir, 1))
+            self.assertEqual(1, len(spprofiling.reports(profdir)))
+            spprofiling.forget(profdir)
+            self.assertFalse(os.path.exists(profdir))
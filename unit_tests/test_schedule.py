@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory re-collection schedule.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import schedule as spschedule
+
+
+class TestSchedule(unittest.TestCase):
+    def test_due(self):
+        """
+        Each tier is due according to its own interval.
+        """
+        names = ['dmidecode', 'lsblk', 'ip-address-list']
+        intervals = {
+            spschedule.TIER_VOLATILE: 60,
+            spschedule.TIER_STATIC: 3600,
+        }
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'schedule.json')
+            self.assertEqual(sorted(names),
+                             spschedule.due_collectors(path, names,
+                                                       intervals, 1000))
+
+            spschedule.record_run(path, names, 1000)
+            self.assertEqual([], spschedule.due_collectors(
+                path, names, intervals, 1059))
+            self.assertEqual(['ip-address-list', 'lsblk'],
+                             spschedule.due_collectors(
+                                 path, names, intervals, 1060))
+            self.assertEqual(sorted(names), spschedule.due_collectors(
+                path, names, intervals, 4600))
+
+            intervals[spschedule.TIER_STATIC] = 0
+            self.assertEqual(['ip-address-list', 'lsblk'],
+                             spschedule.due_collectors(
+                                 path, names, intervals, 1000000))
+
+    def test_pending(self):
+        """
+        Request some collectors to be run, then take the list.
+        """
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'schedule.json')
+            self.assertEqual([], spschedule.take_pending(path))
+            self.assertFalse(os.path.exists(path))
+
+            spschedule.request(path, ['lsblk', 'nvme-list'])
+            spschedule.request(path, ['lsblk', 'ip-link-list'])
+            spschedule.record_run(path, ['lsblk'], 1000)
+            self.assertEqual(['ip-link-list', 'lsblk', 'nvme-list'],
+                             spschedule.take_pending(path))
+            self.assertEqual([], spschedule.take_pending(path))
+            self.assertEqual({'lsblk': 1000},
+                             spschedule.load_state(path)['last_run'])
+
+            spschedule.forget(path)
+            self.assertFalse(os.path.exists(path))
+            spschedule.forget(path)
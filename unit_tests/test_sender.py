@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory background sender.
+"""
+
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from http import server as http_server
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import sender as spsender
+from spinventory import submit as spsubmit
+
+
+class SenderHandler(http_server.BaseHTTPRequestHandler):
+    """
+    Store the method, headers, and body of each request and respond
+    with the configured code.
+    """
+    code = 201
+    etag = None
+    requests = []
+
+    def do_HEAD(self):
+        self.requests.append(('HEAD', dict(self.headers.items()), None))
+        match = self.etag is not None and \
+            self.headers['If-None-Match'] == self.etag
+        self.send_response(304 if match else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.requests.append(('POST', dict(self.headers.items()),
+                              self.rfile.read(length)))
+        self.send_response(self.code)
+        if self.code == 503:
+            self.send_header('Retry-After', '120')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSender(unittest.TestCase):
+    def setUp(self):
+        super(TestSender, self).setUp()
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.senderdir = os.path.join(tempdir.name, 'sender')
+
+        SenderHandler.code = 201
+        SenderHandler.etag = None
+        SenderHandler.requests = []
+        self.srv = http_server.HTTPServer(('127.0.0.1', 0), SenderHandler)
+        self.addCleanup(self.srv.server_close)
+        self.url = 'http://127.0.0.1:{port}/submit'.format(
+            port=self.srv.server_port)
+
+    def serve(self, count):
+        """
+        Handle the specified number of requests in a separate thread.
+        """
+        thr = threading.Thread(
+            target=lambda: [self.srv.handle_request() for _ in range(count)])
+        thr.start()
+        return thr
+
+    def test_prepare(self):
+        """
+        Write the submission document and the job description.
+        """
+        self.assertEqual(('idle', None, None),
+                         spsender.status(self.senderdir))
+
+        job = spsender.prepare(self.senderdir, self.url,
+                               [b'{"a": ', b'1}'], 'legacy',
+                               spsubmit.CONTENT_JSON,
+                               context={'spooled': ['/x']})
+        self.assertEqual({'Content-Length': '8'}, job['headers'])
+        with open(os.path.join(self.senderdir, spsender.BODY_FILE),
+                  mode='rb') as f:
+            self.assertEqual(b'{"a": 1}', f.read())
+
+        job = spsender.prepare(self.senderdir, self.url,
+                               [b'{"a": ', b'1}'], 'gzip',
+                               spsubmit.CONTENT_JSON,
+                               {'X-Inventory-Fingerprint': 'abc'})
+        self.assertEqual('gzip', job['encoding'])
+        self.assertEqual({}, job['context'])
+        self.assertEqual({
+            'Content-Type': spsubmit.CONTENT_JSON,
+            'Content-Encoding': 'gzip',
+            'Content-Length': str(job['length']),
+            'X-Inventory-Fingerprint': 'abc',
+        }, job['headers'])
+        with open(os.path.join(self.senderdir, spsender.BODY_FILE),
+                  mode='rb') as f:
+            self.assertEqual(b'{"a": 1}', gzip.decompress(f.read()))
+
+        # No sender was started, so the outcome is lost
+        (state, loaded, result) = spsender.status(self.senderdir)
+        self.assertEqual('lost', state)
+        self.assertEqual(job, loaded)
+        self.assertIsNone(result)
+
+        spsender.clear(self.senderdir)
+        self.assertFalse(os.path.exists(self.senderdir))
+
+    def test_run(self):
+        """
+        Send the prepared document and record the outcome.
+        """
+        spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'], 'gzip',
+                         spsubmit.CONTENT_JSON, timeout=10)
+        thr = self.serve(1)
+        try:
+            result = spsender.run(self.senderdir)
+        finally:
+            thr.join()
+        self.assertEqual(201, result['code'])
+        self.assertIsNone(result['error'])
+        self.assertFalse(result['not_modified'])
+        (method, headers, body) = SenderHandler.requests[0]
+        self.assertEqual('POST', method)
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(b'{"a": 1}', gzip.decompress(body))
+        self.assertEqual(('done', result),
+                         spsender.status(self.senderdir)[::2])
+
+        # The server is overloaded
+        SenderHandler.code = 503
+        spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'], 'legacy',
+                         spsubmit.CONTENT_JSON)
+        self.assertEqual('lost', spsender.status(self.senderdir)[0])
+        thr = self.serve(1)
+        try:
+            result = spsender.run(self.senderdir)
+        finally:
+            thr.join()
+        self.assertEqual(503, result['code'])
+        self.assertEqual(120, result['retry_after'])
+        self.assertIsNotNone(result['error'])
+
+        # Nobody is listening
+        self.srv.server_close()
+        spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'], 'legacy',
+                         spsubmit.CONTENT_JSON)
+        result = spsender.run(self.senderdir)
+        self.assertIsNone(result['code'])
+        self.assertIsNotNone(result['error'])
+
+    def test_fingerprint(self):
+        """
+        Ask the server whether it already has the data first.
+        """
+        SenderHandler.etag = '"abc"'
+        spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'], 'legacy',
+                         spsubmit.CONTENT_JSON, check_fingerprint='abc',
+                         filename='node')
+        thr = self.serve(1)
+        try:
+            result = spsender.run(self.senderdir)
+        finally:
+            thr.join()
+        self.assertEqual(304, result['code'])
+        self.assertTrue(result['not_modified'])
+        self.assertEqual(['HEAD'],
+                         [req[0] for req in SenderHandler.requests])
+
+        spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'], 'legacy',
+                         spsubmit.CONTENT_JSON, check_fingerprint='def',
+                         filename='node')
+        thr = self.serve(2)
+        try:
+            result = spsender.run(self.senderdir)
+        finally:
+            thr.join()
+        self.assertEqual(201, result['code'])
+        self.assertFalse(result['not_modified'])
+        self.assertEqual(['HEAD', 'HEAD', 'POST'],
+                         [req[0] for req in SenderHandler.requests])
+
+    def test_spawn(self):
+        """
+        Run the sender in a separate process.
+        """
+        spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'], 'gzip',
+                         spsubmit.CONTENT_JSON, timeout=10)
+        thr = self.serve(1)
+        try:
+            pid = spsender.spawn(self.senderdir, lib_path)
+            with open(os.path.join(self.senderdir, spsender.PID_FILE),
+                      mode='r') as f:
+                self.assertEqual(pid, json.load(f)['pid'])
+            for _ in range(200):
+                (state, _, result) = spsender.status(self.senderdir)
+                if state != 'running':
+                    break
+                time.sleep(0.05)
+        finally:
+            thr.join()
+        self.assertEqual('done', state)
+        self.assertEqual(201, result['code'])
+        with open(os.path.join(self.senderdir, spsender.LOG_FILE),
+                  mode='r') as f:
+            self.assertIn('code 201', f.read())
+        with open(os.path.join(self.senderdir, spsender.RESULT_FILE),
+                  mode='r') as f:
+            self.assertEqual(result, json.load(f))
+
+    def test_stale(self):
+        """
+        Do not wait forever for a sender that is gone or stuck.
+        """
+        self.assertIsNotNone(spsender.process_identity(os.getpid()))
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        self.assertIsNone(spsender.process_identity(proc.pid))
+
+        job = spsender.prepare(self.senderdir, self.url, [b'{"a": 1}'],
+                               'legacy', spsubmit.CONTENT_JSON, timeout=10)
+        spsender.save_pid(self.senderdir, os.getpid())
+        self.assertEqual('running', spsender.status(self.senderdir)[0])
+
+        # The PID now belongs to an unrelated process
+        with open(os.path.join(self.senderdir, spsender.PID_FILE),
+                  mode='w') as f:
+            json.dump({'pid': os.getpid(), 'identity': 'other:1'}, f)
+        self.assertEqual('lost', spsender.status(self.senderdir)[0])
+
+        # A result left over from an earlier submission does not count
+        with open(os.path.join(self.senderdir, spsender.RESULT_FILE),
+                  mode='w') as f:
+            json.dump({'created': job['created'] - 3600, 'code': 201}, f)
+        self.assertEqual('lost', spsender.status(self.senderdir)[0])
+
+        # The sender is stuck way past its time budget
+        proc = subprocess.Popen(['sleep', '30'])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        spsender.save_pid(self.senderdir, proc.pid)
+        self.assertEqual('running', spsender.status(
+            self.senderdir, job['created'] + 20 + spsender.STALE_SLACK)[0])
+        self.assertEqual('lost', spsender.status(
+            self.senderdir, job['created'] + 21 + spsender.STALE_SLACK)[0])
+        self.assertEqual(-9, proc.wait(10))
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory snapshot spool.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import spool as spspool
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.spooldir = os.path.join(self.tempdir.name, 'spool')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestSpool, self).tearDown()
+
+    def spool(self, timestamp, size):
+        path = os.path.join(self.tempdir.name, 'collect.json')
+        with open(path, mode='w') as f:
+            f.write('x' * size)
+        os.utime(path, (timestamp, timestamp))
+        return spspool.add(self.spooldir, path)
+
+    def test_spool(self):
+        self.assertEqual([], spspool.entries(self.spooldir))
+
+        paths = [self.spool(1000 + idx * 100, 10) for idx in range(5)]
+        self.assertEqual(os.path.join(self.spooldir, '1000.000000.json'),
+                         paths[0])
+        with open(os.path.join(self.spooldir, 'something-else'),
+                  mode='w') as f:
+            f.write('x' * 1000)
+        self.assertEqual([(1000.0 + idx * 100, paths[idx])
+                          for idx in range(5)],
+                         spspool.entries(self.spooldir))
+
+        # No limits at all
+        self.assertEqual([], spspool.evict(self.spooldir, 0, 0, now=10000))
+
+        # Too old
+        self.assertEqual(paths[:2],
+                         spspool.evict(self.spooldir, 0, 250, now=1400))
+        self.assertEqual(paths[2:], [path for (_, path)
+                                     in spspool.entries(self.spooldir)])
+
+        # Too big
+        self.assertEqual(paths[2:3],
+                         spspool.evict(self.spooldir, 25, 0, now=1400))
+        self.assertEqual(paths[3:], [path for (_, path)
+                                     in spspool.entries(self.spooldir)])
+
+        spspool.remove(paths[3:4])
+        spspool.remove(paths[3:4])
+        self.assertEqual([(1400.0, paths[4])],
+                         spspool.entries(self.spooldir))
+
+        os.unlink(os.path.join(self.spooldir, 'something-else'))
+        spspool.clear(self.spooldir)
+        self.assertFalse(os.path.exists(self.spooldir))
+        spspool.clear(self.spooldir)
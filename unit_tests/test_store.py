@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory content-addressed store.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+import mock
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import delta as spdelta
+from spinventory import store as spstore
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        super(TestStore, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.storedir = os.path.join(self.tempdir.name, 'store')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestStore, self).tearDown()
+
+    def count_objects(self):
+        objdir = os.path.join(self.storedir, 'objects')
+        return sum(len(os.listdir(os.path.join(objdir, sub)))
+                   for sub in os.listdir(objdir))
+
+    def test_atomic_write(self):
+        path = os.path.join(self.tempdir.name, 'data.json')
+        spstore.atomic_write(path, b'old')
+        spstore.atomic_write(path, b'new')
+        with open(path, mode='rb') as f:
+            self.assertEqual(b'new', f.read())
+
+        # A failed write leaves the old contents and no temporary file
+        with mock.patch('os.fsync', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                spstore.atomic_write(path, b'torn')
+        with open(path, mode='rb') as f:
+            self.assertEqual(b'new', f.read())
+        self.assertEqual(['data.json'], os.listdir(self.tempdir.name))
+
+    def test_snapshots(self):
+        self.assertIsNone(spstore.latest_manifest(self.storedir))
+
+        first = {'lspci.txt': 'pci', 'lsblk.txt': 'sda', '_meta': {'a': 1}}
+        (manifest, written) = spstore.put_snapshot(self.storedir, first,
+                                                   timestamp=1000)
+        self.assertEqual(3, written)
+        self.assertEqual(spdelta.build_manifest(first), manifest)
+
+        # Only the changed section is written
+        second = dict(first)
+        second['lsblk.txt'] = 'sda sdb'
+        (manifest, written) = spstore.put_snapshot(self.storedir, second,
+                                                   timestamp=2000)
+        self.assertEqual(1, written)
+        self.assertEqual(manifest, spstore.latest_manifest(self.storedir))
+        self.assertEqual(second,
+                         spstore.load_sections(self.storedir, manifest))
+        self.assertEqual({'lsblk.txt': 'sda sdb'},
+                         spstore.load_sections(self.storedir, manifest,
+                                               ['lsblk.txt']))
+        self.assertEqual([1000.0, 2000.0],
+                         [ts for (ts, _) in spstore.snapshots(self.storedir)])
+        self.assertEqual(4, self.count_objects())
+
+        spstore.put_snapshot(self.storedir, first, timestamp=3000)
+        self.assertEqual((0, 0), spstore.gc(self.storedir, 3))
+        self.assertEqual((1, 0), spstore.gc(self.storedir, 2))
+        self.assertEqual((1, 1), spstore.gc(self.storedir, 0))
+        self.assertEqual([3000.0],
+                         [ts for (ts, _) in spstore.snapshots(self.storedir)])
+        self.assertEqual(3, self.count_objects())
+        self.assertEqual(first, spstore.load_sections(
+            self.storedir, spstore.latest_manifest(self.storedir)))
+
+        spstore.forget(self.storedir)
+        self.assertFalse(os.path.exists(self.storedir))
+        spstore.forget(self.storedir)
@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the storpool-inventory submission routines.
+"""
+
+import functools
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from http import server as http_server
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spinventory import cbor as spcbor
+from spinventory import submit as spsubmit
+
+
+class RecordingHandler(http_server.BaseHTTPRequestHandler):
+    """
+    Store the headers and the body of each POST request.
+    """
+    requests = []
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.requests.append((dict(self.headers.items()),
+                              self.rfile.read(length)))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class NegotiatingHandler(RecordingHandler):
+    """
+    Reject CBOR documents unless told to accept them.
+    """
+    accept_cbor = False
+
+    def do_POST(self):
+        if self.headers['Content-Type'] == spsubmit.CONTENT_CBOR and \
+           not self.accept_cbor:
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.requests.append((dict(self.headers.items()), None))
+            self.send_response(415)
+            self.send_header('Accept', spsubmit.CONTENT_JSON)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        super(NegotiatingHandler, self).do_POST()
+
+
+class ConditionalHandler(http_server.BaseHTTPRequestHandler):
+    """
+    Respond to HEAD requests with 304 if the entity tag matches.
+    """
+    etag = None
+    requests = []
+
+    def do_HEAD(self):
+        self.requests.append((self.path, self.headers['If-None-Match']))
+        if self.headers['If-None-Match'] == self.etag:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSubmit(unittest.TestCase):
+    def setUp(self):
+        super(TestSubmit, self).setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.datafile = os.path.join(self.tempdir.name, 'collect.json')
+        self.collected = {
+            'lspci.txt': 'x' * (3 * spsubmit.CHUNK_SIZE),
+            'lsblk.txt': 'sda é',
+        }
+        with open(self.datafile, mode='w', encoding='latin1') as f:
+            print(json.dumps(self.collected), file=f)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super(TestSubmit, self).tearDown()
+
+    def test_legacy(self):
+        """
+        The legacy format double-encodes the collected data.
+        """
+        data = json.loads(spsubmit.legacy_body('node', self.datafile)
+                          .decode('latin1'))
+        self.assertEqual('node', data['filename'])
+        self.assertEqual(self.collected, json.loads(data['contents']))
+
+    def test_full_chunks(self):
+        """
+        The full format embeds the collected data as an object.
+        """
+        chunks = list(spsubmit.full_chunks('node', self.datafile))
+        self.assertGreater(len(chunks), 3)
+        data = json.loads(b''.join(chunks).decode('latin1'))
+        self.assertEqual({
+            'format': 'full',
+            'filename': 'node',
+            'collected': self.collected,
+        }, data)
+
+    def test_batch_chunks(self):
+        """
+        The batch format embeds several snapshots.
+        """
+        older = os.path.join(self.tempdir.name, 'older.json')
+        with open(older, mode='w') as f:
+            print(json.dumps({'lsblk.txt': 'sda'}), file=f)
+        chunks = list(spsubmit.batch_chunks('node', [
+            (1000.5, older),
+            (2000, self.datafile),
+        ]))
+        data = json.loads(b''.join(chunks).decode('latin1'))
+        self.assertEqual({
+            'format': 'batch',
+            'filename': 'node',
+            'snapshots': [
+                {'timestamp': 1000.5, 'collected': {'lsblk.txt': 'sda'}},
+                {'timestamp': 2000, 'collected': self.collected},
+            ],
+        }, data)
+
+    def test_multi_chunks(self):
+        """
+        The multi format embeds the data of several nodes.
+        """
+        chunks = list(spsubmit.multi_chunks([
+            ('node', spsubmit.file_chunks(self.datafile)),
+            ('other', [b'{"lsblk.txt": ', b'"sdb"}']),
+        ]))
+        data = json.loads(b''.join(chunks).decode('latin1'))
+        self.assertEqual({
+            'format': 'multi',
+            'nodes': [
+                {'filename': 'node', 'collected': self.collected},
+                {'filename': 'other', 'collected': {'lsblk.txt': 'sdb'}},
+            ],
+        }, data)
+
+    def test_post_compressed(self):
+        """
+        Stream a gzip-compressed document to a local HTTP server.
+        """
+        RecordingHandler.requests = []
+        srv = http_server.HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        thr = threading.Thread(target=srv.handle_request)
+        thr.start()
+        try:
+            url = 'http://127.0.0.1:{port}/'.format(port=srv.server_port)
+            (code, length, encoding) = spsubmit.post_compressed(
+                url, spsubmit.full_chunks('node', self.datafile), 'gzip')
+        finally:
+            thr.join()
+            srv.server_close()
+
+        self.assertEqual(201, code)
+        self.assertEqual('gzip', encoding)
+        self.assertEqual(1, len(RecordingHandler.requests))
+        (headers, body) = RecordingHandler.requests[0]
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual('application/json', headers['Content-Type'])
+        self.assertEqual(length, len(body))
+        self.assertLess(length, spsubmit.CHUNK_SIZE)
+        data = json.loads(gzip.decompress(body).decode('latin1'))
+        self.assertEqual(self.collected, data['collected'])
+
+    def test_zstd_fallback(self):
+        """
+        Fall back to gzip if the zstandard module is not available.
+        """
+        (body, length, encoding) = spsubmit.compress_chunks(
+            [b'{}'], 'gzip' if spsubmit.zstandard is None else 'zstd')
+        with body:
+            if spsubmit.zstandard is None:
+                self.assertEqual('gzip', encoding)
+                self.assertEqual(b'{}', gzip.decompress(body.read()))
+            else:
+                self.assertEqual('zstd', encoding)
+                self.assertEqual(length, len(body.read()))
+        self.assertRaises(ValueError, spsubmit.compress_chunks,
+                          [b'{}'], 'brotli')
+
+    def test_binary(self):
+        """
+        The CBOR documents contain the sections as raw bytes.
+        """
+        raw = dict((name, value.encode('latin1'))
+                   for (name, value) in self.collected.items())
+        (chunk,) = spsubmit.snapshot_chunks('node', self.datafile, 'legacy',
+                                            spsubmit.CONTENT_CBOR)
+        self.assertEqual({
+            'format': 'full',
+            'filename': 'node',
+            'collected': raw,
+        }, spcbor.loads(chunk))
+        self.assertEqual(
+            spsubmit.legacy_body('node', self.datafile),
+            b''.join(spsubmit.snapshot_chunks('node', self.datafile,
+                                              'legacy')))
+
+        delta = {'format': 'delta', 'sections': dict(self.collected),
+                 'removed': ['lscpu.txt']}
+        (chunk,) = spsubmit.delta_chunks(delta, spsubmit.CONTENT_CBOR)
+        self.assertEqual(dict(delta, sections=raw), spcbor.loads(chunk))
+        (chunk,) = spsubmit.delta_chunks(delta)
+        self.assertEqual(delta, json.loads(chunk.decode('latin1')))
+
+    def test_negotiated(self):
+        """
+        Fall back to JSON if the server does not accept CBOR documents.
+        """
+        cachefile = os.path.join(self.tempdir.name, 'content-type.json')
+        build = functools.partial(spsubmit.snapshot_chunks, 'node',
+                                  self.datafile, 'gzip')
+        NegotiatingHandler.requests = []
+        srv = http_server.HTTPServer(('127.0.0.1', 0), NegotiatingHandler)
+        url = 'http://127.0.0.1:{port}/'.format(port=srv.server_port)
+
+        def submit(accept_cbor, count):
+            NegotiatingHandler.accept_cbor = accept_cbor
+            thr = threading.Thread(
+                target=lambda: [srv.handle_request() for _ in range(count)])
+            thr.start()
+            try:
+                return spsubmit.post_negotiated(url, build, 'gzip',
+                                                cachefile)
+            finally:
+                thr.join()
+
+        try:
+            # Rejected, then sent as JSON
+            (code, _, encoding, ctype) = submit(False, 2)
+            self.assertEqual((201, 'gzip', spsubmit.CONTENT_JSON),
+                             (code, encoding, ctype))
+            self.assertEqual([spsubmit.CONTENT_CBOR, spsubmit.CONTENT_JSON],
+                             [headers['Content-Type'] for (headers, _)
+                              in NegotiatingHandler.requests])
+            self.assertEqual(spsubmit.CONTENT_JSON,
+                             spsubmit.load_negotiated(cachefile, url))
+
+            # Not even trying again
+            (code, _, _, ctype) = submit(True, 1)
+            self.assertEqual((201, spsubmit.CONTENT_JSON), (code, ctype))
+            self.assertEqual(3, len(NegotiatingHandler.requests))
+
+            # A different server that accepts CBOR
+            spsubmit.forget_negotiated(cachefile)
+            (code, length, _, ctype) = submit(True, 1)
+            self.assertEqual((201, spsubmit.CONTENT_CBOR), (code, ctype))
+            self.assertEqual(spsubmit.CONTENT_CBOR,
+                             spsubmit.load_negotiated(cachefile, url))
+            (headers, body) = NegotiatingHandler.requests[-1]
+            self.assertEqual(length, len(body))
+            data = spcbor.loads(gzip.decompress(body))
+            self.assertEqual(b'sda \xe9', data['collected']['lsblk.txt'])
+        finally:
+            srv.server_close()
+        self.assertIsNone(spsubmit.load_negotiated(cachefile, 'http://x/'))
+
+    def test_server_has(self):
+        """
+        Ask the server whether it has the data with a fingerprint.
+        """
+        ConditionalHandler.etag = '"abc"'
+        ConditionalHandler.requests = []
+        srv = http_server.HTTPServer(('127.0.0.1', 0), ConditionalHandler)
+        thr = threading.Thread(
+            target=lambda: [srv.handle_request() for _ in range(2)])
+        thr.start()
+        try:
+            url = 'http://127.0.0.1:{port}/submit?v=1'.format(
+                port=srv.server_port)
+            self.assertTrue(spsubmit.server_has(url, 'node', 'abc'))
+            self.assertFalse(spsubmit.server_has(url, 'node', 'def'))
+        finally:
+            thr.join()
+            srv.server_close()
+        self.assertEqual([
+            ('/submit?v=1&filename=node', '"abc"'),
+            ('/submit?v=1&filename=node', '"def"'),
+        ], ConditionalHandler.requests)